@@ -0,0 +1,90 @@
+"""
+Faux guacd local pour tester la passerelle RDP sans machine Windows ni guacd installé.
+
+Répond à la poignée de main Guacamole (select/args/connect/ready) puis envoie des images
+synthétiques (instructions img/blob/end/sync) à la cadence demandée; les instructions du
+navigateur sont lues et ignorées. S'utilise comme commande de passerelle du proxy:
+
+    RDP_BACKEND_COMMAND="python -m src.benchmarks.fake_guacd --port {port}"
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+
+from src.services.freerdp_service import GuacamoleParser, encode_instruction
+
+ARGS = ("VERSION_1_5_0", "hostname", "port", "username", "password", "domain",
+        "width", "height", "dpi", "ignore-cert", "security")
+
+
+async def _send_frames(writer: asyncio.StreamWriter, frame_size: int, fps: float):
+    payload = base64.b64encode(os.urandom(frame_size)).decode()
+    stream = 0
+    while True:
+        writer.write("".join([
+            encode_instruction("img", stream, 14, 0, "image/png", 0, 0),
+            encode_instruction("blob", stream, payload),
+            encode_instruction("end", stream),
+            encode_instruction("sync", int(time.time() * 1000)),
+        ]).encode())
+        await writer.drain()
+        stream = (stream + 1) % 16
+        await asyncio.sleep(1 / fps)
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, frame_size: int, fps: float):
+    parser = GuacamoleParser()
+    sender = None
+    try:
+        select = await parser.read_instruction(reader)
+        if select[:2] != ["select", "rdp"]:
+            writer.write(encode_instruction("error", "Unsupported protocol", 768).encode())
+            return
+        writer.write(encode_instruction("args", *ARGS).encode())
+        await writer.drain()
+
+        # size, audio, video et image précèdent connect
+        instruction = await parser.read_instruction(reader)
+        while instruction[0] != "connect":
+            instruction = await parser.read_instruction(reader)
+        values = dict(zip(ARGS, instruction[1:]))
+        writer.write("".join([
+            encode_instruction("ready", f"$fake-{values.get('hostname')}"),
+            encode_instruction("size", 0, values.get("width", 1024), values.get("height", 768)),
+        ]).encode())
+        await writer.drain()
+
+        sender = asyncio.create_task(_send_frames(writer, frame_size, fps))
+        while await reader.read(64 * 1024):
+            pass
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        if sender:
+            sender.cancel()
+        writer.close()
+
+
+async def serve(host: str, port: int, frame_size: int, fps: float, startup_delay: float = 0.0):
+    # Simule le temps de démarrage d'un vrai guacd (chargement des bibliothèques FreeRDP)
+    await asyncio.sleep(startup_delay)
+    server = await asyncio.start_server(lambda r, w: _handle(r, w, frame_size, fps), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake guacd speaking the Guacamole handshake")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--frame-size", type=int, default=32 * 1024, help="bytes of image data per frame")
+    parser.add_argument("--fps", type=float, default=20, help="frames per second")
+    parser.add_argument("--startup-delay", type=float, default=0.0, help="seconds before listening")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.frame_size, args.fps, args.startup_delay))
+
+
+if __name__ == "__main__":
+    main()
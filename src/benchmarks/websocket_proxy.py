@@ -0,0 +1,248 @@
+"""
+Benchmark hors ligne du proxy WebSocket VNC (src/services/websocket_proxy.py).
+
+Démarre websocket_app dans le processus face à un faux serveur RFB local (poignée de main
+de version RFB puis écho TCP), ouvre N clients WebSocket concurrents et mesure le débit,
+la latence aller-retour (p50/p99), le retard de la boucle d'événements et la mémoire par
+connexion. Aucun accès réseau ni base de données n'est nécessaire.
+
+Usage:
+    python -m src.benchmarks.websocket_proxy --clients 100 --frame-size 65536 --duration 10
+    python -m src.benchmarks.websocket_proxy --clients 200 --json > baseline.json
+    python -m src.benchmarks.websocket_proxy --clients 200 --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+import psutil
+import uvicorn
+import websockets
+
+from src.services import websocket_proxy
+
+RFB_VERSION = b"RFB 003.008\n"
+
+
+class FakeRFBServer:
+    """Serveur TCP local: envoie la version RFB, lit celle du client puis renvoie tout en écho"""
+
+    def __init__(self):
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            writer.write(RFB_VERSION)
+            await writer.drain()
+            await reader.readexactly(len(RFB_VERSION))
+            while True:
+                data = await reader.read(256 * 1024)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class LoopLagMonitor:
+    """Mesure le retard de réveil d'une tâche qui dort interval secondes"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _start_proxy(rfb_port: int):
+    """Démarrer websocket_app sur un port libre, les machines pointant vers le faux serveur RFB"""
+    websocket_proxy.proxy.resolver.set_endpoint(1, 1, "127.0.0.1", vnc_port=rfb_port)
+    config = uvicorn.Config(websocket_proxy.websocket_app, host="127.0.0.1", port=0,
+                            log_level="warning", lifespan="off", ws_max_size=64 * 1024 * 1024)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, port
+
+
+async def _open_client(url: str):
+    ws = await websockets.connect(url, max_size=None, subprotocols=["binary"], compression=None)
+    banner = await ws.recv()
+    if banner != RFB_VERSION:
+        raise RuntimeError(f"Unexpected RFB banner: {banner!r}")
+    await ws.send(RFB_VERSION)
+    return ws
+
+
+async def _drive_client(ws, frame_size: int, deadline: float, latencies: List[float]) -> int:
+    """Aller-retours successifs d'une trame de frame_size octets jusqu'à deadline"""
+    payload = os.urandom(frame_size)
+    transferred = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await ws.send(payload)
+        received = 0
+        while received < frame_size:
+            received += len(await ws.recv())
+        latencies.append(time.perf_counter() - start)
+        transferred += frame_size + received
+    return transferred
+
+
+async def run_benchmark(clients: int = 50, frame_size: int = 16 * 1024, duration: float = 5.0,
+                        connect_batch: int = 50) -> Dict[str, Any]:
+    logging.getLogger("src.services.websocket_proxy").setLevel(logging.WARNING)
+    process = psutil.Process()
+
+    rfb = FakeRFBServer()
+    await rfb.start()
+    server, server_task, port = await _start_proxy(rfb.port)
+    url = f"ws://127.0.0.1:{port}/vnc/1/1"
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    try:
+        rss_before = process.memory_info().rss
+        connections = []
+        for start in range(0, clients, connect_batch):
+            batch = min(connect_batch, clients - start)
+            connections += await asyncio.gather(*[_open_client(url) for _ in range(batch)])
+        rss_connected = process.memory_info().rss
+
+        latencies: List[float] = []
+        started = time.perf_counter()
+        deadline = started + duration
+        transferred = await asyncio.gather(*[
+            _drive_client(ws, frame_size, deadline, latencies) for ws in connections
+        ])
+        elapsed = time.perf_counter() - started
+        rss_peak = process.memory_info().rss
+
+        await asyncio.gather(*[ws.close() for ws in connections], return_exceptions=True)
+    finally:
+        await monitor.stop()
+        server.should_exit = True
+        await server_task
+        await rfb.stop()
+
+    total_bytes = sum(transferred)
+    return {
+        "clients": clients,
+        "frame_size": frame_size,
+        "duration": round(elapsed, 3),
+        "round_trips": len(latencies),
+        "throughput_mb_s": round(total_bytes / elapsed / 1e6, 2),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+            "mean": round(statistics.mean(latencies) * 1000, 3) if latencies else 0.0,
+        },
+        "loop_lag_ms": {
+            "p50": round(_percentile(monitor.samples, 50) * 1000, 3),
+            "p99": round(_percentile(monitor.samples, 99) * 1000, 3),
+            "max": round(max(monitor.samples, default=0.0) * 1000, 3),
+        },
+        "memory": {
+            "rss_before_mb": round(rss_before / 1e6, 1),
+            "rss_peak_mb": round(rss_peak / 1e6, 1),
+            # Client, proxy and fake server live in the same process: this is an upper bound
+            "per_connection_kb": round((rss_connected - rss_before) / max(clients, 1) / 1024, 1),
+            "per_connection_under_load_kb": round((rss_peak - rss_before) / max(clients, 1) / 1024, 1),
+        },
+    }
+
+
+def _print_report(result: Dict[str, Any]):
+    print(f"clients:            {result['clients']}")
+    print(f"frame size:         {result['frame_size']} bytes")
+    print(f"duration:           {result['duration']} s ({result['round_trips']} round trips)")
+    print(f"throughput:         {result['throughput_mb_s']} MB/s")
+    print(f"latency p50/p99:    {result['latency_ms']['p50']} / {result['latency_ms']['p99']} ms")
+    print(f"loop lag p50/p99:   {result['loop_lag_ms']['p50']} / {result['loop_lag_ms']['p99']} ms "
+          f"(max {result['loop_lag_ms']['max']} ms)")
+    print(f"memory/connection:  {result['memory']['per_connection_kb']} KB idle, "
+          f"{result['memory']['per_connection_under_load_kb']} KB under load")
+
+
+def compare_to_baseline(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Régressions par rapport à un résultat précédent (débit plus bas, latence ou lag plus hauts)"""
+    regressions = []
+    if result["throughput_mb_s"] < baseline["throughput_mb_s"] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput_mb_s']} MB/s < baseline {baseline['throughput_mb_s']} MB/s")
+    for metric in ("latency_ms", "loop_lag_ms"):
+        if result[metric]["p99"] > baseline[metric]["p99"] * (1 + tolerance):
+            regressions.append(f"{metric} p99 {result[metric]['p99']} > baseline {baseline[metric]['p99']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the VNC WebSocket proxy")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent WebSocket clients")
+    parser.add_argument("--frame-size", type=int, default=16 * 1024, help="bytes per WebSocket frame")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of traffic")
+    parser.add_argument("--connect-batch", type=int, default=50, help="clients connected at once")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--baseline", help="JSON result to compare with; exits with status 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args.clients, args.frame_size, args.duration, args.connect_batch))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        _print_report(result)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,16 @@
 import os
 import sys
 from flask import Flask, send_from_directory
-from src.models.lab import db, Lab, Machine, Snapshot, CustomPlaybook, DeploymentLog # Import all models
+from src.models.lab import db, DATABASE_URL, Lab, Machine, Snapshot, CustomPlaybook, DeploymentLog, DeploymentLogChunk, DeploymentPlan, MachineEndpointEvent # Import all models
 from src.models.remote_connection import RemoteConnection # Import new model
 from src.routes.labs import labs_bp
+from src.routes.jobs import jobs_bp
 from src.routes.remote_access import remote_access_bp
 from src.routes.ssl_management import ssl_bp
 from src.routes.performance import performance_bp
+from src.routes.metrics import metrics_bp
 from src.middleware.performance_middleware import PerformanceMiddleware
-from src.services.websocket_proxy import websocket_app
+from src.services.websocket_proxy import run_websocket_server_thread
 from flask_cors import CORS
 import logging
 
@@ -25,7 +27,7 @@ app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'sta
 CORS(app) # Enable CORS for all routes
 
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "super-secret-key")
-app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}")
+app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db.init_app(app)
@@ -35,9 +37,11 @@ performance_middleware = PerformanceMiddleware(app)
 
 # Register blueprints
 app.register_blueprint(labs_bp, url_prefix="/api")
+app.register_blueprint(jobs_bp, url_prefix="/api")
 app.register_blueprint(remote_access_bp, url_prefix="/api")
-app.register_blueprint(ssl_bp, url_prefix="/api")
-app.register_blueprint(performance_bp, url_prefix="/api")
+app.register_blueprint(ssl_bp) # url_prefix /api/ssl défini par le blueprint
+app.register_blueprint(performance_bp) # url_prefix /api/performance défini par le blueprint
+app.register_blueprint(metrics_bp) # /metrics (format texte Prometheus)
 
 with app.app_context():
     db.create_all() # Create all tables based on models
@@ -54,18 +58,11 @@ def serve_static(path):
         return send_from_directory(app.static_folder, "index.html")
 
 if __name__ == "__main__":
-
+    # Le proxy WebSocket tourne normalement comme service séparé (src/proxy_main.py);
+    # WS_PROXY_EMBEDDED=True le lance dans ce processus pour le développement
+    debug = os.getenv("FLASK_DEBUG", "True") == "True"
+    # Avec le reloader, seul le processus enfant (WERKZEUG_RUN_MAIN) démarre le proxy
+    if os.getenv("WS_PROXY_EMBEDDED", "False") == "True" and (not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true"):
+        run_websocket_server_thread(host=os.getenv("WS_PROXY_HOST", "0.0.0.0"), port=int(os.getenv("WS_PROXY_PORT", 8765)))
     
-    app.run(host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 5000)), debug=os.getenv("FLASK_DEBUG", "True") == "True")
-
-
-
-
-# Start WebSocket server using uvicorn in a separate thread
-@app.before_first_request
-def start_websocket_server():
-    websocket_thread = threading.Thread(target=uvicorn.run, args=(websocket_app, ), kwargs={"host": "0.0.0.0", "port": 8765, "log_level": "info"}, daemon=True)
-    websocket_thread.start()
-    logger.info("Uvicorn WebSocket server started successfully in a separate thread.")
-
-
+    app.run(host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 5000)), debug=debug)
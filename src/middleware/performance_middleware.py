@@ -1,11 +1,52 @@
+import gzip
+import hashlib
+import os
 import time
 import logging
 from functools import wraps
-from flask import request, g
+from typing import NamedTuple, Optional, Tuple
+from flask import request, g, Response
 from src.services.performance_optimizer import performance_optimizer
+from src.services.metrics_registry import metrics_registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 logger = logging.getLogger(__name__)
 
+# Pré-compression des réponses mises en cache (gzip, et brotli si le paquet est installé)
+RESPONSE_CACHE_COMPRESS = os.getenv("RESPONSE_CACHE_COMPRESS", "True") == "True"
+RESPONSE_CACHE_COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_CACHE_COMPRESS_MIN_SIZE", 1024))
+
+# Métriques HTTP exposées sur /metrics (un label par endpoint Flask, pas par URL)
+HTTP_REQUESTS = metrics_registry.counter(
+    'labcreator_http_requests_total', 'HTTP requests handled', ('endpoint', 'method', 'status'))
+HTTP_LATENCY = metrics_registry.histogram(
+    'labcreator_http_request_duration_seconds', 'HTTP request latency in seconds', ('endpoint', 'method', 'status'))
+HTTP_IN_FLIGHT = metrics_registry.gauge(
+    'labcreator_http_requests_in_flight', 'HTTP requests currently being handled', ('endpoint',))
+
+# En-têtes propres à une réponse donnée, jamais rejoués depuis le cache
+_UNCACHED_HEADERS = {'content-length', 'content-encoding', 'etag', 'set-cookie', 'date', 'age',
+                     'x-response-time', 'x-cache-status', 'connection', 'transfer-encoding'}
+
+
+class CachedResponse(NamedTuple):
+    """Réponse figée: statut, en-têtes, corps et ses variantes compressées"""
+    status: int
+    headers: Tuple[Tuple[str, str], ...]
+    body: bytes
+    etag: str
+    gzip_body: Optional[bytes]
+    brotli_body: Optional[bytes]
+    created_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip_body or b'') + len(self.brotli_body or b'')
+
 class PerformanceMiddleware:
     """Middleware Flask pour le monitoring et l'optimisation des performances"""
     
@@ -29,14 +70,22 @@ class PerformanceMiddleware:
         """Exécuté avant chaque requête"""
         g.start_time = time.time()
         g.endpoint = request.endpoint or 'unknown'
+        g.cache_hit = False
+        HTTP_IN_FLIGHT.inc(g.endpoint)
+        g.in_flight = True
         
         # Vérifier le cache pour les requêtes GET
-        if request.method == 'GET':
+        if request.method == 'GET' and self._is_cacheable_endpoint(g.endpoint):
+            # Versions des tags relevées avant d'exécuter la vue: un commit concurrent
+            # rendra périmée la réponse calculée pendant cette requête
+            g.cache_tags = performance_optimizer.cache.tag_versions(
+                self._get_cache_tags(g.endpoint, request.view_args or {}))
             cache_key = self._generate_cache_key(request)
-            cached_response = performance_optimizer.get_cache(cache_key)
-            if cached_response:
+            cached = performance_optimizer.get_cache(cache_key)
+            if isinstance(cached, CachedResponse):
                 logger.debug(f"Cache hit pour {cache_key}")
-                return cached_response
+                g.cache_hit = True
+                return self._serve_cached(cached)
     
     def after_request(self, response):
         """Exécuté après chaque requête"""
@@ -45,20 +94,31 @@ class PerformanceMiddleware:
             
             # Enregistrer le temps de réponse
             performance_optimizer.record_response_time(g.endpoint, response_time)
+            status = str(response.status_code)
+            HTTP_REQUESTS.inc(g.endpoint, request.method, status)
+            HTTP_LATENCY.observe(response_time, g.endpoint, request.method, status)
             
             # Mettre en cache les réponses GET réussies
-            if (request.method == 'GET' and 
+            if (not g.get('cache_hit') and
+                request.method == 'GET' and 
                 response.status_code == 200 and 
-                self._is_cacheable_endpoint(g.endpoint)):
+                self._is_cacheable_endpoint(g.endpoint) and
+                self._is_storable(response)):
                 
                 cache_key = self._generate_cache_key(request)
                 cache_ttl = self._get_cache_ttl(g.endpoint)
-                performance_optimizer.set_cache(cache_key, response, cache_ttl)
+                cached = self._freeze(response)
+                performance_optimizer.cache.set(cache_key, cached, cache_ttl, size=cached.size,
+                                                tags=g.get('cache_tags', ()))
                 logger.debug(f"Réponse mise en cache: {cache_key}")
+                
+                # Le client peut déjà détenir cette version
+                response.set_etag(cached.etag)
+                response = response.make_conditional(request)
             
             # Ajouter des headers de performance
             response.headers['X-Response-Time'] = f"{response_time:.3f}s"
-            response.headers['X-Cache-Status'] = 'MISS'  # Sera 'HIT' si depuis le cache
+            response.headers['X-Cache-Status'] = 'HIT' if g.get('cache_hit') else 'MISS'
             
             # Log des requêtes lentes
             if response_time > 2.0:
@@ -66,10 +126,68 @@ class PerformanceMiddleware:
         
         return response
     
+    def _is_storable(self, response):
+        """Une réponse en flux, posant un cookie ou marquée no-store n'est pas mise en cache"""
+        return not (response.is_streamed or
+                    response.direct_passthrough or
+                    'Set-Cookie' in response.headers or
+                    response.cache_control.no_store or
+                    response.cache_control.private)
+    
+    def _freeze(self, response):
+        """Copie immuable de la réponse, avec son ETag et ses variantes pré-compressées"""
+        body = response.get_data()
+        headers = tuple((k, v) for k, v in response.headers.items() if k.lower() not in _UNCACHED_HEADERS)
+        gzip_body = brotli_body = None
+        if (RESPONSE_CACHE_COMPRESS and
+                len(body) >= RESPONSE_CACHE_COMPRESS_MIN_SIZE and
+                'Content-Encoding' not in response.headers):
+            gzip_body = gzip.compress(body, 6)
+            if brotli is not None:
+                brotli_body = brotli.compress(body, quality=5)
+        return CachedResponse(
+            status=response.status_code,
+            headers=headers,
+            body=body,
+            etag=hashlib.blake2b(body, digest_size=16).hexdigest(),
+            gzip_body=gzip_body,
+            brotli_body=brotli_body,
+            created_at=time.time()
+        )
+    
+    def _serve_cached(self, cached):
+        """Construit la réponse d'un hit: 304 si le client a déjà cet ETag, sinon le corps adapté à Accept-Encoding"""
+        age = str(int(time.time() - cached.created_at))
+        if request.if_none_match.contains_weak(cached.etag):
+            response = Response(status=304, headers=[(k, v) for k, v in cached.headers
+                                                     if k.lower() in ('cache-control', 'vary', 'expires')])
+            response.set_etag(cached.etag)
+            response.headers['Age'] = age
+            return response
+        
+        accepted = request.accept_encodings
+        if cached.brotli_body is not None and accepted['br']:
+            body, encoding = cached.brotli_body, 'br'
+        elif cached.gzip_body is not None and accepted['gzip']:
+            body, encoding = cached.gzip_body, 'gzip'
+        else:
+            body, encoding = cached.body, None
+        
+        response = Response(body, status=cached.status, headers=list(cached.headers))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if cached.gzip_body is not None:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(cached.etag)
+        response.headers['Age'] = age
+        return response
+    
     def teardown_request(self, exception):
         """Exécuté à la fin de chaque requête"""
+        if g.pop('in_flight', False):
+            HTTP_IN_FLIGHT.dec(g.endpoint)
         if exception:
-            logger.error(f"Exception dans la requête {g.endpoint}: {exception}")
+            logger.error(f"Exception dans la requête {g.get('endpoint', 'unknown')}: {exception}")
     
     def _generate_cache_key(self, request):
         """Génère une clé de cache pour la requête"""
@@ -86,20 +204,31 @@ class PerformanceMiddleware:
         """Détermine si un endpoint peut être mis en cache"""
         # Endpoints qui peuvent être mis en cache (lecture seule)
         cacheable_endpoints = [
-            'labs.get_labs',
-            'labs.get_lab',
+            'labs_bp.get_labs',
+            'labs_bp.get_lab',
             'ssl.get_ssl_status',
             'ssl.get_certificates',
             'remote_access.get_connection_info'
         ]
         return endpoint in cacheable_endpoints
     
+    def _get_cache_tags(self, endpoint, view_args):
+        """Tags invalidés par les commits des objets dont dépend la réponse"""
+        if endpoint == 'labs_bp.get_labs':
+            return ('labs:list',)
+        if endpoint == 'labs_bp.get_lab':
+            return (f"lab:{view_args.get('lab_id')}",)
+        if endpoint == 'remote_access.get_connection_info':
+            return (f"machine:{view_args.get('machine_id')}",)
+        return ()
+    
     def _get_cache_ttl(self, endpoint):
         """Détermine le TTL du cache pour un endpoint"""
         # TTL personnalisés par endpoint
+        # (les labs sont invalidés par tags à chaque commit, le TTL n'est qu'un filet de sécurité)
         ttl_mapping = {
-            'labs.get_labs': 60,        # 1 minute
-            'labs.get_lab': 30,         # 30 secondes
+            'labs_bp.get_labs': 600,    # 10 minutes
+            'labs_bp.get_lab': 600,     # 10 minutes
             'ssl.get_ssl_status': 300,  # 5 minutes
             'ssl.get_certificates': 600, # 10 minutes
             'remote_access.get_connection_info': 10  # 10 secondes
@@ -1,9 +1,38 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, selectinload
 import json
+import os
+import zlib
 
 db = SQLAlchemy()
 
+# Base de l'application, partagée avec les processus hors Flask (proxy WebSocket)
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'app.db')}")
+
+@lru_cache(maxsize=4096)
+def _decode_json_cached(raw):
+    return json.loads(raw)
+
+def _copy_json(value):
+    # Copie des seuls conteneurs JSON, bien plus rapide que copy.deepcopy ou json.loads
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+def decode_json_column(raw, default):
+    """
+    Decode a JSON text column, caching by raw value (the raw text is the row version:
+    any update produces a new key). Each caller gets its own copy of the decoded value.
+    """
+    if not raw:
+        return default()
+    return _copy_json(_decode_json_cached(raw))
+
 class Lab(db.Model):
     __tablename__ = 'labs'
     
@@ -20,19 +49,42 @@ class Lab(db.Model):
     machines = db.relationship('Machine', backref='lab', lazy=True, cascade='all, delete-orphan')
     snapshots = db.relationship('Snapshot', backref='lab', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
+    FIELDS = ('id', 'name', 'description', 'provider', 'provider_config', 'status',
+              'created_at', 'updated_at', 'machines', 'snapshots')
+    
+    @classmethod
+    def load_options(cls, fields=None):
+        """Eager loading options for to_dict(fields): one SELECT ... IN per relation instead of one per lab"""
+        options = []
+        if not fields or 'machines' in fields:
+            options.append(selectinload(cls.machines))
+        if not fields or 'snapshots' in fields:
+            options.append(selectinload(cls.snapshots))
+        return options
+    
+    def to_dict(self, fields=None):
+        """Serialize the lab; fields restricts the output (machines/snapshots are only loaded if requested)"""
+        fields = set(fields) if fields else set(self.FIELDS)
+        data = {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'provider': self.provider,
-            'provider_config': json.loads(self.provider_config) if self.provider_config else {},
             'status': self.status,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat(),
-            'machines': [machine.to_dict() for machine in self.machines],
-            'snapshots': [snapshot.to_dict() for snapshot in self.snapshots]
+            'updated_at': self.updated_at.isoformat()
         }
+        if 'provider_config' in fields:
+            data['provider_config'] = decode_json_column(self.provider_config, dict)
+        if 'machines' in fields:
+            data['machines'] = [machine.to_dict() for machine in self.machines]
+        if 'snapshots' in fields:
+            data['snapshots'] = [snapshot.to_dict() for snapshot in self.snapshots]
+        return {key: value for key, value in data.items() if key in fields}
+    
+    def cache_tags(self):
+        """Tags des réponses en cache à invalider quand ce lab change"""
+        return {f'lab:{self.id}', 'labs:list'}
 
 class Machine(db.Model):
     __tablename__ = 'machines'
@@ -63,10 +115,14 @@ class Machine(db.Model):
             'ip_address': self.ip_address,
             'status': self.status,
             'role': self.role,
-            'software_config': json.loads(self.software_config) if self.software_config else [],
-            'custom_playbooks': json.loads(self.custom_playbooks) if self.custom_playbooks else [],
+            'software_config': decode_json_column(self.software_config, list),
+            'custom_playbooks': decode_json_column(self.custom_playbooks, list),
             'created_at': self.created_at.isoformat()
         }
+    
+    def cache_tags(self):
+        # Les machines sont incluses dans la représentation du lab et de la liste
+        return {f'machine:{self.id}', f'lab:{self.lab_id}', 'labs:list'}
 
 class Snapshot(db.Model):
     __tablename__ = 'snapshots'
@@ -84,9 +140,12 @@ class Snapshot(db.Model):
             'lab_id': self.lab_id,
             'name': self.name,
             'description': self.description,
-            'snapshot_data': json.loads(self.snapshot_data) if self.snapshot_data else {},
+            'snapshot_data': decode_json_column(self.snapshot_data, dict),
             'created_at': self.created_at.isoformat()
         }
+    
+    def cache_tags(self):
+        return {f'lab:{self.lab_id}', 'labs:list'}
 
 class CustomPlaybook(db.Model):
     __tablename__ = 'custom_playbooks'
@@ -116,19 +175,142 @@ class DeploymentLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     lab_id = db.Column(db.Integer, db.ForeignKey('labs.id'), nullable=False)
     operation = db.Column(db.String(50), nullable=False)  # deploy, destroy, start, stop
-    status = db.Column(db.String(20), nullable=False)  # running, success, error
-    logs = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False)  # running, success, error, cancelled
+    logs = db.Column(db.Text)  # Legacy: logs written before chunked storage
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
     
+    # Relations
+    chunks = db.relationship('DeploymentLogChunk', backref='log', lazy='dynamic', cascade='all, delete-orphan')
+    plan = db.relationship('DeploymentPlan', backref='log', uselist=False, lazy=True, cascade='all, delete-orphan')
+    
+    FIELDS = ('id', 'lab_id', 'operation', 'status', 'started_at', 'completed_at')
+    
     def to_dict(self):
+        """Metadata only: log content is read through the log store"""
         return {
             'id': self.id,
             'lab_id': self.lab_id,
             'operation': self.operation,
             'status': self.status,
-            'logs': self.logs,
             'started_at': self.started_at.isoformat(),
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
         }
 
+class DeploymentLogChunk(db.Model):
+    __tablename__ = 'deployment_log_chunks'
+    __table_args__ = (db.UniqueConstraint('log_id', 'seq', name='uq_deployment_log_chunks_log_seq'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    log_id = db.Column(db.Integer, db.ForeignKey('deployment_logs.id'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    offset = db.Column(db.Integer, nullable=False)  # Position (characters) of the chunk in the log
+    size = db.Column(db.Integer, nullable=False)  # Length (characters) of the chunk
+    data = db.Column(db.LargeBinary, nullable=False)  # UTF-8 text, zlib-compressed if compressed
+    compressed = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def text(self):
+        data = zlib.decompress(self.data) if self.compressed else self.data
+        return data.decode('utf-8')
+
+class DeploymentPlan(db.Model):
+    __tablename__ = 'deployment_plans'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    log_id = db.Column(db.Integer, db.ForeignKey('deployment_logs.id'), nullable=False, unique=True)
+    lab_id = db.Column(db.Integer, db.ForeignKey('labs.id'), nullable=False, index=True)
+    add = db.Column(db.Integer, default=0)
+    change = db.Column(db.Integer, default=0)
+    destroy = db.Column(db.Integer, default=0)
+    output_changes = db.Column(db.Integer, default=0)
+    resources = db.Column(db.Text)  # JSON list of {address, actions}
+    applied = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def empty(self):
+        return not (self.add or self.change or self.destroy or self.output_changes)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'log_id': self.log_id,
+            'lab_id': self.lab_id,
+            'add': self.add,
+            'change': self.change,
+            'destroy': self.destroy,
+            'output_changes': self.output_changes,
+            'empty': self.empty,
+            'resources': decode_json_column(self.resources, list),
+            'applied': self.applied,
+            'created_at': self.created_at.isoformat()
+        }
+
+class MachineEndpointEvent(db.Model):
+    """Changement d'adresse d'une machine, lu par le proxy WebSocket pour tenir son index à jour"""
+    __tablename__ = 'machine_endpoint_events'
+    # Ids jamais réutilisés, même une fois la table purgée: les lecteurs suivent le dernier id lu
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    machine_id = db.Column(db.Integer, nullable=False)
+    lab_id = db.Column(db.Integer, nullable=False)
+    ip_address = db.Column(db.String(15))  # None: machine supprimée ou sans adresse
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Fonctions appelées après commit avec les événements du processus courant (proxy intégré)
+machine_endpoint_listeners = []
+
+@event.listens_for(Session, "after_flush")
+def _record_machine_endpoint_events(session, flush_context):
+    """Journaliser dans la même transaction les changements d'adresse des machines (deploy_lab)"""
+    events = []
+    for machine in session.new | session.dirty:
+        if isinstance(machine, Machine) and inspect(machine).attrs.ip_address.history.has_changes():
+            events.append({'machine_id': machine.id, 'lab_id': machine.lab_id, 'ip_address': machine.ip_address})
+    for machine in session.deleted:
+        if isinstance(machine, Machine):
+            events.append({'machine_id': machine.id, 'lab_id': machine.lab_id, 'ip_address': None})
+    if events:
+        now = datetime.utcnow()
+        session.connection().execute(MachineEndpointEvent.__table__.insert(),
+                                     [{**e, 'created_at': now} for e in events])
+        session.info.setdefault('machine_endpoint_events', []).extend(events)
+
+@event.listens_for(Session, "after_commit")
+def _notify_machine_endpoint_listeners(session):
+    events = session.info.pop('machine_endpoint_events', None)
+    if events:
+        for listener in machine_endpoint_listeners:
+            listener(events)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_machine_endpoint_events(session):
+    session.info.pop('machine_endpoint_events', None)
+
+# Fonctions appelées après commit avec les tags de cache des objets modifiés (cache des réponses)
+cache_invalidation_listeners = []
+
+@event.listens_for(Session, "after_flush")
+def _collect_cache_tags(session, flush_context):
+    """Tags des objets écrits par ce flush (méthode cache_tags() des modèles), invalidés au commit"""
+    tags = set()
+    for obj in session.new | session.dirty | session.deleted:
+        cache_tags = getattr(obj, 'cache_tags', None)
+        if cache_tags is not None:
+            tags.update(cache_tags())
+    if tags:
+        session.info.setdefault('cache_tags', set()).update(tags)
+
+@event.listens_for(Session, "after_commit")
+def _notify_cache_invalidation_listeners(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        for listener in cache_invalidation_listeners:
+            listener(tags)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
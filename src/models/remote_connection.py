@@ -33,4 +33,8 @@ class RemoteConnection(db.Model):
             'created_at': self.created_at.isoformat(),
             'last_activity': self.last_activity.isoformat()
         }
+    
+    def cache_tags(self):
+        # Les connexions actives font partie des informations de connexion de la machine
+        return {f'machine:{self.machine_id}'}
 
@@ -0,0 +1,36 @@
+import os
+import logging
+import uvicorn
+from src.services.session_registry import create_registry
+from src.services.websocket_proxy import uvicorn_options
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    # Service proxy WebSocket (VNC/RDP) indépendant de Flask, multi-workers.
+    # Les workers partagent leurs sessions via WS_SESSION_REGISTRY (sqlite:///... ou redis://...)
+    host = os.getenv("WS_PROXY_HOST", "0.0.0.0")
+    port = int(os.getenv("WS_PROXY_PORT", 8765))
+    workers = int(os.getenv("WS_PROXY_WORKERS", os.cpu_count() or 1))
+    registry_url = os.getenv("WS_SESSION_REGISTRY", "memory://")
+    
+    if registry_url.startswith("memory://"):
+        # Processus séparé de Flask: un registre en mémoire ne serait vu ni par
+        # /api/performance/proxy/sessions ni par les demandes de fermeture (request_session_close)
+        logger.error("WS_SESSION_REGISTRY=memory:// ne peut pas être partagé avec l'application Flask: "
+                     "utilisez sqlite:///chemin.db ou redis://hôte:port/db pour le service séparé "
+                     "(ou WS_PROXY_EMBEDDED=True pour lancer le proxy dans le processus Flask)")
+        raise SystemExit(1)
+    # Vérifie la configuration du registre avant de lancer les workers
+    create_registry(registry_url)
+    
+    uvicorn.run(
+        "src.services.websocket_proxy:websocket_app",
+        host=host,
+        port=port,
+        workers=workers,
+        log_level=os.getenv("WS_PROXY_LOG_LEVEL", "info"),
+        **uvicorn_options()
+    )
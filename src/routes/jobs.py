@@ -0,0 +1,38 @@
+from flask import Blueprint, request, jsonify
+from src.services.job_queue import job_queue
+import logging
+
+logger = logging.getLogger(__name__)
+
+jobs_bp = Blueprint("jobs_bp", __name__)
+
+@jobs_bp.route("/jobs", methods=["GET"])
+def get_jobs():
+    """Liste les jobs, filtrables par status (queued, running, ...) et type"""
+    jobs = job_queue.list_jobs(
+        status=request.args.get("status"),
+        job_type=request.args.get("type")
+    )
+    return jsonify({
+        "jobs": [job.to_dict() for job in jobs],
+        "count": len(jobs),
+        "stats": job_queue.get_stats()
+    }), 200
+
+@jobs_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@jobs_bp.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = job_queue.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job.finished:
+        return jsonify({"error": f"Job already {job.status}", "job": job.to_dict()}), 409
+    
+    job = job_queue.cancel(job_id)
+    return jsonify({"message": "Cancellation requested", "job": job.to_dict()}), 202
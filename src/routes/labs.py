@@ -1,17 +1,26 @@
-from flask import Blueprint, request, jsonify
-from src.models.lab import db, Lab, Machine, CustomPlaybook, DeploymentLog
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from src.models.lab import db, Lab, Machine, CustomPlaybook, DeploymentLog, DeploymentPlan
 from src.services.terraform_service import TerraformService
 from src.services.ansible_service import AnsibleService
 from src.services.backup_service import BackupService
+from src.services.change_detector import LabChangeDetector
+from src.services.job_queue import job_queue, JobCancelled
+from src.services.log_store import log_store
+from sqlalchemy import func
+from sqlalchemy.orm import defer
+import base64
 import json
 from datetime import datetime
+from urllib.parse import urlencode
 import os
+import time
 
 labs_bp = Blueprint("labs_bp", __name__)
 
 terraform_service = TerraformService(workspace_dir=os.getenv("TERRAFORM_WORKSPACE_DIR", "/tmp/terraform_workspaces"))
 ansible_service = AnsibleService(workspace_dir=os.getenv("ANSIBLE_WORKSPACE_DIR", "/tmp/ansible_workspaces"))
 backup_service = BackupService(backup_dir=os.getenv("BACKUP_DIR", "/tmp/lab_backups"))
+change_detector = LabChangeDetector(terraform_service)
 
 @labs_bp.route("/labs", methods=["POST"])
 def create_lab():
@@ -44,14 +53,93 @@ def create_lab():
     db.session.commit()
     return jsonify(new_lab.to_dict()), 201
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+class ListingError(ValueError):
+    """Paramètre de listing invalide (renvoyé en 400)"""
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded.encode()))["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ListingError("Invalid cursor")
+
+def _parse_datetime_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ListingError(f"Invalid date for {name}: {value}")
+
+def _parse_fields_arg(allowed):
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(requested) - set(allowed)
+    if unknown:
+        raise ListingError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return set(requested) | {"id"}
+
+def _paginate(query, id_column, descending=False):
+    """
+    Pagination par curseur sur la clé primaire (limit, cursor).
+    Retourne les éléments de la page et le curseur de la page suivante (ou None).
+    """
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = min(max(1, limit), MAX_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    if cursor:
+        last_id = _decode_cursor(cursor)
+        query = query.filter(id_column < last_id if descending else id_column > last_id)
+    query = query.order_by(id_column.desc() if descending else id_column.asc())
+    items = query.limit(limit + 1).all()
+    next_cursor = _encode_cursor(items[limit - 1].id) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+def _page_response(payload, next_cursor):
+    """Réponse de liste; la page suivante est annoncée dans X-Next-Cursor et Link"""
+    response = jsonify(payload)
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response, 200
+
+@labs_bp.errorhandler(ListingError)
+def handle_listing_error(error):
+    return jsonify({"error": str(error)}), 400
+
 @labs_bp.route("/labs", methods=["GET"])
 def get_labs():
-    labs = Lab.query.all()
-    return jsonify([lab.to_dict() for lab in labs]), 200
+    """Liste des labs: filtres status, provider, created_after/created_before, fields=, limit/cursor"""
+    fields = _parse_fields_arg(Lab.FIELDS)
+    query = Lab.query.options(*Lab.load_options(fields))
+    if request.args.get("status"):
+        query = query.filter(Lab.status == request.args["status"])
+    if request.args.get("provider"):
+        query = query.filter(Lab.provider == request.args["provider"])
+    created_after = _parse_datetime_arg("created_after")
+    if created_after:
+        query = query.filter(Lab.created_at >= created_after)
+    created_before = _parse_datetime_arg("created_before")
+    if created_before:
+        query = query.filter(Lab.created_at < created_before)
+    
+    labs, next_cursor = _paginate(query, Lab.id)
+    return _page_response([lab.to_dict(fields) for lab in labs], next_cursor)
 
 @labs_bp.route("/labs/<int:lab_id>", methods=["GET"])
 def get_lab(lab_id):
-    lab = Lab.query.get_or_404(lab_id)
+    lab = Lab.query.options(*Lab.load_options()).filter_by(id=lab_id).first_or_404()
     return jsonify(lab.to_dict()), 200
 
 @labs_bp.route("/labs/<int:lab_id>", methods=["PUT"])
@@ -122,110 +210,246 @@ def delete_lab(lab_id):
 @labs_bp.route("/labs/<int:lab_id>/deploy", methods=["POST"])
 def deploy_lab(lab_id):
     lab = Lab.query.get_or_404(lab_id)
-    lab.status = "deploying"
-    db.session.commit()
+    data = request.get_json(silent=True) or {}
+    app = current_app._get_current_object()
     
-    log = DeploymentLog(
-        lab_id=lab.id,
-        operation="deploy",
-        status="running",
-        logs=""
-    )
-    db.session.add(log)
-    db.session.commit()
-    
-    try:
-        # 1. Generate Terraform config
-        workspace_path = terraform_service.generate_terraform_config(lab)
-        log.logs += f"Generated Terraform config in {workspace_path}\n"
-        db.session.commit()
+    with job_queue.exclusive("deploy", lab_id=lab.id) as active_job:
+        if active_job:
+            return jsonify({"error": "A deployment is already queued or running for this lab", "job": active_job.to_dict()}), 409
         
-        # 2. Terraform Init
-        init_result = terraform_service.terraform_init(lab.id)
-        log.logs += f"Terraform Init: {init_result}\n"
-        if not init_result["success"]:
-            raise Exception(f"Terraform Init failed: {init_result['stderr']}")
-        db.session.commit()
-        
-        # 3. Terraform Plan
-        plan_result = terraform_service.terraform_plan(lab.id)
-        log.logs += f"Terraform Plan: {plan_result}\n"
-        if not plan_result["success"]:
-            raise Exception(f"Terraform Plan failed: {plan_result['stderr']}")
-        db.session.commit()
-        
-        # 4. Terraform Apply
-        apply_result = terraform_service.terraform_apply(lab.id)
-        log.logs += f"Terraform Apply: {apply_result}\n"
-        if not apply_result["success"]:
-            raise Exception(f"Terraform Apply failed: {apply_result['stderr']}")
-        db.session.commit()
-        
-        # 5. Get Terraform Outputs (IPs)
-        outputs = terraform_service.get_terraform_outputs(lab.id)
-        if not outputs["success"]:
-            raise Exception(f"Failed to get Terraform outputs: {outputs['error']}")
-        
-        machine_ips = {}
-        for machine in lab.machines:
-            ip_output_key = f"machine_{machine.id}_ip"
-            if ip_output_key in outputs["outputs"]:
-                machine.ip_address = outputs["outputs"][ip_output_key]["value"]
-                machine_ips[machine.id] = machine.ip_address
-            db.session.commit()
-        log.logs += f"Machine IPs: {machine_ips}\n"
+        lab.status = "deploying"
+        log = DeploymentLog(
+            lab_id=lab.id,
+            operation="deploy",
+            status="running"
+        )
+        db.session.add(log)
         db.session.commit()
         
-        # 6. Generate Ansible Inventory
-        inventory_path = ansible_service.generate_inventory(lab, machine_ips)
-        log.logs += f"Generated Ansible inventory in {inventory_path}\n"
+        log_id = log.id
+        job = job_queue.submit(
+            "deploy",
+            _run_deploy_job,
+            app,
+            lab.id,
+            log_id,
+            force=bool(data.get("force", False)),
+            metadata={"lab_id": lab.id, "log_id": log_id},
+            on_cancel=lambda job: _mark_deploy_cancelled(app, lab_id, log_id)
+        )
+    return jsonify({
+        "message": "Deployment queued",
+        "job_id": job.id,
+        "log_id": log_id,
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
+
+# Statut d'un lab dont le déploiement a été annulé, avant ou pendant son exécution:
+# l'infrastructure peut être partiellement appliquée, un nouveau déploiement est nécessaire
+DEPLOY_CANCELLED_LAB_STATUS = "error"
+
+def _mark_deploy_cancelled(app, lab_id, log_id):
+    """Met à jour le lab et son log quand un déploiement est annulé avant d'avoir démarré"""
+    with app.app_context():
+        lab = Lab.query.get(lab_id)
+        log = DeploymentLog.query.get(log_id)
+        if lab:
+            lab.status = DEPLOY_CANCELLED_LAB_STATUS
+        if log:
+            log.status = "cancelled"
+            log.completed_at = datetime.utcnow()
         db.session.commit()
-        
-        # 7. Save SSH Key (assuming it's provided in provider_config)
-        provider_config = json.loads(lab.provider_config)
-        ssh_private_key = provider_config.get("ssh_private_key") # Assuming private key is passed
-        if ssh_private_key:
-            ansible_service.save_ssh_key(lab.id, ssh_private_key)
-            log.logs += "SSH private key saved.\n"
+        log_store.append(log_id, "Deployment cancelled before start.\n")
+        log_store.close(log_id)
+
+def _run_deploy_job(job, app, lab_id, log_id, force=False):
+    """Exécute le déploiement d'un lab dans un worker du job_queue"""
+    with app.app_context():
+        lab = Lab.query.get(lab_id)
+        log = DeploymentLog.query.get(log_id)
+        try:
+            _deploy(job, lab, log, force=force)
+        except JobCancelled:
+            db.session.rollback()
+            log_store.append(log.id, "Deployment cancelled.\n")
+            lab.status = DEPLOY_CANCELLED_LAB_STATUS
+            log.status = "cancelled"
+            log.completed_at = datetime.utcnow()
             db.session.commit()
-        
-        # 8. Test Ansible Connectivity
-        connectivity_result = ansible_service.test_connectivity(lab.id, inventory_path)
-        log.logs += f"Ansible Connectivity Test: {connectivity_result}\n"
-        if not connectivity_result["success"]:
-            raise Exception(f"Ansible Connectivity Test failed: {connectivity_result['stderr']}")
-        db.session.commit()
-        
-        # 9. Run Ansible Playbooks for each machine
-        custom_playbooks = CustomPlaybook.query.filter(CustomPlaybook.id.in_(
-            [pb_id for machine in lab.machines for pb_id in json.loads(machine.custom_playbooks) if machine.custom_playbooks]
-        )).all()
-        
-        for machine in lab.machines:
-            machine_playbook_path = ansible_service.generate_machine_playbook(machine, custom_playbooks)
-            log.logs += f"Generated playbook for {machine.name}: {machine_playbook_path}\n"
+            raise
+        except Exception as e:
+            db.session.rollback()
+            log_store.append(log.id, f"Deployment failed: {str(e)}\n")
+            lab.status = "error"
+            log.status = "error"
+            log.completed_at = datetime.utcnow()
             db.session.commit()
-            
-            playbook_result = ansible_service.run_playbook(lab.id, machine_playbook_path, inventory_path, limit=machine.name)
-            log.logs += f"Ansible Playbook for {machine.name}: {playbook_result}\n"
-            if not playbook_result["success"]:
-                raise Exception(f"Ansible Playbook for {machine.name} failed: {playbook_result['stderr']}")
+            raise
+        else:
+            lab.status = "running"
+            log.status = "success"
+            log.completed_at = datetime.utcnow()
             db.session.commit()
-            
-        lab.status = "running"
-        log.status = "success"
-        log.completed_at = datetime.utcnow()
-        db.session.commit()
+        finally:
+            log_store.close(log_id)
+        return {"lab_id": lab.id, "log_id": log.id, "lab_status": lab.status}
+
+def _step_summary(step, result):
+    """Résumé d'une commande pour le log, la sortie complète étant déjà streamée"""
+    status = "success" if result["success"] else "failed"
+    return f"{step}: {status} (returncode {result['returncode']})\n"
+
+def _save_plan_summary(lab, log, plan_result, write):
+    """Enregistrer le résumé JSON du plan sur le déploiement"""
+    summary = terraform_service.get_plan_summary(lab.id)
+    if not summary["success"]:
+        # Sans résumé, on se fie au code de sortie de terraform plan
+        write(f"Could not read plan summary: {summary['error']}\n")
+        summary = {"add": 0, "change": 0, "destroy": 0, "resources": [],
+                   "output_changes": 1 if plan_result["has_changes"] else 0}
+    plan = DeploymentPlan(
+        log_id=log.id,
+        lab_id=lab.id,
+        add=summary["add"],
+        change=summary["change"],
+        destroy=summary["destroy"],
+        output_changes=summary["output_changes"],
+        resources=json.dumps(summary["resources"])
+    )
+    db.session.add(plan)
+    db.session.commit()
+    write(f"Plan: {plan.add} to add, {plan.change} to change, {plan.destroy} to destroy.\n")
+    return plan
+
+def _deploy(job, lab, log, force=False):
+    """Étapes du déploiement: Terraform puis configuration Ansible"""
+    write = log_store.writer(log.id)
+    
+    # 1. Generate Terraform config (only changed files are rewritten)
+    config = terraform_service.write_terraform_config(lab)
+    changed = ", ".join(config["changed_files"]) or "no file changed"
+    write(f"Generated Terraform config in {config['workspace']} ({changed}, hash {config['config_hash'][:12]})\n")
+    job.raise_if_cancelled()
+    
+    # Machines changed since the last successful deploy (partial deploy unless forced or lab-level change)
+    diff = change_detector.diff(lab)
+    partial = not diff["full"] and not force
+    if partial:
+        write(f"Machine changes since last deploy: added {diff['added']}, changed {diff['changed']}, "
+              f"removed {diff['removed']}, reprovision {diff['reprovision']}\n")
+    
+    if config["up_to_date"] and not force:
+        write("Terraform config and providers unchanged since last successful apply: skipping init, plan and apply.\n")
+    else:
+        # 2. Terraform Init (skipped when providers did not change since the last init)
+        if config["needs_init"]:
+            write("$ terraform init\n")
+            init_result = terraform_service.terraform_init(lab.id, output_callback=write, cancel_event=job.cancel_event)
+            write(_step_summary("Terraform Init", init_result))
+            job.raise_if_cancelled()
+            if not init_result["success"]:
+                raise Exception(f"Terraform Init failed: {init_result['stderr']}")
+            terraform_service.mark_initialized(lab.id, config["providers_hash"])
+        else:
+            write("Terraform providers unchanged: skipping init.\n")
         
-        return jsonify({"message": "Lab deployed successfully", "lab": lab.to_dict()}), 200
+        # 3. Terraform Plan (targeted at the changed machines for a partial deploy)
+        targets = change_detector.get_targets(lab, diff) if partial else []
+        write("$ terraform plan" + "".join(f" -target={target}" for target in targets) + "\n")
+        plan_result = terraform_service.terraform_plan(lab.id, output_callback=write, cancel_event=job.cancel_event,
+                                                       targets=targets)
+        write(_step_summary("Terraform Plan", plan_result))
+        job.raise_if_cancelled()
+        if not plan_result["success"]:
+            raise Exception(f"Terraform Plan failed: {plan_result['stderr']}")
+        plan = _save_plan_summary(lab, log, plan_result, write)
         
-    except Exception as e:
-        lab.status = "error"
-        log.status = "error"
-        log.logs += f"Deployment failed: {str(e)}\n"
-        log.completed_at = datetime.utcnow()
-        db.session.commit()
-        return jsonify({"message": "Deployment failed", "error": str(e)}), 500
+        # 4. Terraform Apply (of the saved plan file, skipped when the plan is empty)
+        if plan.empty:
+            terraform_service.discard_plan(lab.id)
+            write("Terraform plan is empty: skipping apply.\n")
+        else:
+            write("$ terraform apply\n")
+            apply_result = terraform_service.terraform_apply(lab.id, output_callback=write, cancel_event=job.cancel_event)
+            write(_step_summary("Terraform Apply", apply_result))
+            job.raise_if_cancelled()
+            if not apply_result["success"]:
+                raise Exception(f"Terraform Apply failed: {apply_result['stderr']}")
+            plan.applied = True
+            db.session.commit()
+        terraform_service.mark_applied(lab.id)
+    
+    # 5. Get Terraform Outputs (IPs)
+    outputs = terraform_service.get_terraform_outputs(lab.id)
+    if not outputs["success"]:
+        raise Exception(f"Failed to get Terraform outputs: {outputs['error']}")
+    
+    machine_ips = {}
+    for machine in lab.machines:
+        ip_output_key = f"machine_{machine.id}_ip"
+        if ip_output_key in outputs["outputs"]:
+            machine.ip_address = outputs["outputs"][ip_output_key]["value"]
+            machine_ips[machine.id] = machine.ip_address
+    db.session.commit()
+    write(f"Machine IPs: {machine_ips}\n")
+    job.raise_if_cancelled()
+    
+    # 6. Generate Ansible Inventory
+    inventory_path = ansible_service.generate_inventory(lab, machine_ips)
+    write(f"Generated Ansible inventory in {inventory_path}\n")
+    
+    # 7. Save SSH Key (assuming it's provided in provider_config)
+    provider_config = json.loads(lab.provider_config)
+    ssh_private_key = provider_config.get("ssh_private_key") # Assuming private key is passed
+    if ssh_private_key:
+        ansible_service.save_ssh_key(lab.id, ssh_private_key)
+        write("SSH private key saved.\n")
+    
+    # Only new or changed machines are configured again on a partial deploy
+    if partial:
+        to_provision = set(diff["added"] + diff["changed"] + diff["reprovision"])
+        machines = [machine for machine in lab.machines if machine.id in to_provision]
+        deployed_ids = list(diff["unchanged"])
+    else:
+        machines = list(lab.machines)
+        deployed_ids = []
+    if not machines:
+        write("No machine to configure: skipping Ansible.\n")
+        change_detector.record_deployed(lab, deployed_ids)
+        return
+    limit = [machine.name for machine in machines] if partial else None
+    
+    # 8. Test Ansible Connectivity
+    write(f"$ ansible {','.join(limit) if limit else 'all'} -m ping\n")
+    connectivity_result = ansible_service.test_connectivity(lab.id, inventory_path, output_callback=write,
+                                                            cancel_event=job.cancel_event, limit=limit)
+    write(_step_summary("Ansible Connectivity Test", connectivity_result))
+    job.raise_if_cancelled()
+    if not connectivity_result["success"]:
+        raise Exception(f"Ansible Connectivity Test failed: {connectivity_result['stderr']}")
+    
+    # 9. Run Ansible Playbooks for each machine (parallel, combined or serial mode)
+    custom_playbooks = CustomPlaybook.query.filter(CustomPlaybook.id.in_(
+        [pb_id for machine in machines for pb_id in json.loads(machine.custom_playbooks) if machine.custom_playbooks]
+    )).all()
+    
+    playbooks_result = ansible_service.run_machine_playbooks(lab.id, machines, inventory_path, custom_playbooks,
+                                                             output_callback=write, cancel_event=job.cancel_event)
+    job.raise_if_cancelled()
+    for machine in machines:
+        machine_result = playbooks_result["machines"][machine.name]
+        if machine_result.get("skipped"):
+            write(f"Ansible Playbook for {machine.name}: skipped\n")
+            continue
+        machine.status = "running" if machine_result["success"] else "error"
+        if machine_result["success"]:
+            deployed_ids.append(machine.id)
+        status = "ok" if machine_result["success"] else f"failed: {machine_result['error']}"
+        write(f"Ansible Playbook for {machine.name} ({machine_result['playbook']}): {status}\n")
+    db.session.commit()
+    change_detector.record_deployed(lab, deployed_ids)
+    if not playbooks_result["success"]:
+        raise Exception(f"Ansible Playbooks failed for: {', '.join(playbooks_result['failed'])}")
 
 @labs_bp.route("/labs/<int:lab_id>/destroy", methods=["POST"])
 def destroy_lab(lab_id):
@@ -236,15 +460,16 @@ def destroy_lab(lab_id):
     log = DeploymentLog(
         lab_id=lab.id,
         operation="destroy",
-        status="running",
-        logs=""
+        status="running"
     )
     db.session.add(log)
     db.session.commit()
+    write = log_store.writer(log.id)
     
     try:
-        destroy_result = terraform_service.terraform_destroy(lab.id)
-        log.logs += f"Terraform Destroy: {destroy_result}\n"
+        write("$ terraform destroy\n")
+        destroy_result = terraform_service.terraform_destroy(lab.id, output_callback=write)
+        write(_step_summary("Terraform Destroy", destroy_result))
         if not destroy_result["success"]:
             raise Exception(f"Terraform Destroy failed: {destroy_result['stderr']}")
         
@@ -252,6 +477,7 @@ def destroy_lab(lab_id):
         log.status = "success"
         log.completed_at = datetime.utcnow()
         db.session.commit()
+        log_store.close(log.id)
         
         # Cleanup workspaces after successful destroy
         terraform_service.cleanup_workspace(lab.id)
@@ -260,11 +486,12 @@ def destroy_lab(lab_id):
         return jsonify({"message": "Lab destroyed successfully"}), 200
         
     except Exception as e:
+        write(f"Destroy failed: {str(e)}\n")
         lab.status = "error"
         log.status = "error"
-        log.logs += f"Destroy failed: {str(e)}\n"
         log.completed_at = datetime.utcnow()
         db.session.commit()
+        log_store.close(log.id)
         return jsonify({"message": "Destroy failed", "error": str(e)}), 500
 
 @labs_bp.route("/labs/<int:lab_id>/start", methods=["POST"])
@@ -350,13 +577,102 @@ def delete_custom_playbook(playbook_id):
 
 @labs_bp.route("/deployment_logs", methods=["GET"])
 def get_deployment_logs():
-    logs = DeploymentLog.query.order_by(DeploymentLog.started_at.desc()).all()
-    return jsonify([log.to_dict() for log in logs]), 200
+    """Liste des logs (métadonnées): filtres lab_id, status, operation, started_after/started_before, fields=, limit/cursor"""
+    fields = _parse_fields_arg(DeploymentLog.FIELDS + ("size", "chunks"))
+    # The legacy logs column can hold whole deployments: never load it for a listing
+    query = DeploymentLog.query.options(defer(DeploymentLog.logs))
+    lab_id = request.args.get("lab_id", type=int)
+    if lab_id is not None:
+        query = query.filter(DeploymentLog.lab_id == lab_id)
+    if request.args.get("status"):
+        query = query.filter(DeploymentLog.status == request.args["status"])
+    if request.args.get("operation"):
+        query = query.filter(DeploymentLog.operation == request.args["operation"])
+    started_after = _parse_datetime_arg("started_after")
+    if started_after:
+        query = query.filter(DeploymentLog.started_at >= started_after)
+    started_before = _parse_datetime_arg("started_before")
+    if started_before:
+        query = query.filter(DeploymentLog.started_at < started_before)
+    
+    logs, next_cursor = _paginate(query, DeploymentLog.id, descending=True)
+    with_stats = fields is None or "size" in fields or "chunks" in fields
+    stats = log_store.get_stats([log.id for log in logs]) if with_stats else {}
+    legacy_ids = [log.id for log in logs if log.id not in stats] if with_stats else []
+    if legacy_ids:
+        # Size of logs written before chunked storage, computed by the database
+        legacy_sizes = dict(db.session.query(DeploymentLog.id, func.length(DeploymentLog.logs))
+                            .filter(DeploymentLog.id.in_(legacy_ids)))
+        for log_id in legacy_ids:
+            stats[log_id] = {"size": legacy_sizes.get(log_id) or 0, "chunks": 0}
+    result = []
+    for log in logs:
+        log_dict = log.to_dict()
+        if with_stats:
+            log_dict.update(stats[log.id])
+        if fields:
+            log_dict = {key: value for key, value in log_dict.items() if key in fields}
+        result.append(log_dict)
+    return _page_response(result, next_cursor)
 
 @labs_bp.route("/deployment_logs/<int:log_id>", methods=["GET"])
 def get_deployment_log(log_id):
     log = DeploymentLog.query.get_or_404(log_id)
-    return jsonify(log.to_dict()), 200
+    log_dict = log.to_dict()
+    log_dict["plan"] = log.plan.to_dict() if log.plan else None
+    if request.args.get("include_logs", "true").lower() == "true":
+        log_dict["logs"] = log_store.read(log_id)["content"]
+    return jsonify(log_dict), 200
+
+@labs_bp.route("/deployment_logs/<int:log_id>/content", methods=["GET"])
+def get_deployment_log_content(log_id):
+    """Lecture d'une plage du log: offset et length en caractères"""
+    offset = max(0, request.args.get("offset", 0, type=int))
+    length = request.args.get("length", type=int)
+    result = log_store.read(log_id, offset, length)
+    if result is None:
+        return jsonify({"error": "Deployment log not found"}), 404
+    return jsonify(result), 200
+
+@labs_bp.route("/deployment_logs/<int:log_id>/tail", methods=["GET"])
+def get_deployment_log_tail(log_id):
+    """Dernières lignes du log (lines=100 par défaut)"""
+    lines = min(max(0, request.args.get("lines", 100, type=int)), 10000)
+    result = log_store.tail(log_id, lines)
+    if result is None:
+        return jsonify({"error": "Deployment log not found"}), 404
+    return jsonify(result), 200
+
+@labs_bp.route("/deployment_logs/<int:log_id>/stream", methods=["GET"])
+def stream_deployment_log(log_id):
+    """Suivi en direct d'un log de déploiement (Server-Sent Events)"""
+    DeploymentLog.query.get_or_404(log_id)
+    offset = request.headers.get("Last-Event-ID", request.args.get("offset", 0), type=int)
+    poll_interval = 1.0
+    
+    def generate():
+        position = offset
+        idle_polls = 0
+        while True:
+            chunk = log_store.read(log_id, position, length=65536)
+            if chunk is None:
+                return
+            if chunk["content"]:
+                position = chunk["offset"]
+                idle_polls = 0
+                data = "\n".join(f"data: {line}" for line in chunk["content"].rstrip("\n").split("\n"))
+                yield f"id: {position}\n{data}\n\n"
+            elif chunk["status"] != "running":
+                yield f"event: end\ndata: {chunk['status']}\n\n"
+                return
+            else:
+                idle_polls += 1
+                if idle_polls % 15 == 0:
+                    yield ": keep-alive\n\n"
+            time.sleep(poll_interval)
+    
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @labs_bp.route("/labs/<int:lab_id>/export", methods=["POST"])
 def export_lab_route(lab_id):
@@ -382,3 +698,29 @@ def import_lab_route():
         return jsonify({"error": result["error"]}), 500
 
 
+
+@labs_bp.route("/terraform/providers/cache", methods=["GET"])
+def get_terraform_provider_cache():
+    """Statistiques du cache de plugins partagé et providers présents dans le miroir local"""
+    return jsonify(terraform_service.get_plugin_cache_stats()), 200
+
+def _run_provider_mirror_job(job):
+    """Remplit le miroir des providers; le job échoue si terraform providers mirror échoue"""
+    result = terraform_service.seed_provider_mirror()
+    if not result["success"]:
+        raise Exception(f"terraform providers mirror failed: {result['stderr']}")
+    return result
+
+@labs_bp.route("/terraform/providers/mirror", methods=["POST"])
+def seed_terraform_provider_mirror():
+    """Pré-remplir le miroir local des providers (tâche de fond, réseau requis)"""
+    with job_queue.exclusive("provider_mirror") as active_job:
+        if active_job:
+            return jsonify({"error": "Provider mirror seeding already in progress", "job_id": active_job.id}), 409
+        
+        job = job_queue.submit("provider_mirror", _run_provider_mirror_job)
+    return jsonify({
+        "message": "Provider mirror seeding queued",
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
@@ -0,0 +1,24 @@
+from flask import Blueprint, Response
+from src.services.metrics_registry import metrics_registry, CONTENT_TYPE
+from src.services.performance_optimizer import performance_optimizer
+
+metrics_bp = Blueprint('metrics', __name__)
+
+CACHE_EVENTS = ('hits', 'misses', 'sets', 'evictions', 'expirations', 'invalidations', 'rejected')
+
+def _cache_metrics():
+    """Compteurs du cache de réponses, relus à chaque exposition"""
+    stats = performance_optimizer.get_cache_stats()
+    return [
+        ('labcreator_cache_events_total', 'counter', 'Response cache events',
+         [({'event': event}, stats[event]) for event in CACHE_EVENTS]),
+        ('labcreator_cache_entries', 'gauge', 'Entries in the response cache', [({}, stats['entries'])]),
+        ('labcreator_cache_bytes', 'gauge', 'Estimated size of the response cache in bytes', [({}, stats['bytes'])]),
+    ]
+
+metrics_registry.register_collector(_cache_metrics)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métriques au format d'exposition texte Prometheus (latences par endpoint et statut, requêtes en cours, cache)"""
+    return Response(metrics_registry.render(), mimetype=None, content_type=CONTENT_TYPE)
@@ -187,15 +187,15 @@ def stop_monitoring():
 def get_cache_stats():
     """Récupère les statistiques du cache"""
     try:
-        cache_size = len(performance_optimizer.cache)
-        cache_keys = list(performance_optimizer.cache.keys())[:10]  # Premiers 10 pour exemple
+        stats = performance_optimizer.get_cache_stats()
+        cache_keys = performance_optimizer.cache.keys(limit=10)  # Premiers 10 pour exemple
         
         return jsonify({
             'success': True,
             'cache_stats': {
-                'size': cache_size,
+                'size': stats['entries'],
                 'sample_keys': cache_keys,
-                'ttl_count': len(performance_optimizer.cache_ttl)
+                **stats
             }
         })
         
@@ -211,10 +211,7 @@ def get_cache_stats():
 def clear_cache():
     """Vide le cache"""
     try:
-        cache_size_before = len(performance_optimizer.cache)
-        
-        performance_optimizer.cache.clear()
-        performance_optimizer.cache_ttl.clear()
+        cache_size_before = performance_optimizer.cache.clear()
         
         return jsonify({
             'success': True,
@@ -242,11 +239,27 @@ def get_active_connections():
                 'type': conn_data.get('connection_type', 'unknown')
             })
         
+        # Sessions relayées par le proxy WebSocket: compteurs et limites de débit
+        from src.services.websocket_proxy import proxy
+        proxy_sessions = proxy.get_sessions()
+        labs = {}
+        for session in proxy_sessions:
+            stats = session.get('stats', {})
+            lab = labs.setdefault(str(session.get('lab_id')), {
+                'sessions': 0, 'bytes_up': 0, 'bytes_down': 0, 'messages_up': 0, 'messages_down': 0
+            })
+            lab['sessions'] += 1
+            for key in ('bytes_up', 'bytes_down', 'messages_up', 'messages_down'):
+                lab[key] += stats.get(key, 0)
+        
         return jsonify({
             'success': True,
             'connections': connections,
             'count': len(connections),
-            'max_connections': performance_optimizer.optimization_rules['max_concurrent_connections']
+            'max_connections': performance_optimizer.optimization_rules['max_concurrent_connections'],
+            'proxy_sessions': proxy_sessions,
+            'proxy_labs': labs,
+            'rate_limits': proxy.shaper.get_limits()
         })
         
     except Exception as e:
@@ -284,6 +297,29 @@ def cleanup_connections():
             'error': str(e)
         }), 500
 
+@performance_bp.route('/proxy/sessions', methods=['GET'])
+@monitor_performance
+def get_proxy_sessions():
+    """Sessions VNC/RDP de tous les workers du proxy WebSocket (registre partagé)"""
+    try:
+        from src.services.websocket_proxy import proxy
+        sessions = proxy.get_sessions()
+        workers = sorted({session['worker'] for session in sessions})
+        
+        return jsonify({
+            'success': True,
+            'sessions': sessions,
+            'count': len(sessions),
+            'workers': workers
+        })
+        
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des sessions du proxy: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @performance_bp.route('/system-info', methods=['GET'])
 @monitor_performance
 def get_system_info():
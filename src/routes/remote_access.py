@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from src.services.remote_access_service import RemoteAccessService
+from src.services.websocket_proxy import request_session_close
 from src.models.lab import Machine
 import logging
 
@@ -55,7 +56,9 @@ def create_connection():
         
         # Return connection details
         response_data = connection.to_dict()
-        response_data['websocket_url'] = f"ws://localhost:8765/{connection_type}/{connection.machine.lab_id}/{machine_id}"
+        # The proxy reports traffic on this connection (and looks up its RDP credentials)
+        response_data['websocket_url'] = (f"ws://localhost:8765/{connection_type}/{connection.machine.lab_id}/{machine_id}"
+                                          f"?session_id={connection.session_id}")
         
         return jsonify(response_data), 201
         
@@ -108,6 +111,9 @@ def disconnect_connection(session_id):
         if not success:
             return jsonify({'error': 'Connection not found'}), 404
         
+        # The proxy worker holding the session closes it (4005) on its next heartbeat
+        request_session_close([session_id], 'disconnected')
+        
         return jsonify({'message': 'Connection disconnected successfully'}), 200
         
     except Exception as e:
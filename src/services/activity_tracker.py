@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+
+from src.models.lab import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Intervalle d'écriture groupée des activités dans remote_connections
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("WS_ACTIVITY_FLUSH_INTERVAL", 30))
+
+
+class ActivityFlusher:
+    """
+    Report de l'activité réelle des sessions du proxy dans remote_connections.
+
+    Le proxy signale l'horodatage du dernier octet relayé (et la fin des sessions) en
+    mémoire; une tâche de fond écrit le tout en une transaction toutes les interval
+    secondes, au lieu d'une écriture par trame. cleanup_inactive_connections s'appuie
+    ainsi sur le trafic et non plus sur les appels à l'endpoint de statut.
+    """
+
+    def __init__(self, database_url: str = None, interval: float = None):
+        self.database_url = database_url or DATABASE_URL
+        self.interval = interval or ACTIVITY_FLUSH_INTERVAL
+        self._engine = None
+        # session_id (remote_connections) -> (dernier octet, statut ou None si inchangé)
+        self._pending: Dict[str, Tuple[float, Optional[str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"flushes": 0, "rows": 0, "errors": 0}
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = create_engine(self.database_url, pool_pre_ping=True)
+        return self._engine
+
+    def touch(self, session_id: str, last_activity: float, status: str = None):
+        """Noter l'activité d'une session (mémoire uniquement)"""
+        previous = self._pending.get(session_id)
+        self._pending[session_id] = (max(last_activity, previous[0]) if previous else last_activity,
+                                     status or (previous[1] if previous else None))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Failed to flush remote connection activity: {e}")
+            # Remettre le lot sans écraser les activités plus récentes
+            for session_id, (last_activity, status) in batch.items():
+                if session_id not in self._pending:
+                    self._pending[session_id] = (last_activity, status)
+            return 0
+        self.stats["flushes"] += 1
+        self.stats["rows"] += len(batch)
+        return len(batch)
+
+    def _write(self, batch: Dict[str, Tuple[float, Optional[str]]]):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("UPDATE remote_connections SET last_activity = :last_activity, "
+                     "status = COALESCE(:status, status) WHERE session_id = :session_id"),
+                [
+                    {"session_id": session_id,
+                     "last_activity": datetime.fromtimestamp(last_activity, timezone.utc).replace(tzinfo=None),
+                     "status": status}
+                    for session_id, (last_activity, status) in batch.items()
+                ]
+            )
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self._pending), "interval": self.interval}
+
+
+# Instance globale
+activity_flusher = ActivityFlusher()
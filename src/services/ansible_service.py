@@ -1,14 +1,21 @@
 import os
-import subprocess
 import json
 import yaml
 import tempfile
-from typing import Dict, List, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any
 from src.models.lab import Lab, Machine, CustomPlaybook
+from src.services.command_runner import run_streaming
 
 class AnsibleService:
-    def __init__(self, workspace_dir: str = "/tmp/ansible_workspaces"):
+    def __init__(self, workspace_dir: str = "/tmp/ansible_workspaces", execution_mode: str = None,
+                 max_parallel: int = None, forks: int = None):
         self.workspace_dir = workspace_dir
+        # Configuration des machines: parallel, combined ou serial
+        self.execution_mode = execution_mode or os.getenv("ANSIBLE_EXECUTION_MODE", "parallel")
+        self.max_parallel = max_parallel or int(os.getenv("ANSIBLE_MAX_PARALLEL", 5))
+        self.forks = forks or int(os.getenv("ANSIBLE_FORKS", 20))
         os.makedirs(workspace_dir, exist_ok=True)
         self.playbooks_dir = os.path.join(workspace_dir, "playbooks")
         os.makedirs(self.playbooks_dir, exist_ok=True)
@@ -403,10 +410,9 @@ class AnsibleService:
         
         return playbooks
     
-    def generate_machine_playbook(self, machine: Machine, custom_playbooks: List[CustomPlaybook] = None) -> str:
-        """Générer un playbook spécifique pour une machine"""
+    def _build_machine_play(self, machine: Machine, custom_playbooks: List[CustomPlaybook] = None) -> Dict[str, Any]:
+        """Construire le play Ansible d'une machine"""
         workspace = self.get_lab_workspace(machine.lab_id)
-        playbook_path = os.path.join(workspace, f"machine_{machine.id}_playbook.yml")
         
         software_config = json.loads(machine.software_config) if machine.software_config else []
         custom_playbook_ids = json.loads(machine.custom_playbooks) if machine.custom_playbooks else []
@@ -456,13 +462,36 @@ class AnsibleService:
                         'include': custom_path
                     })
         
+        return playbook
+    
+    def generate_machine_playbook(self, machine: Machine, custom_playbooks: List[CustomPlaybook] = None) -> str:
+        """Générer un playbook spécifique pour une machine"""
+        workspace = self.get_lab_workspace(machine.lab_id)
+        playbook_path = os.path.join(workspace, f"machine_{machine.id}_playbook.yml")
+        
+        playbook = self._build_machine_play(machine, custom_playbooks)
+        
         # Sauvegarder le playbook principal
         with open(playbook_path, 'w') as f:
             yaml.dump([playbook], f, default_flow_style=False)
         
         return playbook_path
     
-    def run_playbook(self, lab_id: int, playbook_path: str, inventory_path: str, limit: str = None) -> Dict[str, Any]:
+    def generate_combined_playbook(self, lab_id: int, machines: List[Machine], custom_playbooks: List[CustomPlaybook] = None) -> str:
+        """Générer un playbook multi-plays (un play par machine) pour tout le lab"""
+        workspace = self.get_lab_workspace(lab_id)
+        playbook_path = os.path.join(workspace, "lab_playbook.yml")
+        
+        plays = [self._build_machine_play(machine, custom_playbooks) for machine in machines]
+        
+        with open(playbook_path, 'w') as f:
+            yaml.dump(plays, f, default_flow_style=False)
+        
+        return playbook_path
+    
+    def run_playbook(self, lab_id: int, playbook_path: str, inventory_path: str, limit: str = None,
+                     forks: int = None, output_callback: Callable[[str], None] = None,
+                     cancel_event: threading.Event = None) -> Dict[str, Any]:
         """Exécuter un playbook Ansible"""
         workspace = self.get_lab_workspace(lab_id)
         
@@ -475,56 +504,154 @@ class AnsibleService:
         
         if limit:
             cmd.extend(['--limit', limit])
+        if forks:
+            cmd.extend(['--forks', str(forks)])
         
-        try:
-            result = subprocess.run(
-                cmd,
-                cwd=workspace,
-                capture_output=True,
-                text=True,
-                timeout=1800  # 30 minutes
-            )
-            
-            return {
-                'success': result.returncode == 0,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                'success': False,
-                'stdout': '',
-                'stderr': 'Timeout during ansible playbook execution',
-                'returncode': -1
+        return run_streaming(
+            cmd,
+            cwd=workspace,
+            timeout=1800,  # 30 minutes
+            timeout_message='Timeout during ansible playbook execution',
+            output_callback=output_callback,
+            cancel_event=cancel_event
+        )
+    
+    def run_machine_playbooks(self, lab_id: int, machines: List[Machine], inventory_path: str,
+                              custom_playbooks: List[CustomPlaybook] = None, mode: str = None,
+                              output_callback: Callable[[str], None] = None,
+                              cancel_event: threading.Event = None) -> Dict[str, Any]:
+        """
+        Configurer toutes les machines d'un lab et attribuer les résultats à chaque machine.
+        
+        Modes:
+            parallel: un ansible-playbook par machine, au plus max_parallel en même temps
+            combined: un seul playbook multi-plays exécuté avec --forks
+            serial:   un ansible-playbook par machine, l'un après l'autre; s'arrête au premier
+                      échec, les machines suivantes sont marquées 'skipped'
+        """
+        mode = mode or self.execution_mode
+        results: Dict[str, Dict[str, Any]] = {}
+        
+        if mode == 'combined':
+            playbook_path = self.generate_combined_playbook(lab_id, machines, custom_playbooks)
+            run_result = self.run_playbook(lab_id, playbook_path, inventory_path, forks=self.forks,
+                                           output_callback=output_callback, cancel_event=cancel_event)
+            recap = self.parse_play_recap(run_result['stdout'])
+            for machine in machines:
+                host_recap = recap.get(machine.name)
+                if host_recap is None:
+                    success = False
+                    error = run_result['stderr'] or 'No result for this host in PLAY RECAP'
+                else:
+                    success = host_recap.get('failed', 0) == 0 and host_recap.get('unreachable', 0) == 0
+                    error = None if success else run_result['stderr'] or f"Recap: {host_recap}"
+                results[machine.name] = {
+                    'success': success,
+                    'playbook': playbook_path,
+                    'recap': host_recap,
+                    'returncode': run_result['returncode'],
+                    'error': error
+                }
+        else:
+            playbook_paths = {
+                machine.name: self.generate_machine_playbook(machine, custom_playbooks)
+                for machine in machines
             }
+            
+            def run_one(machine_name: str) -> Dict[str, Any]:
+                machine_callback = None
+                if output_callback:
+                    # Préfixer chaque ligne par la machine, les sorties étant entrelacées
+                    machine_callback = lambda chunk: output_callback(
+                        ''.join(f"[{machine_name}] {line}" for line in chunk.splitlines(True))
+                    )
+                run_result = self.run_playbook(lab_id, playbook_paths[machine_name], inventory_path, limit=machine_name,
+                                               output_callback=machine_callback, cancel_event=cancel_event)
+                return {
+                    'success': run_result['success'],
+                    'playbook': playbook_paths[machine_name],
+                    'recap': self.parse_play_recap(run_result['stdout']).get(machine_name),
+                    'returncode': run_result['returncode'],
+                    'error': None if run_result['success'] else run_result['stderr']
+                }
+            
+            def run_safe(machine_name: str, future=None) -> Dict[str, Any]:
+                try:
+                    return future.result() if future else run_one(machine_name)
+                except Exception as e:
+                    return {
+                        'success': False,
+                        'playbook': playbook_paths[machine_name],
+                        'recap': None,
+                        'returncode': -1,
+                        'error': str(e)
+                    }
+            
+            if mode == 'serial':
+                # Comportement historique: ne pas configurer la suite après un échec
+                for machine_name in playbook_paths:
+                    if results and not all(result['success'] for result in results.values()):
+                        results[machine_name] = {
+                            'success': False,
+                            'skipped': True,
+                            'playbook': playbook_paths[machine_name],
+                            'recap': None,
+                            'returncode': None,
+                            'error': 'Skipped after a previous machine failed'
+                        }
+                    else:
+                        results[machine_name] = run_safe(machine_name)
+            else:
+                with ThreadPoolExecutor(max_workers=max(1, self.max_parallel)) as executor:
+                    futures = {executor.submit(run_one, name): name for name in playbook_paths}
+                    for future, machine_name in futures.items():
+                        results[machine_name] = run_safe(machine_name, future)
+        
+        failed = [name for name, result in results.items()
+                  if not result['success'] and not result.get('skipped')]
+        skipped = [name for name, result in results.items() if result.get('skipped')]
+        return {
+            'success': not failed,
+            'mode': mode,
+            'machines': results,
+            'failed': failed,
+            'skipped': skipped
+        }
     
-    def test_connectivity(self, lab_id: int, inventory_path: str) -> Dict[str, Any]:
-        """Tester la connectivité avec les machines"""
+    @staticmethod
+    def parse_play_recap(stdout: str) -> Dict[str, Dict[str, int]]:
+        """Extraire les compteurs par hôte de la section PLAY RECAP"""
+        recap: Dict[str, Dict[str, int]] = {}
+        in_recap = False
+        for line in (stdout or '').splitlines():
+            if line.startswith('PLAY RECAP'):
+                in_recap = True
+                continue
+            if not in_recap or ':' not in line:
+                continue
+            host, _, counters = line.partition(':')
+            values = {}
+            for item in counters.split():
+                key, sep, value = item.partition('=')
+                if sep and value.isdigit():
+                    values[key] = int(value)
+            if values:
+                recap[host.strip()] = values
+        return recap
+    
+    def test_connectivity(self, lab_id: int, inventory_path: str, output_callback: Callable[[str], None] = None,
+                          cancel_event: threading.Event = None, limit: List[str] = None) -> Dict[str, Any]:
+        """Tester la connectivité avec les machines (toutes, ou seulement celles de limit)"""
         workspace = self.get_lab_workspace(lab_id)
         
-        try:
-            result = subprocess.run(
-                ['ansible', 'all', '-i', inventory_path, '-m', 'ping'],
-                cwd=workspace,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            
-            return {
-                'success': result.returncode == 0,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                'success': False,
-                'stdout': '',
-                'stderr': 'Timeout during connectivity test',
-                'returncode': -1
-            }
+        return run_streaming(
+            ['ansible', ','.join(limit) if limit else 'all', '-i', inventory_path, '-m', 'ping'],
+            cwd=workspace,
+            timeout=300,
+            timeout_message='Timeout during connectivity test',
+            output_callback=output_callback,
+            cancel_event=cancel_event
+        )
     
     def save_ssh_key(self, lab_id: int, private_key: str) -> str:
         """Sauvegarder la clé SSH privée pour un lab"""
@@ -0,0 +1,280 @@
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Limites globales du cache, réparties également entre les segments
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Nombre de segments (un verrou chacun) pour limiter la contention entre threads
+CACHE_STRIPES = int(os.getenv("CACHE_STRIPES", 16))
+# Marge ajoutée au plus long TTL avant d'oublier la version d'un tag
+TAG_RETENTION_GRACE = 60
+
+_MISSING = object()
+
+
+def estimate_size(value: Any) -> int:
+    """Taille approximative d'une valeur en octets (contenu des bytes/str, un niveau de conteneur)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8", "surrogatepass"))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(
+            len(v) if isinstance(v, (bytes, bytearray, str)) else sys.getsizeof(v) for v in value
+        )
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class _Stripe:
+    """Segment du cache: LRU ordonnée, tas des expirations et compteurs, sous un même verrou"""
+
+    __slots__ = ("lock", "entries", "expiry", "bytes", "max_entries", "max_bytes", "stats")
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.lock = threading.Lock()
+        # clé -> (expiration monotonic, taille, valeur, versions des tags); l'ordre est celui des accès (LRU en tête)
+        self.entries: "OrderedDict[Hashable, Tuple[float, int, Any, Tuple]]" = OrderedDict()
+        # (expiration, clé); les entrées remplacées ou supprimées y restent et sont ignorées
+        self.expiry: List[Tuple[float, Hashable]] = []
+        self.bytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0,
+                      "invalidations": 0, "deletes": 0, "rejected": 0}
+
+    def remove(self, key: Hashable) -> Tuple[float, int, Any, Tuple]:
+        entry = self.entries.pop(key)
+        self.bytes -= entry[1]
+        return entry
+
+    def purge_expired(self, now: float) -> int:
+        removed = 0
+        while self.expiry and self.expiry[0][0] <= now:
+            expires, key = heapq.heappop(self.expiry)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == expires:
+                self.remove(key)
+                removed += 1
+        self.stats["expirations"] += removed
+        return removed
+
+    def evict_lru(self, count: int) -> int:
+        evicted = 0
+        while self.entries and evicted < count:
+            self.remove(next(iter(self.entries)))
+            evicted += 1
+        self.stats["evictions"] += evicted
+        return evicted
+
+    def compact_expiry(self):
+        # Reconstruire le tas quand les entrées périmées y dominent (réécritures fréquentes)
+        if len(self.expiry) > 2 * len(self.entries) + 64:
+            self.expiry = [(entry[0], key) for key, entry in self.entries.items()]
+            heapq.heapify(self.expiry)
+
+
+class CacheEngine:
+    """
+    Cache clé/valeur borné et partagé entre threads.
+
+    Les clés sont réparties par hachage entre plusieurs segments protégés chacun par leur
+    propre verrou; chaque segment est une LRU bornée en nombre d'entrées et en octets, avec
+    un tas d'expirations qui permet de retirer les entrées périmées sans parcourir le cache.
+    Une lecture d'entrée expirée compte comme un échec et la retire immédiatement.
+
+    Une entrée peut porter des tags (ex. "lab:3"): invalidate_tags() incrémente leur version,
+    et toute entrée enregistrée avec une version antérieure devient un échec à sa prochaine
+    lecture. L'invalidation est ainsi en O(nombre de tags), sans index des clés par tag.
+    set() refuse une valeur dont les tags ont changé depuis la lecture de leurs versions:
+    une entrée antérieure à une invalidation expire donc au plus tard le plus long TTL après
+    celle-ci, et purge_expired() oublie ensuite la version du tag (labs supprimés...).
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, default_ttl: float = 300,
+                 stripes: int = None, sizeof: Callable[[Any], int] = estimate_size):
+        self.max_entries = max_entries or CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or CACHE_MAX_BYTES
+        self.default_ttl = default_ttl
+        self.sizeof = sizeof
+        count = max(1, stripes or CACHE_STRIPES)
+        self._stripes = [
+            _Stripe(max(1, self.max_entries // count), max(1, self.max_bytes // count))
+            for _ in range(count)
+        ]
+        self._tag_versions: Dict[str, int] = {}
+        # tag -> dernière invalidation (monotonic), pour oublier les tags inactifs
+        self._tag_bumped_at: Dict[str, float] = {}
+        self._tags_lock = threading.Lock()
+        self._max_ttl = default_ttl
+        self.tag_bumps = 0
+
+    def _stripe(self, key: Hashable) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key, _MISSING)
+            if entry is _MISSING:
+                stripe.stats["misses"] += 1
+                return default
+            if entry[0] <= time.monotonic():
+                stripe.remove(key)
+                stripe.stats["expirations"] += 1
+                stripe.stats["misses"] += 1
+                return default
+            if entry[3] and any(self._tag_versions.get(tag, 0) != version for tag, version in entry[3]):
+                stripe.remove(key)
+                stripe.stats["invalidations"] += 1
+                stripe.stats["misses"] += 1
+                return default
+            stripe.entries.move_to_end(key)
+            stripe.stats["hits"] += 1
+            return entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, size: Optional[int] = None,
+            tags: Tuple[Tuple[str, int], ...] = ()) -> bool:
+        """
+        Ajouter ou remplacer une entrée; False si elle dépasse à elle seule la limite d'un segment.
+
+        tags est le résultat de tag_versions() obtenu AVANT de calculer la valeur: une
+        invalidation survenue pendant le calcul rend alors l'entrée immédiatement périmée.
+        """
+        size = self.sizeof(value) if size is None else size
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl > self._max_ttl:
+            self._max_ttl = ttl
+        expires = time.monotonic() + ttl
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key in stripe.entries:
+                stripe.remove(key)
+            if tags and any(self._tag_versions.get(tag, 0) != version for tag, version in tags):
+                # Invalidée pendant le calcul: déjà périmée
+                stripe.stats["invalidations"] += 1
+                return False
+            if size > stripe.max_bytes:
+                stripe.stats["rejected"] += 1
+                return False
+            stripe.purge_expired(time.monotonic())
+            overflow = len(stripe.entries) + 1 - stripe.max_entries
+            if overflow > 0:
+                stripe.evict_lru(overflow)
+            while stripe.bytes + size > stripe.max_bytes and stripe.entries:
+                stripe.evict_lru(1)
+            stripe.entries[key] = (expires, size, value, tags)
+            stripe.bytes += size
+            heapq.heappush(stripe.expiry, (expires, key))
+            stripe.compact_expiry()
+            stripe.stats["sets"] += 1
+        return True
+
+    def delete(self, key: Hashable) -> bool:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key not in stripe.entries:
+                return False
+            stripe.remove(key)
+            stripe.stats["deletes"] += 1
+            return True
+
+    def tag_versions(self, tags: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+        """Versions courantes des tags, à passer à set()"""
+        return tuple((tag, self._tag_versions.get(tag, 0)) for tag in tags)
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        """Périmer toutes les entrées portant l'un de ces tags"""
+        now = time.monotonic()
+        with self._tags_lock:
+            for tag in tags:
+                # Versions tirées d'un compteur global croissant: un tag oublié puis invalidé
+                # à nouveau ne retrouve jamais une version déjà portée par une entrée
+                self.tag_bumps += 1
+                self._tag_versions[tag] = self.tag_bumps
+                self._tag_bumped_at[tag] = now
+
+    def _forget_tags(self, now: float) -> int:
+        # Toute entrée enregistrée avant la dernière invalidation a expiré: la version peut
+        # revenir à 0 (les entrées plus récentes deviennent des échecs, et la prochaine
+        # invalidation prend une version jamais utilisée)
+        cutoff = now - self._max_ttl - TAG_RETENTION_GRACE
+        with self._tags_lock:
+            stale = [tag for tag, bumped_at in self._tag_bumped_at.items() if bumped_at < cutoff]
+            for tag in stale:
+                del self._tag_bumped_at[tag]
+                del self._tag_versions[tag]
+        return len(stale)
+
+    def purge_expired(self) -> int:
+        """Retirer les entrées expirées de tous les segments et oublier les tags inactifs"""
+        now = time.monotonic()
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                removed += stripe.purge_expired(now)
+        self._forget_tags(now)
+        return removed
+
+    def shrink(self, fraction: float) -> int:
+        """Évincer la fraction la moins récemment utilisée de chaque segment (pression mémoire)"""
+        evicted = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                evicted += stripe.evict_lru(int(len(stripe.entries) * fraction))
+                stripe.compact_expiry()
+        return evicted
+
+    def clear(self) -> int:
+        cleared = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                cleared += len(stripe.entries)
+                stripe.entries.clear()
+                stripe.expiry.clear()
+                stripe.bytes = 0
+        return cleared
+
+    def keys(self, limit: Optional[int] = None) -> List[Hashable]:
+        keys = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                keys.extend(stripe.entries.keys())
+            if limit is not None and len(keys) >= limit:
+                return keys[:limit]
+        return keys
+
+    def __len__(self) -> int:
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        totals = {name: 0 for name in self._stripes[0].stats}
+        entries = size = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for name, value in stripe.stats.items():
+                    totals[name] += value
+                entries += len(stripe.entries)
+                size += stripe.bytes
+        lookups = totals["hits"] + totals["misses"]
+        return {
+            **totals,
+            "hit_rate": round(totals["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "stripes": len(self._stripes),
+            "tags": len(self._tag_versions),
+            "tag_invalidations": self.tag_bumps,
+            "default_ttl": self.default_ttl
+        }
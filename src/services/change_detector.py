@@ -0,0 +1,101 @@
+import hashlib
+import json
+from typing import Any, Dict, List
+from src.models.lab import Lab, Machine
+
+# Champs d'une machine utilisés par la configuration Terraform et par les playbooks Ansible
+INFRA_FIELDS = ('name', 'os', 'cpu', 'ram', 'storage', 'role')
+PROVISION_FIELDS = ('name', 'os', 'role', 'software_config', 'custom_playbooks')
+# Champs du lab partagés par toutes les machines (réseau, clé SSH, provider)
+LAB_FIELDS = ('name', 'provider', 'provider_config')
+
+
+def _hash_fields(obj, fields) -> str:
+    values = {field: getattr(obj, field) for field in fields}
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LabChangeDetector:
+    """
+    Détection des machines modifiées depuis le dernier déploiement réussi.
+
+    Le snapshot des définitions déployées (un hash infra et un hash provisioning par
+    machine, plus un hash des champs du lab) est conservé dans l'état du workspace
+    Terraform du lab.
+    """
+
+    def __init__(self, terraform_service):
+        self.terraform_service = terraform_service
+
+    def snapshot_lab(self, lab: Lab) -> Dict[str, Any]:
+        """Définitions actuelles du lab et de ses machines"""
+        return {
+            'lab': _hash_fields(lab, LAB_FIELDS),
+            'machines': {str(machine.id): self.snapshot_machine(machine) for machine in lab.machines}
+        }
+
+    @staticmethod
+    def snapshot_machine(machine: Machine) -> Dict[str, str]:
+        return {
+            'name': machine.name,
+            'infra': _hash_fields(machine, INFRA_FIELDS),
+            'provision': _hash_fields(machine, PROVISION_FIELDS)
+        }
+
+    def diff(self, lab: Lab) -> Dict[str, Any]:
+        """
+        Comparer le lab au dernier snapshot déployé.
+
+        full est vrai quand aucun déploiement partiel n'est possible (pas de snapshot ou
+        champs du lab modifiés); sinon les listes d'ids indiquent les machines à recréer
+        (added, changed), à détruire (removed) et à reconfigurer (reprovision).
+        """
+        current = self.snapshot_lab(lab)
+        deployed = self.terraform_service.get_deployed_snapshot(lab.id)
+        full = not deployed or deployed.get('lab') != current['lab']
+        deployed_machines = deployed.get('machines', {}) if deployed else {}
+
+        added, changed, reprovision, unchanged = [], [], [], []
+        for machine in lab.machines:
+            previous = deployed_machines.get(str(machine.id))
+            definition = current['machines'][str(machine.id)]
+            if previous is None:
+                added.append(machine.id)
+            elif previous['infra'] != definition['infra']:
+                changed.append(machine.id)
+            elif previous['provision'] != definition['provision']:
+                reprovision.append(machine.id)
+            else:
+                unchanged.append(machine.id)
+        removed = [int(machine_id) for machine_id in deployed_machines if machine_id not in current['machines']]
+
+        return {
+            'full': full,
+            'added': added,
+            'changed': changed,
+            'removed': removed,
+            'reprovision': reprovision,
+            'unchanged': unchanged
+        }
+
+    def get_targets(self, lab: Lab, diff: Dict[str, Any]) -> List[str]:
+        """Adresses Terraform des machines ajoutées, modifiées ou supprimées"""
+        machine_ids = diff['added'] + diff['changed'] + diff['removed']
+        return [
+            address
+            for machine_id in machine_ids
+            for address in self.terraform_service.get_machine_addresses(lab, machine_id)
+        ]
+
+    def record_deployed(self, lab: Lab, succeeded_ids: List[int]):
+        """
+        Enregistrer le snapshot après un déploiement: les machines en échec sont retirées
+        du snapshot pour être recréées et reconfigurées au prochain déploiement.
+        """
+        current = self.snapshot_lab(lab)
+        succeeded = {str(machine_id) for machine_id in succeeded_ids}
+        current['machines'] = {
+            machine_id: definition for machine_id, definition in current['machines'].items()
+            if machine_id in succeeded
+        }
+        self.terraform_service.set_deployed_snapshot(lab.id, current)
@@ -0,0 +1,148 @@
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Taille des morceaux transmis au callback et délai maximal avant envoi
+CHUNK_BYTES = 8192
+FLUSH_INTERVAL = 1.0
+# Nombre de lignes conservées en mémoire pour stdout/stderr dans le résultat
+TAIL_LINES = 200
+
+
+def run_streaming(cmd: List[str], cwd: str, timeout: int, timeout_message: str,
+                  output_callback: Optional[Callable[[str], None]] = None,
+                  cancel_event: Optional[threading.Event] = None,
+                  tail_lines: int = TAIL_LINES, env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Exécuter une commande en lisant stdout/stderr ligne par ligne pendant son exécution.
+
+    La sortie est transmise par morceaux à output_callback (au plus CHUNK_BYTES, au moins
+    toutes les FLUSH_INTERVAL secondes); seules les dernières lignes de chaque flux sont
+    gardées en mémoire et renvoyées dans le résultat, au même format que subprocess.run.
+    env complète l'environnement du processus courant.
+    """
+    try:
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            env={**os.environ, **env} if env else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            # Sortie non UTF-8 (terraform, ansible): remplacée plutôt que d'arrêter la lecture
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1
+        )
+    except OSError as e:
+        return {
+            'success': False,
+            'stdout': '',
+            'stderr': str(e),
+            'returncode': -1
+        }
+
+    lines: "queue.Queue" = queue.Queue()
+    tails = {'stdout': deque(maxlen=tail_lines), 'stderr': deque(maxlen=tail_lines)}
+
+    def read_stream(name: str, stream):
+        try:
+            for line in stream:
+                lines.put((name, line))
+        except Exception as e:
+            logger.error(f"Erreur lors de la lecture de la sortie de {cmd[0]}: {e}")
+        finally:
+            # Toujours signaler la fin du flux, sinon la boucle attendrait jusqu'au timeout
+            stream.close()
+            lines.put((name, None))
+
+    readers = [
+        threading.Thread(target=read_stream, args=('stdout', process.stdout), daemon=True),
+        threading.Thread(target=read_stream, args=('stderr', process.stderr), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+
+    chunk: List[str] = []
+    chunk_size = 0
+    last_flush = time.monotonic()
+    deadline = time.monotonic() + timeout
+    open_streams = 2
+    failure = None
+
+    def flush():
+        nonlocal chunk, chunk_size, last_flush
+        if chunk and output_callback:
+            try:
+                output_callback(''.join(chunk))
+            except Exception as e:
+                logger.error(f"Erreur lors de l'écriture de la sortie de {cmd[0]}: {e}")
+        chunk = []
+        chunk_size = 0
+        last_flush = time.monotonic()
+
+    while open_streams:
+        try:
+            name, line = lines.get(timeout=0.2)
+        except queue.Empty:
+            name, line = None, None
+        else:
+            if line is None:
+                open_streams -= 1
+            else:
+                tails[name].append(line)
+                if output_callback:
+                    chunk.append(line if name == 'stdout' else f"[stderr] {line}")
+                    chunk_size += len(line)
+
+        if chunk_size >= CHUNK_BYTES or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+            flush()
+
+        if cancel_event is not None and cancel_event.is_set():
+            failure = 'Cancelled'
+        elif time.monotonic() > deadline:
+            failure = timeout_message
+        if failure:
+            _terminate(process)
+            break
+
+    flush()
+    try:
+        returncode = process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        returncode = process.wait()
+
+    stdout = ''.join(tails['stdout'])
+    stderr = ''.join(tails['stderr'])
+    if failure:
+        return {
+            'success': False,
+            'stdout': stdout,
+            'stderr': failure,
+            'returncode': -1
+        }
+    return {
+        'success': returncode == 0,
+        'stdout': stdout,
+        'stderr': stderr,
+        'returncode': returncode
+    }
+
+
+def _terminate(process: subprocess.Popen, grace_seconds: float = 5):
+    """Arrêter proprement un processus, puis le tuer s'il ne répond pas"""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=grace_seconds)
+    except subprocess.TimeoutExpired:
+        process.kill()
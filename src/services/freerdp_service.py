@@ -1,276 +1,547 @@
-import subprocess
-import threading
-import socket
-import json
+import asyncio
+import codecs
+import fcntl
 import logging
-import uuid
-import time
-from typing import Dict, Optional, Tuple
 import os
+import random
+import shlex
+import shutil
 import signal
+import socket
+import tempfile
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
-class FreeRDPService:
-    """Service pour gérer les connexions RDP via FreeRDP"""
-    
+# Processus passerelle lancé pour chaque session RDP: il écoute sur {port} (127.0.0.1) et parle
+# le protocole Guacamole; guacd utilise FreeRDP pour la connexion à la machine
+RDP_BACKEND_COMMAND = os.getenv("RDP_BACKEND_COMMAND", "guacd -f -b 127.0.0.1 -l {port}")
+RDP_BACKEND_START_TIMEOUT = float(os.getenv("RDP_BACKEND_START_TIMEOUT", 10))
+RDP_BACKEND_STOP_TIMEOUT = float(os.getenv("RDP_BACKEND_STOP_TIMEOUT", 5))
+# Plage de ports réservée aux passerelles et répertoire des verrous partagés entre workers
+RDP_BACKEND_PORTS = os.getenv("RDP_BACKEND_PORTS", "42000-42999")
+RDP_PORT_LOCK_DIR = os.getenv("RDP_PORT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "labcreator-rdp-ports"))
+# Pool de passerelles démarrées d'avance: minimum inactif, maximum total, durée de vie inactive
+RDP_POOL_MIN = int(os.getenv("RDP_POOL_MIN", 2))
+RDP_POOL_MAX = int(os.getenv("RDP_POOL_MAX", 50))
+RDP_POOL_IDLE_TTL = float(os.getenv("RDP_POOL_IDLE_TTL", 300))
+RDP_POOL_REAP_INTERVAL = float(os.getenv("RDP_POOL_REAP_INTERVAL", 10))
+
+
+class RDPBackendError(Exception):
+    """Le processus passerelle n'a pas démarré ou a refusé la connexion"""
+
+
+def encode_instruction(*elements) -> str:
+    """Encoder une instruction Guacamole: LONGUEUR.VALEUR séparés par ',' et terminés par ';'"""
+    return ",".join(f"{len(str(element))}.{element}" for element in elements) + ";"
+
+
+def decode_instructions(text: str) -> List[List[str]]:
+    """Décoder une suite d'instructions Guacamole complètes"""
+    instructions, elements, pos = [], [], 0
+    while pos < len(text):
+        dot = text.index(".", pos)
+        length = int(text[pos:dot])
+        elements.append(text[dot + 1:dot + 1 + length])
+        terminator = text[dot + 1 + length]
+        pos = dot + 2 + length
+        if terminator == ";":
+            instructions.append(elements)
+            elements = []
+    return instructions
+
+
+class GuacamoleParser:
+    """
+    Découpage d'un flux guacd en instructions complètes.
+
+    Les longueurs du protocole sont en caractères Unicode: le flux est décodé en UTF-8 de
+    manière incrémentale et seules des instructions entières sont rendues, car
+    guacamole-common-js attend une ou plusieurs instructions complètes par message WebSocket.
+    """
+
     def __init__(self):
-        self.active_sessions: Dict[str, dict] = {}
-        self.freerdp_path = self._find_freerdp_executable()
-        
-    def _find_freerdp_executable(self) -> str:
-        """Trouve l'exécutable FreeRDP sur le système"""
-        possible_paths = [
-            '/usr/bin/xfreerdp',
-            '/usr/local/bin/xfreerdp',
-            '/opt/freerdp/bin/xfreerdp',
-            'xfreerdp'  # Dans le PATH
-        ]
-        
-        for path in possible_paths:
-            if os.path.exists(path) or self._command_exists(path):
-                return path
-                
-        raise RuntimeError("FreeRDP executable not found. Please install FreeRDP.")
-    
-    def _command_exists(self, command: str) -> bool:
-        """Vérifie si une commande existe dans le PATH"""
-        try:
-            subprocess.run(['which', command], capture_output=True, check=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
-    
-    def create_rdp_session(self, host: str, port: int = 3389, username: str = None, 
-                          password: str = None, domain: str = None, 
-                          width: int = 1024, height: int = 768) -> Tuple[str, int]:
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        # Début de l'élément suivant à analyser dans _buffer
+        self._pos = 0
+        # Instructions complètes reçues mais pas encore consommées par read_instruction
+        self.pending = ""
+
+    def feed(self, data: bytes) -> str:
+        """Ajouter des octets reçus; retourne le texte des instructions désormais complètes"""
+        buffer = self._buffer + self._decoder.decode(data)
+        pos, end = self._pos, 0
+        while True:
+            dot = buffer.find(".", pos)
+            if dot == -1:
+                break
+            terminator = dot + 1 + int(buffer[pos:dot])
+            if terminator >= len(buffer):
+                break
+            if buffer[terminator] == ";":
+                end = terminator + 1
+            elif buffer[terminator] != ",":
+                raise ValueError("Malformed Guacamole instruction")
+            pos = terminator + 1
+        self._buffer = buffer[end:]
+        self._pos = pos - end
+        return buffer[:end]
+
+    async def read_instruction(self, reader: asyncio.StreamReader) -> List[str]:
+        """Lire une seule instruction (poignée de main); les suivantes restent dans pending"""
+        while not self.pending:
+            data = await reader.read(64 * 1024)
+            if not data:
+                raise RDPBackendError("Gateway closed the connection during the handshake")
+            self.pending = self.feed(data)
+        end = _instruction_end(self.pending)
+        instruction, self.pending = self.pending[:end], self.pending[end:]
+        return decode_instructions(instruction)[0]
+
+
+def _instruction_end(text: str) -> int:
+    pos = 0
+    while True:
+        dot = text.index(".", pos)
+        terminator = dot + 1 + int(text[pos:dot])
+        if text[terminator] == ";":
+            return terminator + 1
+        pos = terminator + 1
+
+
+class PortAllocator:
+    """
+    Réservation atomique des ports locaux des passerelles.
+
+    Les ports sont pris dans une plage dédiée; chaque port réservé est protégé par un verrou
+    flock sur un fichier de lock_dir, partagé par les workers du proxy et libéré par le
+    noyau si le worker s'arrête, ce qui supprime la course entre le choix du port et le
+    bind du processus.
+    """
+
+    def __init__(self, first: int, last: int, lock_dir: str):
+        self.first = first
+        self.last = last
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+        # port -> descripteur du fichier verrouillé
+        self._held: Dict[int, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "PortAllocator":
+        first, last = (int(port) for port in RDP_BACKEND_PORTS.split("-"))
+        return cls(first, last, RDP_PORT_LOCK_DIR)
+
+    def acquire(self) -> int:
+        size = self.last - self.first + 1
+        # Départ aléatoire pour limiter la contention entre workers
+        offset = random.randrange(size)
+        for index in range(size):
+            port = self.first + (offset + index) % size
+            if port in self._held:
+                continue
+            fd = os.open(os.path.join(self.lock_dir, f"port-{port}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            if not self._bindable(port):
+                os.close(fd)
+                continue
+            self._held[port] = fd
+            return port
+        raise RDPBackendError(f"No free gateway port in {self.first}-{self.last}")
+
+    def release(self, port: Optional[int]):
+        fd = self._held.pop(port, None)
+        if fd is not None:
+            os.close(fd)
+
+    @staticmethod
+    def _bindable(port: int) -> bool:
+        """Le port n'est pas occupé par un processus hors du proxy"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(("127.0.0.1", port))
+                return True
+            except OSError:
+                return False
+
+    def in_use(self) -> int:
+        return len(self._held)
+
+
+class RDPBackend:
+    """Processus passerelle (démarré à l'avance ou à la demande) et session RDP associée"""
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        self.host: Optional[str] = None
+        self.port: Optional[int] = None
+        self.username: Optional[str] = None
+        self.local_port: Optional[int] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        # Tâche de suivi du processus (référence gardée: la boucle ne garde que des références faibles)
+        self.watcher: Optional[asyncio.Task] = None
+        self.status = "starting"
+        self.created_at = time.time()
+        self.idle_since: Optional[float] = None
+        self.requested_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.first_frame_at: Optional[float] = None
+        self.exited_at: Optional[float] = None
+        self.pooled = False
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.parser = GuacamoleParser()
+        # Identifiant renvoyé par guacd (ready)
+        self.connection_id: Optional[str] = None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode if self.process else None
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "status": self.status,
+            "host": self.host,
+            "port": self.port,
+            "username": self.username,
+            "local_port": self.local_port,
+            "pid": self.process.pid if self.process else None,
+            "returncode": self.returncode,
+            "pooled": self.pooled,
+            "created_at": self.created_at,
+            "startup_seconds": round(self.ready_at - self.requested_at, 3) if self.ready_at else None,
+            "time_to_first_frame": round(self.first_frame_at - self.requested_at, 3) if self.first_frame_at else None,
+            "exited_at": self.exited_at
+        }
+
+
+class FreeRDPService:
+    """
+    Passerelle RDP -> WebSocket: un processus headless (guacd/FreeRDP) par session.
+
+    Les processus sont lancés et surveillés depuis la boucle asyncio du proxy WebSocket
+    (aucun thread par session); le proxy relaie ensuite le flux Guacamole vers le navigateur.
+    Un pool garde pool_min processus démarrés d'avance (sans dépasser pool_max processus au
+    total) pour éviter l'attente du démarrage à la connexion; les processus inactifs au-delà
+    du minimum sont arrêtés après idle_ttl secondes et une tâche de fond retire les
+    processus morts.
+    """
+
+    def __init__(self, command: str = None, pool_min: int = None, pool_max: int = None,
+                 idle_ttl: float = None, ports: PortAllocator = None):
+        self.command = command or RDP_BACKEND_COMMAND
+        self.pool_min = RDP_POOL_MIN if pool_min is None else pool_min
+        self.pool_max = pool_max or RDP_POOL_MAX
+        self.idle_ttl = RDP_POOL_IDLE_TTL if idle_ttl is None else idle_ttl
+        self._ports = ports
+        self.active_sessions: Dict[str, RDPBackend] = {}
+        self._idle: Deque[RDPBackend] = deque()
+        self._starting = 0
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "misses": 0, "spawned": 0, "spawn_failures": 0,
+                      "expired": 0, "reaped": 0, "rejected": 0}
+        self._startup_times: Deque[float] = deque(maxlen=500)
+        self._first_frame_times: Deque[float] = deque(maxlen=500)
+
+    @property
+    def ports(self) -> PortAllocator:
+        if self._ports is None:
+            self._ports = PortAllocator.from_env()
+        return self._ports
+
+    def is_available(self) -> bool:
+        """Vrai si l'exécutable de la passerelle est installé"""
+        executable = shlex.split(self.command)[0]
+        return os.path.exists(executable) or shutil.which(executable) is not None
+
+    def start_pool(self):
+        """Démarrer la tâche de maintenance du pool (remplissage, expiration, processus morts)"""
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._maintain_loop())
+
+    async def shutdown(self):
+        """Arrêter la maintenance et tous les processus (arrêt du proxy)"""
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            await asyncio.gather(self._reaper_task, return_exceptions=True)
+        idle, self._idle = list(self._idle), deque()
+        await asyncio.gather(*[self._stop(backend) for backend in idle],
+                             *[self.terminate_session(session_id) for session_id in list(self.active_sessions)])
+
+    async def create_rdp_session(self, host: str, port: int = 3389, username: str = None,
+                                 password: str = None, domain: str = None, width: int = 1024,
+                                 height: int = 768, dpi: int = 96, session_id: str = None) -> RDPBackend:
         """
-        Crée une session RDP et retourne l'ID de session et le port local
+        Prend une passerelle du pool (ou en lance une), s'y connecte et effectue la poignée
+        de main Guacamole; la session retournée est prête à être relayée (reader/writer)
         """
-        session_id = str(uuid.uuid4())
-        local_port = self._get_free_port()
-        
+        requested_at = time.time()
+        self.start_pool()
+        backend = await self._checkout()
+        backend.session_id = session_id or str(uuid.uuid4())
+        backend.host, backend.port, backend.username = host, port, username
+        backend.requested_at = requested_at
+        self.active_sessions[backend.session_id] = backend
         try:
-            # Créer un socket pour la communication avec FreeRDP
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.bind(('localhost', local_port))
-            server_socket.listen(1)
-            
-            # Construire la commande FreeRDP
-            cmd = self._build_freerdp_command(
-                host, port, username, password, domain, width, height, local_port
-            )
-            
-            # Démarrer le processus FreeRDP
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid  # Créer un nouveau groupe de processus
-            )
-            
-            # Stocker les informations de session
-            self.active_sessions[session_id] = {
-                'process': process,
-                'socket': server_socket,
-                'local_port': local_port,
-                'host': host,
-                'port': port,
-                'username': username,
-                'created_at': time.time(),
-                'status': 'connecting'
-            }
-            
-            # Démarrer un thread pour gérer la connexion
-            thread = threading.Thread(
-                target=self._handle_rdp_connection,
-                args=(session_id, server_socket),
-                daemon=True
-            )
-            thread.start()
-            
-            logger.info(f"Created RDP session {session_id} for {host}:{port} on local port {local_port}")
-            return session_id, local_port
-            
-        except Exception as e:
-            logger.error(f"Failed to create RDP session: {e}")
-            if 'server_socket' in locals():
-                server_socket.close()
+            if backend.writer is None:
+                await self._connect(backend)
+            await self._handshake(backend, {
+                "hostname": host,
+                "port": str(port),
+                "username": username or "",
+                "password": password or "",
+                "domain": domain or "",
+                "width": str(width),
+                "height": str(height),
+                "dpi": str(dpi),
+                "ignore-cert": "true",
+                "security": "any",
+            }, width, height, dpi)
+        except Exception:
+            await self.terminate_session(backend.session_id)
             raise
-    
-    def _build_freerdp_command(self, host: str, port: int, username: str, 
-                              password: str, domain: str, width: int, 
-                              height: int, local_port: int) -> list:
-        """Construit la commande FreeRDP"""
-        cmd = [
-            self.freerdp_path,
-            f'/v:{host}:{port}',
-            f'/size:{width}x{height}',
-            '/bpp:32',
-            '/compression',
-            '/clipboard',
-            '/audio-mode:0',  # Pas d'audio pour simplifier
-            '/cert:ignore',   # Ignorer les erreurs de certificat
-            f'/port:{local_port}',  # Port pour la communication
-        ]
-        
-        if username:
-            cmd.append(f'/u:{username}')
-        if password:
-            cmd.append(f'/p:{password}')
-        if domain:
-            cmd.append(f'/d:{domain}')
-            
-        return cmd
-    
-    def _handle_rdp_connection(self, session_id: str, server_socket: socket.socket):
-        """Gère la connexion RDP dans un thread séparé"""
+
+        backend.status = "connected"
+        backend.ready_at = time.time()
+        self._startup_times.append(backend.ready_at - requested_at)
+        logger.info(f"RDP session {backend.session_id} ready for {host}:{port} "
+                    f"(gateway pid {backend.process.pid}, {'warm' if backend.pooled else 'cold'}, "
+                    f"{backend.ready_at - requested_at:.2f}s)")
+        return backend
+
+    def record_first_frame(self, backend: RDPBackend):
+        """Appelé par le proxy quand la première image complète (sync) part vers le navigateur"""
+        if backend.first_frame_at is None and backend.requested_at:
+            backend.first_frame_at = time.time()
+            self._first_frame_times.append(backend.first_frame_at - backend.requested_at)
+
+    async def _checkout(self) -> RDPBackend:
+        while self._idle:
+            backend = self._idle.popleft()
+            if backend.returncode is None:
+                self.stats["hits"] += 1
+                backend.status = "connecting"
+                return backend
+            self.stats["reaped"] += 1
+            self.ports.release(backend.local_port)
+
+        if self._total() >= self.pool_max:
+            self.stats["rejected"] += 1
+            raise RDPBackendError(f"RDP gateway limit reached ({self.pool_max} processes)")
+        self.stats["misses"] += 1
+        # Lancement à la demande: la connexion de test devient celle de la session
+        backend = await self._spawn(keep_connection=True)
+        backend.status = "connecting"
+        return backend
+
+    def _total(self) -> int:
+        return len(self.active_sessions) + len(self._idle) + self._starting
+
+    async def _spawn(self, keep_connection: bool = False) -> RDPBackend:
+        """Lancer un processus passerelle et attendre qu'il écoute sur son port"""
+        backend = RDPBackend()
+        self._starting += 1
         try:
-            # Attendre une connexion WebSocket
-            client_socket, addr = server_socket.accept()
-            logger.info(f"WebSocket connected to RDP session {session_id}")
-            
-            session = self.active_sessions.get(session_id)
-            if not session:
-                client_socket.close()
-                return
-                
-            session['status'] = 'connected'
-            session['client_socket'] = client_socket
-            
-            # Gérer le transfert de données bidirectionnel
-            self._handle_data_transfer(session_id, client_socket, session['process'])
-            
-        except Exception as e:
-            logger.error(f"Error handling RDP connection {session_id}: {e}")
+            backend.local_port = self.ports.acquire()
+            cmd = [part.format(port=backend.local_port) for part in shlex.split(self.command)]
+            try:
+                backend.process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                    start_new_session=True  # Créer un nouveau groupe de processus
+                )
+            except OSError as e:
+                raise RDPBackendError(f"Cannot start RDP gateway {cmd[0]}: {e}") from e
+            backend.watcher = asyncio.create_task(self._watch_process(backend))
+            await self._connect(backend)
+            if not keep_connection:
+                backend.writer.close()
+                backend.reader = backend.writer = None
+        except Exception:
+            self.stats["spawn_failures"] += 1
+            await self._stop(backend)
+            raise
         finally:
-            self._cleanup_session(session_id)
-    
-    def _handle_data_transfer(self, session_id: str, client_socket: socket.socket, 
-                             process: subprocess.Popen):
-        """Gère le transfert de données entre WebSocket et FreeRDP"""
-        try:
-            # Cette partie nécessiterait une implémentation plus complexe
-            # pour interfacer correctement avec FreeRDP
-            # Pour l'instant, on simule une connexion
-            
-            while process.poll() is None:  # Tant que le processus est actif
-                try:
-                    # Lire les données du client WebSocket
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-                        
-                    # Ici, on devrait envoyer les données à FreeRDP
-                    # et récupérer la réponse pour la renvoyer au client
-                    
-                    # Pour l'instant, on envoie juste un message de test
-                    response = b"RDP data simulation"
-                    client_socket.send(response)
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    logger.error(f"Data transfer error for session {session_id}: {e}")
-                    break
-                    
-        except Exception as e:
-            logger.error(f"Error in data transfer for session {session_id}: {e}")
-    
-    def _get_free_port(self) -> int:
-        """Trouve un port libre pour la communication"""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind(('', 0))
-            s.listen(1)
-            port = s.getsockname()[1]
-        return port
-    
-    def get_session_status(self, session_id: str) -> Optional[dict]:
-        """Retourne le statut d'une session"""
-        session = self.active_sessions.get(session_id)
-        if not session:
-            return None
-            
+            self._starting -= 1
+        self.stats["spawned"] += 1
+        return backend
+
+    async def _watch_process(self, backend: RDPBackend):
+        """Suivre la fin du processus (arrêt normal, plantage ou signal)"""
+        returncode = await backend.process.wait()
+        backend.exited_at = time.time()
+        if backend.status != "terminated":
+            backend.status = "exited"
+            logger.warning(f"RDP gateway pid {backend.process.pid} "
+                           f"(session {backend.session_id}) exited with code {returncode}")
+
+    async def _connect(self, backend: RDPBackend):
+        """Attendre que la passerelle écoute sur son port"""
+        deadline = time.monotonic() + RDP_BACKEND_START_TIMEOUT
+        while True:
+            if backend.returncode is not None:
+                raise RDPBackendError(f"RDP gateway exited with code {backend.returncode}")
+            try:
+                backend.reader, backend.writer = await asyncio.open_connection("127.0.0.1", backend.local_port)
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise RDPBackendError(f"RDP gateway not listening after {RDP_BACKEND_START_TIMEOUT}s")
+                await asyncio.sleep(0.05)
+
+    async def _handshake(self, backend: RDPBackend, parameters: Dict[str, str],
+                         width: int, height: int, dpi: int):
+        """select rdp -> args -> size/audio/video/image/connect -> ready"""
+        backend.writer.write(encode_instruction("select", "rdp").encode())
+        await backend.writer.drain()
+        args = await asyncio.wait_for(backend.parser.read_instruction(backend.reader),
+                                      RDP_BACKEND_START_TIMEOUT)
+        if args[0] != "args":
+            raise RDPBackendError(f"Unexpected gateway instruction: {args[0]}")
+
+        # Le premier argument annonce la version du protocole: la même est renvoyée
+        values = [name if name.startswith("VERSION_") else parameters.get(name, "") for name in args[1:]]
+        backend.writer.write("".join([
+            encode_instruction("size", width, height, dpi),
+            encode_instruction("audio"),
+            encode_instruction("video"),
+            encode_instruction("image", "image/png", "image/jpeg", "image/webp"),
+            encode_instruction("connect", *values)
+        ]).encode())
+        await backend.writer.drain()
+
+        ready = await asyncio.wait_for(backend.parser.read_instruction(backend.reader),
+                                       RDP_BACKEND_START_TIMEOUT)
+        if ready[0] == "error":
+            raise RDPBackendError(f"RDP connection refused: {ready[1] if len(ready) > 1 else ''}")
+        if ready[0] != "ready":
+            raise RDPBackendError(f"Unexpected gateway instruction: {ready[0]}")
+        backend.connection_id = ready[1] if len(ready) > 1 else backend.session_id
+
+    async def _maintain_loop(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"RDP gateway pool maintenance failed: {e}")
+            await asyncio.sleep(RDP_POOL_REAP_INTERVAL)
+
+    async def maintain(self) -> dict:
+        """
+        Une passe de maintenance: retire les processus morts (inactifs ou de sessions
+        actives), arrête les inactifs expirés au-delà du minimum et recomplète le pool
+        """
+        now = time.time()
+        reaped = expired = 0
+        for backend in [backend for backend in self._idle if backend.returncode is not None]:
+            self._idle.remove(backend)
+            self.ports.release(backend.local_port)
+            reaped += 1
+        for session_id, backend in list(self.active_sessions.items()):
+            if backend.returncode is not None:
+                await self.terminate_session(session_id)
+                reaped += 1
+        while len(self._idle) > self.pool_min and now - self._idle[0].idle_since > self.idle_ttl:
+            await self._stop(self._idle.popleft())
+            expired += 1
+        self.stats["reaped"] += reaped
+        self.stats["expired"] += expired
+
+        missing = min(self.pool_min - len(self._idle) - self._starting, self.pool_max - self._total())
+        if missing > 0:
+            results = await asyncio.gather(*[self._spawn() for _ in range(missing)], return_exceptions=True)
+            for result in results:
+                if isinstance(result, RDPBackend):
+                    result.status = "idle"
+                    result.pooled = True
+                    result.idle_since = time.time()
+                    self._idle.append(result)
+                else:
+                    logger.error(f"Failed to pre-start RDP gateway: {result}")
+        return {"reaped": reaped, "expired": expired, "started": max(missing, 0)}
+
+    def get_pool_stats(self) -> dict:
+        """Compteurs du pool et temps de démarrage / de première image des sessions récentes"""
+        lookups = self.stats["hits"] + self.stats["misses"]
         return {
-            'session_id': session_id,
-            'status': session['status'],
-            'host': session['host'],
-            'port': session['port'],
-            'username': session['username'],
-            'created_at': session['created_at'],
-            'local_port': session['local_port']
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "idle": len(self._idle),
+            "active": len(self.active_sessions),
+            "starting": self._starting,
+            "ports_in_use": self.ports.in_use(),
+            "config": {"min": self.pool_min, "max": self.pool_max, "idle_ttl": self.idle_ttl},
+            "startup_seconds": _summary(self._startup_times),
+            "time_to_first_frame": _summary(self._first_frame_times)
         }
-    
-    def terminate_session(self, session_id: str) -> bool:
-        """Termine une session RDP"""
-        session = self.active_sessions.get(session_id)
-        if not session:
-            return False
-            
-        try:
-            # Terminer le processus FreeRDP
-            if session['process'].poll() is None:
-                os.killpg(os.getpgid(session['process'].pid), signal.SIGTERM)
-                
-            self._cleanup_session(session_id)
-            logger.info(f"Terminated RDP session {session_id}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error terminating session {session_id}: {e}")
+
+    def get_session_status(self, session_id: str) -> Optional[dict]:
+        """Retourne le statut d'une session"""
+        backend = self.active_sessions.get(session_id)
+        return backend.to_dict() if backend else None
+
+    async def terminate_session(self, session_id: str) -> bool:
+        """Termine une session RDP (SIGTERM au groupe du processus, puis SIGKILL)"""
+        backend = self.active_sessions.pop(session_id, None)
+        if not backend:
             return False
-    
-    def _cleanup_session(self, session_id: str):
-        """Nettoie les ressources d'une session"""
-        session = self.active_sessions.get(session_id)
-        if not session:
-            return
-            
+        await self._stop(backend)
+        logger.info(f"Terminated RDP session {session_id}")
+        return True
+
+    async def _stop(self, backend: RDPBackend):
+        backend.status = "terminated"
+        if backend.writer:
+            backend.writer.close()
+        if backend.process and backend.returncode is None:
+            self._signal(backend, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(backend.process.wait(), RDP_BACKEND_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"RDP gateway pid {backend.process.pid} ignored SIGTERM, killing it")
+                self._signal(backend, signal.SIGKILL)
+                await backend.process.wait()
+        if backend.watcher and not backend.watcher.done():
+            backend.watcher.cancel()
+            if backend.process and backend.exited_at is None and backend.returncode is not None:
+                backend.exited_at = time.time()
+        backend.watcher = None
+        self.ports.release(backend.local_port)
+
+    @staticmethod
+    def _signal(backend: RDPBackend, sig: int):
         try:
-            # Fermer le socket client
-            if 'client_socket' in session:
-                session['client_socket'].close()
-                
-            # Fermer le socket serveur
-            if 'socket' in session:
-                session['socket'].close()
-                
-            # Terminer le processus si nécessaire
-            if session['process'].poll() is None:
-                try:
-                    os.killpg(os.getpgid(session['process'].pid), signal.SIGTERM)
-                except:
-                    pass
-                    
-        except Exception as e:
-            logger.error(f"Error cleaning up session {session_id}: {e}")
-        finally:
-            # Supprimer de la liste des sessions actives
-            if session_id in self.active_sessions:
-                del self.active_sessions[session_id]
-    
+            os.killpg(os.getpgid(backend.process.pid), sig)
+        except ProcessLookupError:
+            pass
+
     def list_active_sessions(self) -> list:
         """Liste toutes les sessions actives"""
-        return [
-            self.get_session_status(session_id) 
-            for session_id in self.active_sessions.keys()
-        ]
-    
-    def cleanup_inactive_sessions(self, timeout_seconds: int = 3600):
-        """Nettoie les sessions inactives"""
-        current_time = time.time()
-        inactive_sessions = []
-        
-        for session_id, session in self.active_sessions.items():
-            if current_time - session['created_at'] > timeout_seconds:
-                if session['process'].poll() is not None:  # Processus terminé
-                    inactive_sessions.append(session_id)
-                    
-        for session_id in inactive_sessions:
-            self._cleanup_session(session_id)
-            
-        return len(inactive_sessions)
+        return [backend.to_dict() for backend in self.active_sessions.values()]
+
+
+def _summary(values) -> Optional[dict]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 3),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+    }
 
 # Instance globale du service
 freerdp_service = FreeRDPService()
-
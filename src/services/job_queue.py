@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Levée dans un job lorsque son annulation a été demandée"""
+
+
+class Job:
+    """Job asynchrone exécuté par le pool de workers"""
+
+    def __init__(self, job_type: str, metadata: Dict[str, Any] = None):
+        self.id = str(uuid.uuid4())
+        self.job_type = job_type
+        self.metadata = metadata or {}
+        self.status = 'queued'  # queued, running, success, error, cancelled
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.completed_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.on_cancel: Optional[Callable[["Job"], None]] = None
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def raise_if_cancelled(self):
+        """Point d'annulation coopératif à appeler entre deux étapes"""
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} annulé")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('success', 'error', 'cancelled')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'type': self.job_type,
+            'status': self.status,
+            'metadata': self.metadata,
+            'result': self.result,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'completed_at': self.completed_at
+        }
+
+
+class JobQueue:
+    """File de jobs avec un pool de workers configurable"""
+
+    def __init__(self, max_workers: int = 4, max_finished_jobs: int = 500):
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Sérialise find_active_job + submit (voir exclusive())
+        self._submit_lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lab-job')
+
+    def submit(self, job_type: str, func: Callable[..., Optional[Dict[str, Any]]], *args,
+               metadata: Dict[str, Any] = None, on_cancel: Callable[[Job], None] = None, **kwargs) -> Job:
+        """
+        Ajoute un job à la file; func(job, *args, **kwargs) est exécutée par un worker.
+        on_cancel(job) est appelé si le job est annulé avant d'avoir démarré.
+        """
+        job = Job(job_type, metadata)
+        job.on_cancel = on_cancel
+        with self._submit_lock:
+            with self._lock:
+                self.jobs[job.id] = job
+                self._prune_finished()
+            job.future = self._executor.submit(self._run, job, func, args, kwargs)
+        logger.info(f"Job {job.id} ({job_type}) mis en file")
+        return job
+
+    def _run(self, job: Job, func: Callable, args: tuple, kwargs: dict):
+        """Exécute un job dans un worker et enregistre son état final"""
+        if job.cancel_requested:
+            # Annulé entre cancel_event.set() et future.cancel(): cancel() n'a pas pu le retirer
+            self._cancelled_before_start(job)
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = 'success'
+        except JobCancelled as e:
+            job.status = 'cancelled'
+            job.error = str(e)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.job_type}) en erreur: {e}")
+            job.status = 'error'
+            job.error = str(e)
+        finally:
+            job.completed_at = time.time()
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Annule un job: immédiatement s'il est en file, à la prochaine étape s'il tourne"""
+        job = self.jobs.get(job_id)
+        if not job or job.finished:
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._cancelled_before_start(job)
+        logger.info(f"Annulation demandée pour le job {job_id}")
+        return job
+
+    def _cancelled_before_start(self, job: Job):
+        """État final d'un job annulé avant d'avoir démarré (une seule fois: future.cancel() ou _run)"""
+        job.status = 'cancelled'
+        job.completed_at = time.time()
+        if job.on_cancel:
+            try:
+                job.on_cancel(job)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'annulation du job {job.id}: {e}")
+
+    def list_jobs(self, status: str = None, job_type: str = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [
+            job for job in jobs
+            if (status is None or job.status == status)
+            and (job_type is None or job.job_type == job_type)
+        ]
+
+    def find_active_job(self, job_type: str, **metadata) -> Optional[Job]:
+        """Retourne le job en file ou en cours correspondant aux métadonnées"""
+        for job in self.list_jobs(job_type=job_type):
+            if job.finished:
+                continue
+            if all(job.metadata.get(key) == value for key, value in metadata.items()):
+                return job
+        return None
+
+    @contextmanager
+    def exclusive(self, job_type: str, **metadata) -> Iterator[Optional[Job]]:
+        """
+        Vérifier puis soumettre un job unique en une seule étape atomique:
+
+            with job_queue.exclusive("deploy", lab_id=lab.id) as active_job:
+                if active_job:
+                    return 409
+                job_queue.submit("deploy", ...)
+
+        Le job actif correspondant (ou None) est fourni; aucun autre submit ne peut
+        s'intercaler avant la fin du bloc.
+        """
+        with self._submit_lock:
+            yield self.find_active_job(job_type, **metadata)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {'max_workers': self.max_workers, 'total': 0}
+        for job in self.list_jobs():
+            stats[job.status] = stats.get(job.status, 0) + 1
+            stats['total'] += 1
+        return stats
+
+    def _prune_finished(self):
+        """Oublie les plus anciens jobs terminés au-delà de max_finished_jobs"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+
+# Instance globale
+job_queue = JobQueue(max_workers=int(os.getenv("DEPLOY_MAX_WORKERS", 4)))
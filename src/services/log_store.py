@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+from sqlalchemy import delete, func, insert, select
+from src.models.lab import db, DeploymentLog, DeploymentLogChunk
+
+logger = logging.getLogger(__name__)
+
+chunks_table = DeploymentLogChunk.__table__
+
+
+class DeploymentLogStore:
+    """
+    Stockage en ajout seul des logs de déploiement.
+
+    Chaque écriture ajoute une ligne (log_id, seq) dans deployment_log_chunks avec sa
+    position dans le log; les lectures par plage ou par la fin ne chargent que les
+    morceaux concernés. À la fermeture d'un log, ses morceaux peuvent être regroupés
+    en segments compressés (zlib) sans changer les positions.
+    """
+
+    def __init__(self, compress_closed: bool = True, segment_size: int = 256 * 1024):
+        self.compress_closed = compress_closed
+        self.segment_size = segment_size
+        # Un verrou par log ouvert: les écritures de déploiements différents ne s'attendent pas;
+        # _lock ne protège que le dictionnaire des verrous
+        self._lock = threading.Lock()
+        self._log_locks: Dict[int, threading.Lock] = {}
+        # log_id -> (prochain seq, position de fin) pour éviter un SELECT par écriture
+        self._positions: Dict[int, tuple] = {}
+
+    def _log_lock(self, log_id: int) -> threading.Lock:
+        with self._lock:
+            lock = self._log_locks.get(log_id)
+            if lock is None:
+                lock = self._log_locks[log_id] = threading.Lock()
+            return lock
+
+    def append(self, log_id: int, text: str, engine=None):
+        """
+        Ajouter un morceau à un log.
+
+        L'écriture passe par sa propre connexion: elle peut être appelée depuis un
+        thread sans contexte d'application si engine est fourni.
+        """
+        if not text:
+            return
+        engine = engine or db.engine
+        with self._log_lock(log_id):
+            try:
+                with engine.begin() as conn:
+                    seq, offset = self._get_position(conn, log_id)
+                    conn.execute(insert(chunks_table).values(
+                        log_id=log_id,
+                        seq=seq,
+                        offset=offset,
+                        size=len(text),
+                        data=text.encode('utf-8'),
+                        compressed=False,
+                        created_at=datetime.utcnow()
+                    ))
+                self._positions[log_id] = (seq + 1, offset + len(text))
+            except Exception:
+                self._positions.pop(log_id, None)
+                raise
+
+    def writer(self, log_id: int) -> Callable[[str], None]:
+        """Retourner un callback d'écriture utilisable depuis n'importe quel thread"""
+        engine = db.engine
+        return lambda text: self.append(log_id, text, engine=engine)
+
+    def _get_position(self, conn, log_id: int) -> tuple:
+        if log_id not in self._positions:
+            last_seq, size = conn.execute(
+                select(func.max(chunks_table.c.seq), func.coalesce(func.sum(chunks_table.c.size), 0))
+                .where(chunks_table.c.log_id == log_id)
+            ).first()
+            self._positions[log_id] = ((last_seq or 0) + 1, size or 0)
+        return self._positions[log_id]
+
+    def read(self, log_id: int, offset: int = 0, length: int = None) -> Optional[Dict[str, Any]]:
+        """Lire une plage d'un log (positions en caractères)"""
+        row = db.session.execute(
+            select(DeploymentLog.status, DeploymentLog.logs).where(DeploymentLog.id == log_id)
+        ).first()
+        if row is None:
+            db.session.commit()
+            return None
+        status, legacy_logs = row
+
+        query = select(DeploymentLogChunk).where(
+            DeploymentLogChunk.log_id == log_id,
+            DeploymentLogChunk.offset + DeploymentLogChunk.size > offset
+        )
+        if length is not None:
+            query = query.where(DeploymentLogChunk.offset < offset + length)
+        chunks = db.session.execute(query.order_by(DeploymentLogChunk.offset)).scalars().all()
+        db.session.commit()
+
+        if chunks:
+            start = chunks[0].offset
+            text = ''.join(chunk.text for chunk in chunks)
+        else:
+            # Logs écrits avant le stockage par morceaux
+            start = 0
+            text = legacy_logs or ''
+        content = text[max(0, offset - start):]
+        if length is not None:
+            content = content[:length]
+        return {
+            'status': status,
+            'content': content,
+            'offset': offset + len(content)
+        }
+
+    def tail(self, log_id: int, lines: int = 100) -> Optional[Dict[str, Any]]:
+        """Lire les dernières lignes d'un log en remontant les morceaux depuis la fin"""
+        status = db.session.execute(
+            select(DeploymentLog.status).where(DeploymentLog.id == log_id)
+        ).scalar()
+        if status is None:
+            db.session.commit()
+            return None
+
+        parts: List[str] = []
+        newlines = 0
+        end = 0
+        query = select(DeploymentLogChunk).where(DeploymentLogChunk.log_id == log_id).order_by(DeploymentLogChunk.offset.desc())
+        for chunk in db.session.execute(query.execution_options(yield_per=16)).scalars():
+            text = chunk.text
+            end = max(end, chunk.offset + chunk.size)
+            parts.append(text)
+            newlines += text.count('\n')
+            if newlines > lines:
+                break
+        db.session.commit()
+
+        if not parts:
+            result = self.read(log_id)
+            text, end = result['content'], result['offset']
+        else:
+            text = ''.join(reversed(parts))
+        kept = text.splitlines(True)[-lines:] if lines > 0 else []
+        content = ''.join(kept)
+        return {
+            'status': status,
+            'content': content,
+            'offset': end - len(content),
+            'end_offset': end
+        }
+
+    def get_stats(self, log_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """Taille et nombre de morceaux de plusieurs logs en une requête"""
+        if not log_ids:
+            return {}
+        rows = db.session.execute(
+            select(
+                DeploymentLogChunk.log_id,
+                func.coalesce(func.sum(DeploymentLogChunk.size), 0),
+                func.count(DeploymentLogChunk.id)
+            )
+            .where(DeploymentLogChunk.log_id.in_(log_ids))
+            .group_by(DeploymentLogChunk.log_id)
+        ).all()
+        return {log_id: {'size': size, 'chunks': count} for log_id, size, count in rows}
+
+    def close(self, log_id: int, engine=None):
+        """
+        Fermer un log: regrouper ses morceaux en segments compressés si activé.
+
+        Seul le verrou de ce log est tenu; la compression se fait hors transaction et
+        seul le remplacement des morceaux est écrit dans une transaction courte.
+        """
+        lock = self._log_lock(log_id)
+        try:
+            with lock:
+                self._positions.pop(log_id, None)
+                if self.compress_closed:
+                    self._compress(log_id, engine or db.engine)
+        finally:
+            with self._lock:
+                self._log_locks.pop(log_id, None)
+
+    def _compress(self, log_id: int, engine):
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    select(chunks_table)
+                    .where(chunks_table.c.log_id == log_id, chunks_table.c.compressed == False)  # noqa: E712
+                    .order_by(chunks_table.c.offset)
+                ).all()
+            replacements = []
+            for segment in self._group_segments(rows):
+                text = b''.join(row.data for row in segment)
+                compressed = zlib.compress(text, 6)
+                if len(segment) == 1 and len(compressed) >= len(text):
+                    continue
+                replacements.append((segment, compressed))
+            if not replacements:
+                return
+            with engine.begin() as conn:
+                for segment, compressed in replacements:
+                    conn.execute(delete(chunks_table).where(chunks_table.c.id.in_([row.id for row in segment])))
+                    conn.execute(insert(chunks_table).values(
+                        log_id=log_id,
+                        seq=segment[0].seq,
+                        offset=segment[0].offset,
+                        size=sum(row.size for row in segment),
+                        data=compressed,
+                        compressed=True,
+                        created_at=segment[-1].created_at
+                    ))
+        except Exception as e:
+            logger.error(f"Erreur lors de la compression du log {log_id}: {e}")
+
+    def _group_segments(self, rows) -> List[list]:
+        """Regrouper des morceaux contigus en segments d'environ segment_size caractères"""
+        segments, current, current_size = [], [], 0
+        for row in rows:
+            if current and current_size + row.size > self.segment_size:
+                segments.append(current)
+                current, current_size = [], 0
+            current.append(row)
+            current_size += row.size
+        if current:
+            segments.append(current)
+        return segments
+
+
+# Instance globale
+log_store = DeploymentLogStore(compress_closed=os.getenv("LOG_COMPRESS_CLOSED", "True") == "True")
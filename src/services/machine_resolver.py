@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, create_engine, text
+
+from src.models.lab import DATABASE_URL, machine_endpoint_listeners
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VNC_PORT = 5901
+DEFAULT_RDP_PORT = 3389
+# Durée de validité d'une entrée chargée de la base, et d'une machine introuvable
+RESOLVER_TTL = float(os.getenv("WS_RESOLVER_TTL", 300))
+RESOLVER_NEGATIVE_TTL = float(os.getenv("WS_RESOLVER_NEGATIVE_TTL", 5))
+# Intervalle de lecture des événements machine_endpoint_events (autres processus)
+RESOLVER_POLL_INTERVAL = float(os.getenv("WS_RESOLVER_POLL_INTERVAL", 2))
+# Conservation des événements: largement plus que l'intervalle de lecture (un worker en retard
+# au-delà se rattrape par RESOLVER_TTL); la purge est faite par les workers au plus une fois par minute
+RESOLVER_EVENT_RETENTION = float(os.getenv("WS_RESOLVER_EVENT_RETENTION", 60))
+
+
+class MachineEndpointResolver:
+    """
+    Index en mémoire machine -> adresse et ports, pour le proxy WebSocket.
+
+    La résolution d'une session est une lecture de dictionnaire; l'index est chargé au
+    démarrage, tenu à jour par les événements écrits lors des changements d'adresse
+    (directement dans le processus Flask, via machine_endpoint_events pour les workers
+    séparés) et complété par une requête exécutée hors de la boucle asyncio en cas d'absence.
+    """
+
+    def __init__(self, database_url: str = None):
+        self.database_url = database_url or DATABASE_URL
+        self._engine = None
+        # machine_id -> (expiration monotonic ou None, point d'accès ou None si introuvable)
+        self._entries: Dict[int, Tuple[Optional[float], Optional[dict]]] = {}
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._last_event_id: Optional[int] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "db_lookups": 0,
+                      "db_errors": 0, "events": 0, "events_pruned": 0}
+        machine_endpoint_listeners.append(self.apply_events)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = create_engine(self.database_url, pool_pre_ping=True)
+        return self._engine
+
+    @staticmethod
+    def _endpoint(lab_id: int, ip_address: str, vnc_port: int = DEFAULT_VNC_PORT,
+                  rdp_port: int = DEFAULT_RDP_PORT) -> dict:
+        return {"lab_id": lab_id, "ip_address": ip_address, "vnc_port": vnc_port, "rdp_port": rdp_port}
+
+    async def resolve(self, lab_id, machine_id) -> Optional[dict]:
+        """Point d'accès de la machine du lab, ou None si elle n'existe pas ou n'a pas d'adresse"""
+        try:
+            lab_id, machine_id = int(lab_id), int(machine_id)
+        except (TypeError, ValueError):
+            return None
+        self._ensure_poller()
+
+        entry = self._entries.get(machine_id)
+        if entry and (entry[0] is None or entry[0] > time.monotonic()):
+            if entry[1] is None:
+                self.stats["negative_hits"] += 1
+                return None
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            # Une seule requête par machine même si plusieurs sessions arrivent ensemble
+            future = self._inflight.get(machine_id)
+            if future is None:
+                future = asyncio.ensure_future(self._load(machine_id))
+                self._inflight[machine_id] = future
+                future.add_done_callback(lambda _: self._inflight.pop(machine_id, None))
+            await asyncio.shield(future)
+            entry = self._entries.get(machine_id)
+            if not entry or entry[1] is None:
+                return None
+
+        info = entry[1]
+        return info if info["lab_id"] == lab_id else None
+
+    async def _load(self, machine_id: int):
+        self.stats["db_lookups"] += 1
+        try:
+            row = await asyncio.to_thread(self._query, "SELECT lab_id, ip_address FROM machines WHERE id = :id",
+                                          id=machine_id)
+        except Exception as e:
+            # Erreur de base: ne rien mémoriser, la prochaine session réessaiera
+            self.stats["db_errors"] += 1
+            logger.error(f"Error resolving machine {machine_id}: {e}")
+            return
+        if row and row[0][1]:
+            self._entries[machine_id] = (time.monotonic() + RESOLVER_TTL, self._endpoint(row[0][0], row[0][1]))
+        else:
+            self._entries[machine_id] = (time.monotonic() + RESOLVER_NEGATIVE_TTL, None)
+
+    def _query(self, sql: str, **params) -> List[tuple]:
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(text(sql), params)]
+
+    async def warm(self):
+        """Charger toutes les machines ayant une adresse et se placer au dernier événement"""
+        try:
+            machines, last_event = await asyncio.gather(
+                asyncio.to_thread(self._query, "SELECT id, lab_id, ip_address FROM machines WHERE ip_address IS NOT NULL"),
+                asyncio.to_thread(self._query, "SELECT MAX(id) FROM machine_endpoint_events")
+            )
+        except Exception as e:
+            logger.warning(f"Machine endpoint index not warmed: {e}")
+            return
+        expires = time.monotonic() + RESOLVER_TTL
+        for machine_id, lab_id, ip_address in machines:
+            self._entries[machine_id] = (expires, self._endpoint(lab_id, ip_address))
+        self._last_event_id = last_event[0][0] or 0
+        self._ensure_poller()
+        logger.info(f"Machine endpoint index warmed with {len(machines)} machines")
+
+    def apply_events(self, events: List[dict]):
+        """Appliquer des changements d'adresse (appelable depuis un autre thread)"""
+        expires = time.monotonic() + RESOLVER_TTL
+        for e in events:
+            if e["ip_address"]:
+                self._entries[e["machine_id"]] = (expires, self._endpoint(e["lab_id"], e["ip_address"]))
+            else:
+                self._entries.pop(e["machine_id"], None)
+        self.stats["events"] += len(events)
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll_events())
+
+    async def _poll_events(self):
+        while True:
+            try:
+                if self._last_event_id is None:
+                    rows = await asyncio.to_thread(self._query, "SELECT MAX(id) FROM machine_endpoint_events")
+                    self._last_event_id = rows[0][0] or 0
+                else:
+                    rows = await asyncio.to_thread(
+                        self._query,
+                        "SELECT id, machine_id, lab_id, ip_address FROM machine_endpoint_events "
+                        "WHERE id > :last ORDER BY id LIMIT 1000",
+                        last=self._last_event_id
+                    )
+                    if rows:
+                        self._last_event_id = rows[-1][0]
+                        self.apply_events([{"machine_id": r[1], "lab_id": r[2], "ip_address": r[3]} for r in rows])
+                if time.monotonic() - self._last_prune >= min(60.0, RESOLVER_EVENT_RETENTION):
+                    self._last_prune = time.monotonic()
+                    self.stats["events_pruned"] += await asyncio.to_thread(self._prune_events)
+            except Exception as e:
+                logger.debug(f"Machine endpoint events not available: {e}")
+            await asyncio.sleep(RESOLVER_POLL_INTERVAL)
+
+    def _prune_events(self) -> int:
+        """
+        Supprimer les événements plus anciens que RESOLVER_EVENT_RETENTION (colonnes UTC naïves).
+
+        Le plus récent est toujours conservé: sur une table créée sans AUTOINCREMENT, SQLite
+        réutiliserait sinon les ids à partir de 1 et les workers (id > dernier id lu) ne
+        verraient plus les nouveaux événements.
+        """
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=RESOLVER_EVENT_RETENTION)
+        statement = text(
+            "DELETE FROM machine_endpoint_events WHERE created_at < :cutoff "
+            "AND id < (SELECT MAX(id) FROM machine_endpoint_events)"
+        ).bindparams(bindparam("cutoff", type_=DateTime))
+        with self.engine.begin() as conn:
+            return conn.execute(statement, {"cutoff": cutoff}).rowcount
+
+    def set_endpoint(self, lab_id: int, machine_id: int, ip_address: str,
+                     vnc_port: int = DEFAULT_VNC_PORT, rdp_port: int = DEFAULT_RDP_PORT):
+        """Fixer le point d'accès d'une machine sans expiration (essais, benchmark)"""
+        self._entries[int(machine_id)] = (None, self._endpoint(int(lab_id), ip_address, vnc_port, rdp_port))
+
+    async def get_rdp_credentials(self, session_id: Optional[str]) -> Optional[dict]:
+        """Identifiants RDP enregistrés avec une connexion distante (requête hors de la boucle)"""
+        if not session_id:
+            return None
+        try:
+            rows = await asyncio.to_thread(
+                self._query,
+                "SELECT username, password FROM remote_connections "
+                "WHERE session_id = :session_id AND connection_type = 'rdp'",
+                session_id=session_id
+            )
+        except Exception as e:
+            logger.error(f"Error getting RDP credentials: {e}")
+            return None
+        return {"username": rows[0][0], "password": rows[0][1]} if rows else None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "entries": len(self._entries), "last_event_id": self._last_event_id}
+
+
+# Instance globale
+machine_resolver = MachineEndpointResolver()
@@ -0,0 +1,196 @@
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Bornes des histogrammes de latence (secondes), celles des clients Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _Shard:
+    """Valeurs écrites par un seul thread: les incréments n'ont besoin d'aucun verrou"""
+
+    __slots__ = ("thread", "values", "histograms")
+
+    def __init__(self, thread: Optional[threading.Thread]):
+        self.thread = thread
+        # (nom, valeurs des labels) -> total (compteurs et jauges)
+        self.values: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        # (nom, valeurs des labels) -> [effectif de chaque intervalle..., somme]
+        self.histograms: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+
+    def merge(self, other: "_Shard"):
+        for key, value in other.values.copy().items():
+            self.values[key] = self.values.get(key, 0) + value
+        for key, buckets in other.histograms.copy().items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = list(buckets)
+            else:
+                for i, value in enumerate(buckets):
+                    mine[i] += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        values = self.registry._shard().values
+        key = (self.name, labelvalues)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """Jauge additive (inc/dec): la valeur exposée est la somme de tous les threads"""
+    kind = "gauge"
+
+    def dec(self, *labelvalues: str, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str):
+        histograms = self.registry._shard().histograms
+        key = (self.name, labelvalues)
+        counts = histograms.get(key)
+        if counts is None:
+            # un intervalle par borne, un pour +Inf, puis la somme
+            counts = histograms[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+class MetricsRegistry:
+    """
+    Métriques au format d'exposition texte Prometheus/OpenMetrics.
+
+    Chaque thread écrit dans ses propres dictionnaires (threading.local): les incréments
+    et observations ne prennent aucun verrou. L'exposition additionne les fragments des
+    threads et reporte ceux des threads terminés dans un fragment commun, pour que les
+    serveurs qui créent un thread par requête ne les accumulent pas.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()
+        # Fonctions appelées à l'exposition: [(nom, type, aide, [(labels, valeur)])]
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable):
+        """Ajouter des familles calculées à l'exposition (statistiques d'autres services)"""
+        self._collectors.append(collector)
+
+    def _snapshot(self) -> _Shard:
+        total = _Shard(None)
+        with self._lock:
+            alive = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    alive.append(shard)
+                else:
+                    # Plus aucune écriture possible: fusion définitive
+                    self._retired.merge(shard)
+            self._shards = alive
+            total.merge(self._retired)
+            for shard in alive:
+                total.merge(shard)
+        return total
+
+    def render(self) -> str:
+        snapshot = self._snapshot()
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if isinstance(metric, Histogram):
+                for (name, labelvalues), counts in sorted(snapshot.histograms.items()):
+                    if name != metric.name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), counts):
+                        cumulative += count
+                        le = f'le="{_format_value(bound)}"'
+                        lines.append(f"{name}_bucket{_format_labels(metric.labelnames, labelvalues, le)} {cumulative}")
+                    labels = _format_labels(metric.labelnames, labelvalues)
+                    lines.append(f"{name}_sum{labels} {_format_value(counts[-1])}")
+                    lines.append(f"{name}_count{labels} {cumulative}")
+            else:
+                for (name, labelvalues), value in sorted(snapshot.values.items()):
+                    if name == metric.name:
+                        labels = _format_labels(metric.labelnames, labelvalues)
+                        lines.append(f"{name}{labels} {_format_value(value)}")
+
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Registre global, exposé sur /metrics
+metrics_registry = MetricsRegistry()
@@ -8,6 +8,9 @@ from datetime import datetime, timedelta
 from collections import deque
 import json
 
+from src.models.lab import cache_invalidation_listeners
+from src.services.cache_engine import CacheEngine
+
 logger = logging.getLogger(__name__)
 
 class PerformanceOptimizer:
@@ -24,8 +27,6 @@ class PerformanceOptimizer:
         }
         
         self.connection_pool = {}
-        self.cache = {}
-        self.cache_ttl = {}
         self.monitoring_active = False
         self.optimization_rules = {
             'max_concurrent_connections': 50,
@@ -35,6 +36,9 @@ class PerformanceOptimizer:
             'cpu_threshold': 85,        # %
             'cleanup_interval': 60      # seconds
         }
+        self.cache = CacheEngine(default_ttl=self.optimization_rules['cache_ttl_default'])
+        # Les commits SQLAlchemy invalident les réponses qui dépendent des objets modifiés
+        cache_invalidation_listeners.append(self.invalidate_cache_tags)
         
     def start_monitoring(self):
         """Démarre le monitoring des performances"""
@@ -165,23 +169,11 @@ class PerformanceOptimizer:
     
     def _aggressive_cache_cleanup(self):
         """Nettoyage agressif du cache"""
-        # Réduire le TTL du cache
-        current_time = time.time()
-        expired_keys = []
-        
-        for key, ttl in self.cache_ttl.items():
-            if current_time > ttl:
-                expired_keys.append(key)
+        # Retirer les entrées expirées, puis la moitié la moins récemment utilisée du reste
+        expired = self.cache.purge_expired()
+        evicted = self.cache.shrink(0.5)
         
-        # Supprimer aussi 50% du cache restant pour libérer de la mémoire
-        remaining_keys = list(set(self.cache.keys()) - set(expired_keys))
-        additional_cleanup = len(remaining_keys) // 2
-        
-        for key in expired_keys + remaining_keys[:additional_cleanup]:
-            self.cache.pop(key, None)
-            self.cache_ttl.pop(key, None)
-        
-        logger.info(f"Cache nettoyé: {len(expired_keys + remaining_keys[:additional_cleanup])} entrées supprimées")
+        logger.info(f"Cache nettoyé: {expired + evicted} entrées supprimées ({expired} expirées, {evicted} évincées)")
     
     def register_connection(self, connection_id: str, connection_data: Dict):
         """Enregistre une nouvelle connexion"""
@@ -252,37 +244,27 @@ class PerformanceOptimizer:
         if ttl is None:
             ttl = self.optimization_rules['cache_ttl_default']
         
-        self.cache[key] = value
-        self.cache_ttl[key] = time.time() + ttl
+        self.cache.set(key, value, ttl)
     
     def get_cache(self, key: str) -> Optional[any]:
-        """Récupère une valeur du cache"""
-        if key not in self.cache:
-            return None
-        
-        # Vérifier l'expiration
-        if time.time() > self.cache_ttl.get(key, 0):
-            self.cache.pop(key, None)
-            self.cache_ttl.pop(key, None)
-            return None
-        
-        return self.cache[key]
+        """Récupère une valeur du cache (None si absente ou expirée)"""
+        return self.cache.get(key)
     
     def cleanup_expired_cache(self):
         """Nettoie le cache expiré"""
-        current_time = time.time()
-        expired_keys = []
-        
-        for key, ttl in self.cache_ttl.items():
-            if current_time > ttl:
-                expired_keys.append(key)
+        expired = self.cache.purge_expired()
         
-        for key in expired_keys:
-            self.cache.pop(key, None)
-            self.cache_ttl.pop(key, None)
-        
-        if expired_keys:
-            logger.debug(f"Cache expiré nettoyé: {len(expired_keys)} entrées")
+        if expired:
+            logger.debug(f"Cache expiré nettoyé: {expired} entrées")
+    
+    def invalidate_cache_tags(self, tags):
+        """Invalide les entrées du cache portant ces tags (lab:<id>, machine:<id>, labs:list)"""
+        self.cache.invalidate_tags(tags)
+        logger.debug(f"Tags de cache invalidés: {sorted(tags)}")
+    
+    def get_cache_stats(self) -> Dict:
+        """Compteurs du cache (succès, échecs, évictions, expirations) et occupation"""
+        return self.cache.get_stats()
     
     def record_response_time(self, endpoint: str, response_time: float):
         """Enregistre le temps de réponse d'un endpoint"""
@@ -89,7 +89,7 @@ class RemoteAccessService:
     
     @staticmethod
     def cleanup_inactive_connections(timeout_minutes: int = 30) -> int:
-        """Clean up inactive connections"""
+        """Clean up inactive connections (last_activity is fed by the WebSocket proxy's traffic)"""
         try:
             from datetime import timedelta
             cutoff_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
@@ -105,6 +105,10 @@ class RemoteAccessService:
                 count += 1
             
             db.session.commit()
+            
+            # Close the proxy sessions (and RDP gateways) still attached to these connections
+            from src.services.websocket_proxy import request_session_close
+            request_session_close([connection.session_id for connection in inactive_connections], 'timeout')
             logger.info(f"Cleaned up {count} inactive connections")
             return count
             
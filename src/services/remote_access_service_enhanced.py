@@ -1,5 +1,6 @@
 import uuid
 import logging
+from urllib.parse import urlencode
 from datetime import datetime
 from typing import Optional, Dict, List
 from src.models.remote_connection import RemoteConnection, db
@@ -43,49 +44,33 @@ class EnhancedRemoteAccessService:
             default_port = 3389 if connection_type == 'rdp' else 5901
             
             if connection_type == 'rdp':
-                # Utiliser le service FreeRDP pour les connexions RDP
-                try:
-                    rdp_session_id, local_port = freerdp_service.create_rdp_session(
-                        host=machine.ip_address,
-                        port=default_port,
-                        username=username,
-                        password=password,
-                        domain=domain,
-                        width=width,
-                        height=height
-                    )
-                    
-                    # Créer l'enregistrement en base de données
-                    connection = RemoteConnection(
-                        machine_id=machine_id,
-                        connection_type=connection_type,
-                        port=local_port,
-                        username=username,
-                        password=password,  # En production, chiffrer le mot de passe
-                        session_id=session_id,
-                        status='connecting'
-                    )
-                    
-                    # Ajouter l'ID de session RDP comme métadonnée
-                    connection.connection_metadata = f"rdp_session_id:{rdp_session_id}"
-                    
-                    db.session.add(connection)
-                    db.session.commit()
-                    
-                    return {
-                        "success": True,
-                        "session_id": session_id,
-                        "rdp_session_id": rdp_session_id,
-                        "connection_type": connection_type,
-                        "websocket_url": f"ws://localhost:{local_port}",
-                        "local_port": local_port,
-                        "machine_ip": machine.ip_address,
-                        "status": "connecting"
-                    }
-                    
-                except Exception as e:
-                    logger.error(f"Failed to create RDP session: {e}")
-                    return {"success": False, "error": f"RDP connection failed: {str(e)}"}
+                # La passerelle RDP (un processus par session) est lancée par le proxy WebSocket
+                # à la connexion du navigateur, avec les identifiants enregistrés ici
+                connection = RemoteConnection(
+                    machine_id=machine_id,
+                    connection_type=connection_type,
+                    port=default_port,
+                    username=username,
+                    password=password,  # En production, chiffrer le mot de passe
+                    session_id=session_id,
+                    status='connecting'
+                )
+                
+                db.session.add(connection)
+                db.session.commit()
+                
+                query = urlencode({k: v for k, v in {
+                    "session_id": session_id, "width": width, "height": height, "domain": domain
+                }.items() if v})
+                return {
+                    "success": True,
+                    "session_id": session_id,
+                    "connection_type": connection_type,
+                    "websocket_url": f"ws://localhost:8765/rdp/{machine.lab_id}/{machine_id}?{query}",
+                    "machine_ip": machine.ip_address,
+                    "rdp_port": default_port,
+                    "status": "connecting"
+                }
             
             else:  # VNC
                 # Utiliser l'ancienne logique pour VNC
@@ -106,7 +91,7 @@ class EnhancedRemoteAccessService:
                     "success": True,
                     "session_id": session_id,
                     "connection_type": connection_type,
-                    "websocket_url": f"ws://localhost:8765/vnc/{machine.lab_id}/{machine_id}",
+                    "websocket_url": f"ws://localhost:8765/vnc/{machine.lab_id}/{machine_id}?session_id={session_id}",
                     "machine_ip": machine.ip_address,
                     "vnc_port": default_port,
                     "status": "connecting"
@@ -138,12 +123,11 @@ class EnhancedRemoteAccessService:
             if machine.ip_address:
                 available_types.append('vnc')
             
-            # RDP disponible si FreeRDP est installé
-            try:
-                freerdp_service._find_freerdp_executable()
+            # RDP disponible si la passerelle (guacd/FreeRDP) est installée
+            if freerdp_service.is_available():
                 available_types.append('rdp')
-            except RuntimeError:
-                logger.warning("FreeRDP not available, RDP connections disabled")
+            else:
+                logger.warning("RDP gateway not available, RDP connections disabled")
             
             return {
                 "success": True,
@@ -168,16 +152,6 @@ class EnhancedRemoteAccessService:
             if not connection:
                 return {"success": False, "error": "Connection not found"}
             
-            # Pour les connexions RDP, vérifier le statut via FreeRDP
-            if connection.connection_type == 'rdp' and connection.connection_metadata:
-                rdp_session_id = connection.connection_metadata.split(':')[1] if ':' in connection.connection_metadata else None
-                if rdp_session_id:
-                    rdp_status = freerdp_service.get_session_status(rdp_session_id)
-                    if rdp_status:
-                        connection.status = rdp_status['status']
-                        connection.last_activity = datetime.utcnow()
-                        db.session.commit()
-            
             return {
                 "success": True,
                 "session_id": session_id,
@@ -218,17 +192,15 @@ class EnhancedRemoteAccessService:
             if not connection:
                 return {"success": False, "error": "Connection not found"}
             
-            # Pour les connexions RDP, terminer via FreeRDP
-            if connection.connection_type == 'rdp' and connection.connection_metadata:
-                rdp_session_id = connection.connection_metadata.split(':')[1] if ':' in connection.connection_metadata else None
-                if rdp_session_id:
-                    freerdp_service.terminate_session(rdp_session_id)
-            
             # Marquer comme déconnecté
             connection.status = 'disconnected'
             connection.last_activity = datetime.utcnow()
             db.session.commit()
             
+            # Fermer la session du proxy (et la passerelle RDP) au prochain heartbeat du worker
+            from src.services.websocket_proxy import request_session_close
+            request_session_close([session_id], 'disconnected')
+            
             return {"success": True, "message": "Session disconnected"}
             
         except Exception as e:
@@ -274,22 +246,16 @@ class EnhancedRemoteAccessService:
             
             cleaned_count = 0
             for connection in inactive_connections:
-                # Terminer les sessions RDP via FreeRDP
-                if connection.connection_type == 'rdp' and connection.connection_metadata:
-                    rdp_session_id = connection.connection_metadata.split(':')[1] if ':' in connection.connection_metadata else None
-                    if rdp_session_id:
-                        freerdp_service.terminate_session(rdp_session_id)
-                
                 connection.status = 'timeout'
                 cleaned_count += 1
             
-            # Nettoyer aussi les sessions FreeRDP orphelines
-            freerdp_cleaned = freerdp_service.cleanup_inactive_sessions(timeout_minutes * 60)
-            
             db.session.commit()
             
-            logger.info(f"Cleaned up {cleaned_count} inactive connections and {freerdp_cleaned} FreeRDP sessions")
-            return cleaned_count + freerdp_cleaned
+            from src.services.websocket_proxy import request_session_close
+            request_session_close([connection.session_id for connection in inactive_connections], 'timeout')
+            
+            logger.info(f"Cleaned up {cleaned_count} inactive connections")
+            return cleaned_count
             
         except Exception as e:
             logger.error(f"Error cleaning up connections: {e}")
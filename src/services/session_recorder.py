@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "off", "all" (toutes les sessions VNC) ou "on-demand" (sessions ouvertes avec ?record=1)
+RECORDING_MODE = os.getenv("WS_RECORDING", "off")
+RECORDING_DIR = os.getenv("WS_RECORDING_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                           "database", "recordings"))
+# Taille du tampon d'une session: plein, il devient un bloc compressé
+CHUNK_SIZE = int(os.getenv("WS_RECORDING_CHUNK_SIZE", 256 * 1024))
+# Un bloc partiel est écrit au plus tard après FLUSH_INTERVAL secondes
+FLUSH_INTERVAL = float(os.getenv("WS_RECORDING_FLUSH_INTERVAL", 2))
+# Blocs en attente d'écriture au-delà desquels les nouveaux blocs sont abandonnés
+MAX_PENDING_CHUNKS = int(os.getenv("WS_RECORDING_MAX_PENDING", 256))
+
+# Fichier .rec: MAGIC puis des blocs [CHUNK_HEADER + données zlib]; un bloc décompressé est
+# une suite d'enregistrements [RECORD_HEADER + octets envoyés au navigateur].
+# Fichier .idx: une entrée INDEX_ENTRY par bloc pour se positionner sans tout lire.
+MAGIC = b"LCREC1\n"
+CHUNK_HEADER = struct.Struct("<IIII")   # début (ms), fin (ms), taille brute, taille compressée
+RECORD_HEADER = struct.Struct("<II")    # horodatage (ms depuis le début), taille
+INDEX_ENTRY = struct.Struct("<IIQ")     # début (ms), fin (ms), position du bloc dans .rec
+
+
+class SessionRecording:
+    """
+    Enregistrement du flux serveur -> navigateur d'une session.
+
+    write() ne fait qu'ajouter au tampon en mémoire; les blocs pleins sont confiés au
+    RecordingWriter, seul à compresser et à écrire sur disque.
+    """
+
+    def __init__(self, writer: "RecordingWriter", recording_id: str, metadata: Dict[str, Any]):
+        self.writer = writer
+        self.recording_id = recording_id
+        self.metadata = {**metadata, "id": recording_id, "started_at": time.time()}
+        self._started = time.monotonic()
+        self._buffer = bytearray()
+        self._chunk_start: Optional[int] = None
+        self._last_ts = 0
+        self._last_seal = self._started
+        self.bytes = 0
+        self.records = 0
+        self.chunks = 0
+        self.dropped_chunks = 0
+        self.closed = False
+
+    def write(self, data: bytes):
+        ts = int((time.monotonic() - self._started) * 1000)
+        if self._chunk_start is None:
+            self._chunk_start = ts
+        self._buffer += RECORD_HEADER.pack(ts, len(data))
+        self._buffer += data
+        self._last_ts = ts
+        self.bytes += len(data)
+        self.records += 1
+        if len(self._buffer) >= CHUNK_SIZE:
+            self._seal()
+
+    def _seal(self):
+        if not self._buffer:
+            return
+        chunk = (self._chunk_start, self._last_ts, bytes(self._buffer))
+        self._buffer.clear()
+        self._chunk_start = None
+        self._last_seal = time.monotonic()
+        if self.writer.submit(self, chunk):
+            self.chunks += 1
+        else:
+            self.dropped_chunks += 1
+
+    def flush_if_stale(self, now: float):
+        if self._buffer and now - self._last_seal >= FLUSH_INTERVAL:
+            self._seal()
+
+    def close(self):
+        self._seal()
+        self.closed = True
+        self.metadata.update(ended_at=time.time(), duration_ms=self._last_ts, bytes=self.bytes,
+                             records=self.records, chunks=self.chunks, dropped_chunks=self.dropped_chunks)
+        self.writer.submit(self, None)
+        self.writer.forget(self.recording_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.recording_id, "bytes": self.bytes, "records": self.records,
+                "chunks": self.chunks, "dropped_chunks": self.dropped_chunks}
+
+
+class RecordingWriter:
+    """Tâche de fond unique: compresse et ajoute les blocs de toutes les sessions enregistrées"""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or RECORDING_DIR
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._recordings: Dict[str, SessionRecording] = {}
+        # recording_id -> (fichier .rec, fichier .idx)
+        self._files: Dict[str, Tuple[Any, Any]] = {}
+
+    def start(self, recording_id: str, metadata: Dict[str, Any]) -> Optional[SessionRecording]:
+        """Commencer un enregistrement (None si le disque ne suit pas: la session n'est pas enregistrée)"""
+        if self._task is None or self._task.done():
+            os.makedirs(self.directory, exist_ok=True)
+            self._queue = asyncio.Queue(maxsize=MAX_PENDING_CHUNKS)
+            self._task = asyncio.create_task(self._run())
+            self._flusher = asyncio.create_task(self._flush_loop())
+        recording = SessionRecording(self, recording_id, metadata)
+        try:
+            self._queue.put_nowait((recording, "open"))
+        except asyncio.QueueFull:
+            logger.warning(f"Recording queue full, session {recording_id} will not be recorded")
+            return None
+        self._recordings[recording_id] = recording
+        return recording
+
+    def submit(self, recording: SessionRecording, chunk) -> bool:
+        """Ne bloque jamais: retourne False si la file d'écriture est pleine"""
+        try:
+            self._queue.put_nowait((recording, chunk))
+            return True
+        except asyncio.QueueFull:
+            if chunk is None:
+                # La fermeture doit passer: elle sera traitée après les blocs en attente
+                asyncio.create_task(self._queue.put((recording, None)))
+                return True
+            return False
+
+    def forget(self, recording_id: str):
+        self._recordings.pop(recording_id, None)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            now = time.monotonic()
+            for recording in list(self._recordings.values()):
+                recording.flush_if_stale(now)
+
+    async def _run(self):
+        while True:
+            recording, chunk = await self._queue.get()
+            try:
+                await asyncio.to_thread(self._write, recording, chunk)
+            except Exception as e:
+                logger.error(f"Failed to write recording {recording.recording_id}: {e}")
+
+    def _write(self, recording: SessionRecording, chunk):
+        base = os.path.join(self.directory, recording.recording_id)
+        if chunk == "open":
+            rec = open(f"{base}.rec", "wb")
+            rec.write(MAGIC)
+            self._files[recording.recording_id] = (rec, open(f"{base}.idx", "wb"))
+            self._write_metadata(base, recording.metadata)
+            return
+
+        rec, idx = self._files[recording.recording_id]
+        if chunk is None:
+            rec.close()
+            idx.close()
+            del self._files[recording.recording_id]
+            self._write_metadata(base, recording.metadata)
+            return
+
+        start, end, raw = chunk
+        compressed = zlib.compress(raw, 6)
+        offset = rec.tell()
+        rec.write(CHUNK_HEADER.pack(start, end, len(raw), len(compressed)))
+        rec.write(compressed)
+        rec.flush()
+        idx.write(INDEX_ENTRY.pack(start, end, offset))
+        idx.flush()
+
+    @staticmethod
+    def _write_metadata(base: str, metadata: Dict[str, Any]):
+        with open(f"{base}.json.tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(f"{base}.json.tmp", f"{base}.json")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": RECORDING_MODE,
+            "recording": len(self._recordings),
+            "pending_chunks": self._queue.qsize() if self._queue else 0
+        }
+
+
+class RecordingReader:
+    """Lecture d'un enregistrement: index des blocs et enregistrements horodatés"""
+
+    def __init__(self, directory: str, recording_id: str):
+        if os.path.basename(recording_id) != recording_id or recording_id.startswith("."):
+            raise ValueError("Invalid recording id")
+        self.base = os.path.join(directory, recording_id)
+        if not os.path.exists(f"{self.base}.rec"):
+            raise FileNotFoundError(recording_id)
+
+    def metadata(self) -> Dict[str, Any]:
+        try:
+            with open(f"{self.base}.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def index(self) -> List[Tuple[int, int, int]]:
+        with open(f"{self.base}.idx", "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, pos) for pos in range(0, usable, INDEX_ENTRY.size)]
+
+    def read_chunk(self, offset: int) -> List[Tuple[int, bytes]]:
+        """Enregistrements (horodatage ms, données) du bloc situé à offset"""
+        with open(f"{self.base}.rec", "rb") as f:
+            f.seek(offset)
+            _, _, raw_len, compressed_len = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+            raw = zlib.decompress(f.read(compressed_len))
+        records, pos = [], 0
+        while pos < raw_len:
+            ts, size = RECORD_HEADER.unpack_from(raw, pos)
+            pos += RECORD_HEADER.size
+            records.append((ts, raw[pos:pos + size]))
+            pos += size
+        return records
+
+
+def list_recordings(directory: str = None) -> List[Dict[str, Any]]:
+    directory = directory or RECORDING_DIR
+    if not os.path.isdir(directory):
+        return []
+    recordings = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name)) as f:
+                recordings.append(json.load(f))
+    return sorted(recordings, key=lambda r: r.get("started_at", 0), reverse=True)
+
+
+async def replay(reader: RecordingReader, send, speed: float = 1.0, start_ms: int = 0):
+    """
+    Rejouer un enregistrement via send(bytes) à la vitesse speed.
+
+    Le flux RFB ne peut pas être repris au milieu (état du décodeur): l'avance rapide
+    jusqu'à start_ms envoie sans attente tous les blocs qui précèdent, repérés par l'index
+    sans horodatage à décoder, puis la lecture reprend au rythme enregistré.
+    """
+    loop = asyncio.get_running_loop()
+    clock_start, first_paced = None, None
+    for _, chunk_end, offset in await asyncio.to_thread(reader.index):
+        records = await asyncio.to_thread(reader.read_chunk, offset)
+        if chunk_end < start_ms:
+            await send(b"".join(data for _, data in records))
+            continue
+        for ts, data in records:
+            if ts >= start_ms:
+                if clock_start is None:
+                    clock_start, first_paced = loop.time(), ts
+                delay = clock_start + (ts - first_paced) / 1000 / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await send(data)
+
+
+# Instance globale du writer
+recording_writer = RecordingWriter()
@@ -0,0 +1,388 @@
+import json
+from abc import ABC, abstractmethod
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Identifiant du worker courant (les sessions d'un worker arrêté expirent après ttl secondes)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SessionRegistry(ABC):
+    """
+    Registre des sessions du proxy WebSocket partagé entre workers.
+
+    Chaque session est un dictionnaire sérialisable en JSON; le worker qui la porte la
+    rafraîchit régulièrement (touch) et une session non rafraîchie depuis ttl secondes est
+    considérée comme perdue (worker arrêté) et n'est plus listée.
+    """
+
+    # Vrai si les appels font des E/S (à exécuter hors de la boucle asyncio)
+    blocking = True
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+
+    @abstractmethod
+    def register(self, session_id: str, info: Dict[str, Any]):
+        """Enregistrer une session ouverte par ce worker"""
+
+    @abstractmethod
+    def update(self, session_id: str, **fields):
+        """Mettre à jour des champs d'une session et la rafraîchir"""
+
+    @abstractmethod
+    def touch(self, session_ids: List[str]):
+        """Rafraîchir plusieurs sessions en une opération (heartbeat du worker)"""
+
+    @abstractmethod
+    def update_many(self, updates: Dict[str, Dict[str, Any]]):
+        """Mettre à jour et rafraîchir plusieurs sessions en une opération (compteurs du worker)"""
+
+    @abstractmethod
+    def unregister(self, session_id: str):
+        """Retirer une session fermée"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Session enregistrée, ou None si inconnue ou expirée"""
+
+    @abstractmethod
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        """Sessions non expirées de tous les workers"""
+
+    def count(self) -> int:
+        return len(self.list_sessions())
+
+    @abstractmethod
+    def request_close(self, remote_session_ids: List[str], reason: str = "disconnected"):
+        """
+        Demander la fermeture des sessions liées à ces connexions distantes (remote_connections).
+
+        Appelé par l'application Flask; le worker qui porte la session la ferme à son prochain
+        heartbeat. Une demande non prise en charge expire après ttl secondes.
+        """
+
+    @abstractmethod
+    def pop_close_requests(self, remote_session_ids: List[str]) -> Dict[str, str]:
+        """Retirer et retourner (raison par connexion) les demandes visant ces connexions"""
+
+    def _new_entry(self, session_id: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            **info,
+            "id": session_id,
+            "worker": WORKER_ID,
+            "started_at": info.get("started_at", now),
+            "last_seen": now
+        }
+
+    def _alive(self, entry: Dict[str, Any], now: float = None) -> bool:
+        return (now or time.time()) - entry["last_seen"] <= self.ttl
+
+
+class MemorySessionRegistry(SessionRegistry):
+    """Registre local au processus (un seul worker)"""
+
+    blocking = False
+
+    def __init__(self, ttl: float = 60):
+        super().__init__(ttl)
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        # remote_session_id -> (raison, date de la demande)
+        self._close_requests: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, session_id: str, info: Dict[str, Any]):
+        with self._lock:
+            self._sessions[session_id] = self._new_entry(session_id, info)
+
+    def update(self, session_id: str, **fields):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry.update(fields, last_seen=time.time())
+
+    def touch(self, session_ids: List[str]):
+        now = time.time()
+        with self._lock:
+            for session_id in session_ids:
+                if session_id in self._sessions:
+                    self._sessions[session_id]["last_seen"] = now
+
+    def update_many(self, updates: Dict[str, Dict[str, Any]]):
+        now = time.time()
+        with self._lock:
+            for session_id, fields in updates.items():
+                entry = self._sessions.get(session_id)
+                if entry is not None:
+                    entry.update(fields, last_seen=now)
+
+    def unregister(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return dict(entry) if entry and self._alive(entry) else None
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            for session_id in [key for key, entry in self._sessions.items() if not self._alive(entry, now)]:
+                del self._sessions[session_id]
+            return [dict(entry) for entry in self._sessions.values()]
+
+    def request_close(self, remote_session_ids: List[str], reason: str = "disconnected"):
+        now = time.time()
+        with self._lock:
+            for remote_session_id in remote_session_ids:
+                self._close_requests[remote_session_id] = (reason, now)
+
+    def pop_close_requests(self, remote_session_ids: List[str]) -> Dict[str, str]:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for key in [key for key, (_, requested_at) in self._close_requests.items() if requested_at < cutoff]:
+                del self._close_requests[key]
+            return {remote_session_id: self._close_requests.pop(remote_session_id)[0]
+                    for remote_session_id in remote_session_ids if remote_session_id in self._close_requests}
+
+
+class SQLiteSessionRegistry(SessionRegistry):
+    """Registre partagé par les workers d'un même nœud via un fichier SQLite (mode WAL)"""
+
+    def __init__(self, path: str, ttl: float = 60):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ws_sessions ("
+                "id TEXT PRIMARY KEY, worker TEXT NOT NULL, last_seen REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ws_close_requests ("
+                "remote_session_id TEXT PRIMARY KEY, reason TEXT NOT NULL, requested_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def register(self, session_id: str, info: Dict[str, Any]):
+        entry = self._new_entry(session_id, info)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO ws_sessions (id, worker, last_seen, data) VALUES (?, ?, ?, ?)",
+            (session_id, entry["worker"], entry["last_seen"], json.dumps(entry))
+        )
+
+    def update(self, session_id: str, **fields):
+        self.update_many({session_id: fields})
+
+    def update_many(self, updates: Dict[str, Dict[str, Any]]):
+        if not updates:
+            return
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            placeholders = ",".join("?" * len(updates))
+            rows = conn.execute(f"SELECT id, data FROM ws_sessions WHERE id IN ({placeholders})",
+                                list(updates)).fetchall()
+            values = []
+            for session_id, data in rows:
+                entry = json.loads(data)
+                entry.update(updates[session_id], last_seen=now)
+                values.append((now, json.dumps(entry), session_id))
+            conn.executemany("UPDATE ws_sessions SET last_seen = ?, data = ? WHERE id = ?", values)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def touch(self, session_ids: List[str]):
+        if not session_ids:
+            return
+        now = time.time()
+        # last_seen fait foi: la copie dans data est corrigée à la lecture
+        self._connection().executemany("UPDATE ws_sessions SET last_seen = ? WHERE id = ?",
+                                       [(now, session_id) for session_id in session_ids])
+
+    def unregister(self, session_id: str):
+        self._connection().execute("DELETE FROM ws_sessions WHERE id = ?", (session_id,))
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT last_seen, data FROM ws_sessions WHERE id = ? AND last_seen >= ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        return {**json.loads(row[1]), "last_seen": row[0]} if row else None
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        conn = self._connection()
+        cutoff = time.time() - self.ttl
+        conn.execute("DELETE FROM ws_sessions WHERE last_seen < ?", (cutoff,))
+        rows = conn.execute("SELECT last_seen, data FROM ws_sessions ORDER BY last_seen DESC").fetchall()
+        return [{**json.loads(data), "last_seen": last_seen} for last_seen, data in rows]
+
+    def count(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM ws_sessions WHERE last_seen >= ?", (time.time() - self.ttl,)
+        ).fetchone()[0]
+
+    def request_close(self, remote_session_ids: List[str], reason: str = "disconnected"):
+        if not remote_session_ids:
+            return
+        now = time.time()
+        self._connection().executemany(
+            "INSERT OR REPLACE INTO ws_close_requests (remote_session_id, reason, requested_at) VALUES (?, ?, ?)",
+            [(remote_session_id, reason, now) for remote_session_id in remote_session_ids]
+        )
+
+    def pop_close_requests(self, remote_session_ids: List[str]) -> Dict[str, str]:
+        if not remote_session_ids:
+            return {}
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM ws_close_requests WHERE requested_at < ?", (time.time() - self.ttl,))
+            placeholders = ",".join("?" * len(remote_session_ids))
+            rows = conn.execute(
+                f"SELECT remote_session_id, reason FROM ws_close_requests WHERE remote_session_id IN ({placeholders})",
+                list(remote_session_ids)
+            ).fetchall()
+            conn.executemany("DELETE FROM ws_close_requests WHERE remote_session_id = ?",
+                             [(remote_session_id,) for remote_session_id, _ in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(rows)
+
+
+class RedisSessionRegistry(SessionRegistry):
+    """
+    Registre partagé entre nœuds via un serveur compatible Redis (Redis, Valkey, KeyDB...).
+
+    Chaque session est une clé avec expiration (ttl) et un ensemble indexe les sessions;
+    nécessite le paquet redis.
+    """
+
+    def __init__(self, url: str, ttl: float = 60, prefix: str = "labcreator:ws:"):
+        super().__init__(ttl)
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("The redis package is required for a redis:// session registry") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.index_key = f"{prefix}sessions"
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    def register(self, session_id: str, info: Dict[str, Any]):
+        entry = self._new_entry(session_id, info)
+        pipe = self.client.pipeline()
+        pipe.set(self._key(session_id), json.dumps(entry), ex=int(self.ttl))
+        pipe.sadd(self.index_key, session_id)
+        pipe.execute()
+
+    def update(self, session_id: str, **fields):
+        self.update_many({session_id: fields})
+
+    def update_many(self, updates: Dict[str, Dict[str, Any]]):
+        if not updates:
+            return
+        now = time.time()
+        session_ids = list(updates)
+        values = self.client.mget([self._key(session_id) for session_id in session_ids])
+        pipe = self.client.pipeline()
+        for session_id, raw in zip(session_ids, values):
+            if raw:
+                entry = json.loads(raw)
+                entry.update(updates[session_id], last_seen=now)
+                pipe.set(self._key(session_id), json.dumps(entry), ex=int(self.ttl))
+        pipe.execute()
+
+    def touch(self, session_ids: List[str]):
+        if not session_ids:
+            return
+        pipe = self.client.pipeline()
+        for session_id in session_ids:
+            pipe.expire(self._key(session_id), int(self.ttl))
+        pipe.execute()
+
+    def unregister(self, session_id: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(session_id))
+        pipe.srem(self.index_key, session_id)
+        pipe.execute()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self._key(session_id))
+        return json.loads(raw) if raw else None
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        session_ids = sorted(self.client.smembers(self.index_key))
+        if not session_ids:
+            return []
+        values = self.client.mget([self._key(session_id) for session_id in session_ids])
+        expired = [session_id for session_id, raw in zip(session_ids, values) if raw is None]
+        if expired:
+            self.client.srem(self.index_key, *expired)
+        return [json.loads(raw) for raw in values if raw is not None]
+
+    def _close_key(self, remote_session_id: str) -> str:
+        return f"{self.prefix}close:{remote_session_id}"
+
+    def request_close(self, remote_session_ids: List[str], reason: str = "disconnected"):
+        if not remote_session_ids:
+            return
+        pipe = self.client.pipeline()
+        for remote_session_id in remote_session_ids:
+            pipe.set(self._close_key(remote_session_id), reason, ex=int(self.ttl))
+        pipe.execute()
+
+    def pop_close_requests(self, remote_session_ids: List[str]) -> Dict[str, str]:
+        if not remote_session_ids:
+            return {}
+        # GET puis DELETE dans une transaction (GETDEL n'existe qu'à partir de Redis 6.2)
+        pipe = self.client.pipeline()
+        for remote_session_id in remote_session_ids:
+            pipe.get(self._close_key(remote_session_id))
+            pipe.delete(self._close_key(remote_session_id))
+        reasons = pipe.execute()[::2]
+        return {remote_session_id: reason
+                for remote_session_id, reason in zip(remote_session_ids, reasons) if reason is not None}
+
+
+def create_registry(url: str = None, ttl: float = None) -> SessionRegistry:
+    """
+    Créer le registre décrit par url (WS_SESSION_REGISTRY par défaut):
+    memory://, sqlite:///chemin/registre.db ou redis://hôte:port/db
+    """
+    url = url or os.getenv("WS_SESSION_REGISTRY", "memory://")
+    ttl = ttl or float(os.getenv("WS_SESSION_TTL", 60))
+    if url.startswith("memory://"):
+        return MemorySessionRegistry(ttl=ttl)
+    if url.startswith("sqlite://"):
+        return SQLiteSessionRegistry(url[len("sqlite://"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionRegistry(url, ttl=ttl)
+    raise ValueError(f"Unsupported session registry URL: {url}")
@@ -3,13 +3,43 @@ import subprocess
 import json
 import tempfile
 import shutil
-from typing import Dict, List, Any
+import threading
+import hashlib
+import time
+from typing import Callable, Dict, List, Any
 from src.models.lab import Lab, Machine
+from src.services.command_runner import run_streaming
 
 class TerraformService:
-    def __init__(self, workspace_dir: str = "/tmp/terraform_workspaces"):
+    # Fichier de plan écrit par terraform_plan et consommé par terraform_apply
+    PLAN_FILE = 'tfplan'
+    
+    # Provider Terraform par type de lab: (nom local, source, contrainte de version)
+    PROVIDER_REQUIREMENTS = {
+        'vps': ('digitalocean', 'digitalocean/digitalocean', '~> 2.0'),
+        'local': ('proxmox', 'telmate/proxmox', '2.9.14')
+    }
+    
+    def __init__(self, workspace_dir: str = "/tmp/terraform_workspaces", plugin_cache_dir: str = None,
+                 provider_mirror_dir: str = None, offline: bool = None):
         self.workspace_dir = workspace_dir
         os.makedirs(workspace_dir, exist_ok=True)
+        
+        # Cache de plugins partagé par tous les workspaces et miroir local des providers
+        self.plugin_cache_dir = plugin_cache_dir or os.getenv(
+            "TF_PLUGIN_CACHE_DIR", os.path.join(workspace_dir, ".plugin-cache"))
+        self.provider_mirror_dir = provider_mirror_dir or os.getenv(
+            "TERRAFORM_PROVIDER_MIRROR", os.path.join(workspace_dir, ".provider-mirror"))
+        # Hors ligne: les providers ne sont résolus que depuis le miroir local
+        self.offline = offline if offline is not None else os.getenv("TERRAFORM_OFFLINE", "False") == "True"
+        os.makedirs(self.plugin_cache_dir, exist_ok=True)
+        os.makedirs(self.provider_mirror_dir, exist_ok=True)
+        self.cli_config_path = os.path.join(workspace_dir, ".terraformrc")
+        
+        self._stats_lock = threading.Lock()
+        self.plugin_cache_stats = {'inits': 0, 'hits': 0, 'misses': 0, 'mirror_installs': 0}
+        # Dès la création: plan/apply sur un workspace déjà initialisé utilisent aussi cette configuration
+        self._write_cli_config()
     
     def get_lab_workspace(self, lab_id: int) -> str:
         """Obtenir le répertoire de travail pour un lab spécifique"""
@@ -17,10 +47,8 @@ class TerraformService:
         os.makedirs(workspace, exist_ok=True)
         return workspace
     
-    def generate_terraform_config(self, lab: Lab) -> str:
-        """Générer la configuration Terraform pour un lab"""
-        workspace = self.get_lab_workspace(lab.id)
-        
+    def render_terraform_config(self, lab: Lab) -> Dict[str, str]:
+        """Rendre les fichiers Terraform d'un lab sans les écrire"""
         # Choisir le template selon le provider
         if lab.provider == 'vps':
             config = self._generate_vps_config(lab)
@@ -29,37 +57,139 @@ class TerraformService:
         else:
             raise ValueError(f"Provider non supporté: {lab.provider}")
         
-        # Écrire le fichier main.tf
-        main_tf_path = os.path.join(workspace, "main.tf")
-        with open(main_tf_path, 'w') as f:
-            f.write(config)
+        return {
+            'main.tf': config,
+            'variables.tf': self._generate_variables_config(lab),
+            'terraform.tfvars': self._generate_tfvars(lab)
+        }
+    
+    def write_terraform_config(self, lab: Lab) -> Dict[str, Any]:
+        """
+        Écrire la configuration Terraform d'un lab en ne réécrivant que les fichiers modifiés.
         
-        # Générer le fichier variables.tf
-        variables_tf_path = os.path.join(workspace, "variables.tf")
-        with open(variables_tf_path, 'w') as f:
-            f.write(self._generate_variables_config(lab))
+        Retourne le hash de la configuration et indique si init et plan/apply sont nécessaires:
+        up_to_date est vrai quand la configuration et les providers verrouillés sont identiques
+        à ceux du dernier apply réussi.
+        """
+        workspace = self.get_lab_workspace(lab.id)
+        files = self.render_terraform_config(lab)
         
-        # Générer le fichier terraform.tfvars
-        tfvars_path = os.path.join(workspace, "terraform.tfvars")
-        with open(tfvars_path, 'w') as f:
-            f.write(self._generate_tfvars(lab))
+        changed_files = []
+        for filename, content in files.items():
+            path = os.path.join(workspace, filename)
+            if os.path.exists(path):
+                with open(path) as f:
+                    if f.read() == content:
+                        continue
+            with open(path, 'w') as f:
+                f.write(content)
+            changed_files.append(filename)
         
-        return workspace
+        state = self._read_state(lab.id)
+        config_hash = self.get_config_hash(lab.id, files)
+        providers_hash = self._hash_content(self._generate_terraform_block(lab))
+        initialized = os.path.isdir(os.path.join(workspace, '.terraform'))
+        
+        return {
+            'workspace': workspace,
+            'config_hash': config_hash,
+            'changed_files': changed_files,
+            'needs_init': not initialized or state.get('providers_hash') != providers_hash,
+            'providers_hash': providers_hash,
+            'up_to_date': (
+                initialized
+                and state.get('applied_hash') == config_hash
+                and os.path.exists(os.path.join(workspace, 'terraform.tfstate'))
+            )
+        }
     
-    def _generate_vps_config(self, lab: Lab) -> str:
-        """Générer la configuration Terraform pour VPS (DigitalOcean exemple)"""
-        provider_config = json.loads(lab.provider_config) if lab.provider_config else {}
+    def generate_terraform_config(self, lab: Lab) -> str:
+        """Générer la configuration Terraform pour un lab"""
+        return self.write_terraform_config(lab)['workspace']
+    
+    def get_config_hash(self, lab_id: int, files: Dict[str, str] = None) -> str:
+        """Hash des fichiers de configuration et du verrou des providers (.terraform.lock.hcl)"""
+        workspace = self.get_lab_workspace(lab_id)
+        if files is None:
+            files = {}
+            for filename in ('main.tf', 'variables.tf', 'terraform.tfvars'):
+                path = os.path.join(workspace, filename)
+                if os.path.exists(path):
+                    with open(path) as f:
+                        files[filename] = f.read()
         
-        config = f'''
+        digest = hashlib.sha256()
+        for filename in sorted(files):
+            digest.update(filename.encode())
+            digest.update(files[filename].encode())
+        lock_path = os.path.join(workspace, '.terraform.lock.hcl')
+        if os.path.exists(lock_path):
+            with open(lock_path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+    
+    def mark_initialized(self, lab_id: int, providers_hash: str):
+        """Mémoriser les providers pour lesquels terraform init a réussi"""
+        self._write_state(lab_id, providers_hash=providers_hash)
+    
+    def mark_applied(self, lab_id: int):
+        """Mémoriser le hash de la configuration après un apply réussi"""
+        self._write_state(lab_id, applied_hash=self.get_config_hash(lab_id), applied_at=time.time())
+    
+    def get_deployed_snapshot(self, lab_id: int) -> Dict[str, Any]:
+        """Snapshot des définitions de machines du dernier déploiement réussi"""
+        return self._read_state(lab_id).get('deployed')
+    
+    def set_deployed_snapshot(self, lab_id: int, snapshot: Dict[str, Any]):
+        self._write_state(lab_id, deployed=snapshot)
+    
+    def get_machine_addresses(self, lab: Lab, machine_id: int) -> List[str]:
+        """Adresses des ressources Terraform d'une machine (pour terraform plan -target)"""
+        if lab.provider == 'vps':
+            return [f'digitalocean_droplet.machine_{machine_id}', f'digitalocean_floating_ip.machine_{machine_id}_ip']
+        return [f'proxmox_vm_qemu.machine_{machine_id}']
+    
+    def _state_path(self, lab_id: int) -> str:
+        return os.path.join(self.get_lab_workspace(lab_id), '.lab_state.json')
+    
+    def _read_state(self, lab_id: int) -> Dict[str, Any]:
+        try:
+            with open(self._state_path(lab_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_state(self, lab_id: int, **values):
+        state = self._read_state(lab_id)
+        state.update(values)
+        path = self._state_path(lab_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+    
+    @staticmethod
+    def _hash_content(content: str) -> str:
+        return hashlib.sha256(content.encode()).hexdigest()
+    
+    def _generate_terraform_block(self, lab: Lab) -> str:
+        """Générer le bloc terraform/required_providers du provider du lab"""
+        name, source, version = self.PROVIDER_REQUIREMENTS[lab.provider]
+        return f'''
 terraform {{
   required_providers {{
-    digitalocean = {{
-      source  = "digitalocean/digitalocean"
-      version = "~> 2.0"
+    {name} = {{
+      source  = "{source}"
+      version = "{version}"
     }}
   }}
 }}
-
+'''
+    
+    def _generate_vps_config(self, lab: Lab) -> str:
+        """Générer la configuration Terraform pour VPS (DigitalOcean exemple)"""
+        provider_config = json.loads(lab.provider_config) if lab.provider_config else {}
+        
+        config = self._generate_terraform_block(lab) + f'''
 provider "digitalocean" {{
   token = var.do_token
 }}
@@ -137,16 +267,7 @@ output "machine_{machine.id}_private_ip" {{
     
     def _generate_local_config(self, lab: Lab) -> str:
         """Générer la configuration Terraform pour serveur local (Proxmox exemple)"""
-        config = f'''
-terraform {{
-  required_providers {{
-    proxmox = {{
-      source  = "telmate/proxmox"
-      version = "2.9.14"
-    }}
-  }}
-}}
-
+        config = self._generate_terraform_block(lab) + f'''
 provider "proxmox" {{
   pm_api_url      = var.proxmox_api_url
   pm_user         = var.proxmox_user
@@ -363,113 +484,244 @@ ssh_public_key = "{provider_config.get('ssh_public_key', 'YOUR_SSH_PUBLIC_KEY')}
         }
         return mapping.get(os, 'ubuntu-22.04-template')
     
-    def terraform_init(self, lab_id: int) -> Dict[str, Any]:
+    def _write_cli_config(self) -> str:
+        """Écrire la configuration CLI Terraform (cache de plugins et miroir local)"""
+        mirrored = self.get_mirrored_providers()
+        lines = [
+            f'plugin_cache_dir = "{self.plugin_cache_dir}"',
+            'plugin_cache_may_break_dependency_lock_file = true',
+            '',
+            'provider_installation {'
+        ]
+        if mirrored or self.offline:
+            include = ', '.join(f'"{provider}"' for provider in mirrored) or '"*/*/*"'
+            lines += [
+                '  filesystem_mirror {',
+                f'    path    = "{self.provider_mirror_dir}"',
+                f'    include = [{include}]',
+                '  }'
+            ]
+        if not self.offline:
+            exclude = ', '.join(f'"{provider}"' for provider in mirrored)
+            lines += [
+                '  direct {',
+                f'    exclude = [{exclude}]',
+                '  }'
+            ]
+        lines.append('}')
+        
+        content = '\n'.join(lines) + '\n'
+        tmp_path = f"{self.cli_config_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, self.cli_config_path)
+        return self.cli_config_path
+    
+    def _terraform_env(self) -> Dict[str, str]:
+        """Variables d'environnement communes aux commandes Terraform"""
+        return {
+            'TF_CLI_CONFIG_FILE': self.cli_config_path,
+            'TF_PLUGIN_CACHE_DIR': self.plugin_cache_dir,
+            'TF_IN_AUTOMATION': '1'
+        }
+    
+    def get_mirrored_providers(self) -> List[str]:
+        """Providers présents dans le miroir local (hostname/namespace/type)"""
+        providers = []
+        root = self.provider_mirror_dir
+        for hostname in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            for namespace in sorted(os.listdir(os.path.join(root, hostname))):
+                namespace_dir = os.path.join(root, hostname, namespace)
+                if not os.path.isdir(namespace_dir):
+                    continue
+                for provider_type in sorted(os.listdir(namespace_dir)):
+                    providers.append(f"{hostname}/{namespace}/{provider_type}")
+        return providers
+    
+    def seed_provider_mirror(self, output_callback: Callable[[str], None] = None) -> Dict[str, Any]:
+        """Pré-remplir le miroir local avec tous les providers utilisés par les labs (réseau requis)"""
+        blocks = ''.join(
+            f'''    {name} = {{
+      source  = "{source}"
+      version = "{version}"
+    }}
+'''
+            for name, source, version in self.PROVIDER_REQUIREMENTS.values()
+        )
+        with tempfile.TemporaryDirectory(dir=self.workspace_dir) as tmp_dir:
+            with open(os.path.join(tmp_dir, 'main.tf'), 'w') as f:
+                f.write(f'terraform {{\n  required_providers {{\n{blocks}  }}\n}}\n')
+            result = run_streaming(
+                ['terraform', 'providers', 'mirror', self.provider_mirror_dir],
+                cwd=tmp_dir,
+                timeout=900,
+                timeout_message='Timeout during terraform providers mirror',
+                output_callback=output_callback,
+                env=self._terraform_env()
+            )
+        result['providers'] = self.get_mirrored_providers()
+        # Les providers désormais présents dans le miroir sont servis localement
+        self._write_cli_config()
+        return result
+    
+    def get_plugin_cache_stats(self) -> Dict[str, Any]:
+        """Statistiques du cache de plugins partagé"""
+        with self._stats_lock:
+            stats = dict(self.plugin_cache_stats)
+        lookups = stats['hits'] + stats['misses'] + stats['mirror_installs']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        stats['plugin_cache_dir'] = self.plugin_cache_dir
+        stats['provider_mirror_dir'] = self.provider_mirror_dir
+        stats['mirrored_providers'] = self.get_mirrored_providers()
+        stats['offline'] = self.offline
+        return stats
+    
+    def _record_init_stats(self, stdout: str):
+        """Compter les providers servis par le cache, le miroir ou téléchargés pendant terraform init"""
+        hits = misses = mirror_installs = 0
+        for line in stdout.splitlines():
+            if 'from the shared cache directory' in line:
+                hits += 1
+            elif line.lstrip().startswith('- Installed '):
+                # Les providers issus d'un miroir local ne sont pas signés
+                if '(unauthenticated)' in line:
+                    mirror_installs += 1
+                else:
+                    misses += 1
+        with self._stats_lock:
+            self.plugin_cache_stats['inits'] += 1
+            self.plugin_cache_stats['hits'] += hits
+            self.plugin_cache_stats['misses'] += misses
+            self.plugin_cache_stats['mirror_installs'] += mirror_installs
+    
+    def terraform_init(self, lab_id: int, output_callback: Callable[[str], None] = None,
+                       cancel_event: threading.Event = None) -> Dict[str, Any]:
         """Initialiser Terraform pour un lab"""
         workspace = self.get_lab_workspace(lab_id)
         
-        try:
-            result = subprocess.run(
-                ['terraform', 'init'],
-                cwd=workspace,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            
-            return {
-                'success': result.returncode == 0,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                'success': False,
-                'stdout': '',
-                'stderr': 'Timeout during terraform init',
-                'returncode': -1
-            }
+        # Réécrite à chaque init: le miroir a pu être rempli par un autre processus
+        self._write_cli_config()
+        
+        result = run_streaming(
+            ['terraform', 'init', '-input=false'],
+            cwd=workspace,
+            timeout=300,
+            timeout_message='Timeout during terraform init',
+            output_callback=output_callback,
+            cancel_event=cancel_event,
+            env=self._terraform_env()
+        )
+        if result['success']:
+            self._record_init_stats(result['stdout'])
+        return result
     
-    def terraform_plan(self, lab_id: int) -> Dict[str, Any]:
-        """Planifier le déploiement Terraform"""
+    def terraform_plan(self, lab_id: int, output_callback: Callable[[str], None] = None,
+                       cancel_event: threading.Event = None, targets: List[str] = None) -> Dict[str, Any]:
+        """
+        Planifier le déploiement Terraform dans un fichier de plan consommé par terraform_apply.
+        targets limite le plan à ces ressources (et à leurs dépendances).
+        """
         workspace = self.get_lab_workspace(lab_id)
         
-        try:
-            result = subprocess.run(
-                ['terraform', 'plan', '-out=tfplan'],
-                cwd=workspace,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            
-            return {
-                'success': result.returncode == 0,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                'success': False,
-                'stdout': '',
-                'stderr': 'Timeout during terraform plan',
-                'returncode': -1
-            }
+        # -detailed-exitcode: 0 = aucun changement, 2 = changements à appliquer
+        cmd = ['terraform', 'plan', '-input=false', '-detailed-exitcode', f'-out={self.PLAN_FILE}']
+        cmd += [f'-target={target}' for target in targets or []]
+        result = run_streaming(
+            cmd,
+            cwd=workspace,
+            timeout=300,
+            timeout_message='Timeout during terraform plan',
+            output_callback=output_callback,
+            cancel_event=cancel_event,
+            env=self._terraform_env()
+        )
+        if result['returncode'] == 2:
+            result['success'] = True
+        result['has_changes'] = result['returncode'] == 2
+        return result
     
-    def terraform_apply(self, lab_id: int) -> Dict[str, Any]:
-        """Appliquer la configuration Terraform"""
+    def get_plan_summary(self, lab_id: int) -> Dict[str, Any]:
+        """Résumé du plan enregistré (ressources à créer, modifier, détruire) via terraform show -json"""
         workspace = self.get_lab_workspace(lab_id)
         
         try:
             result = subprocess.run(
-                ['terraform', 'apply', '-auto-approve', 'tfplan'],
+                ['terraform', 'show', '-json', self.PLAN_FILE],
                 cwd=workspace,
+                env={**os.environ, **self._terraform_env()},
                 capture_output=True,
                 text=True,
-                timeout=1800  # 30 minutes
+                timeout=120
             )
-            
-            return {
-                'success': result.returncode == 0,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-        except subprocess.TimeoutExpired:
+            if result.returncode != 0:
+                return {
+                    'success': False,
+                    'error': result.stderr
+                }
+            plan = json.loads(result.stdout)
+        except (subprocess.TimeoutExpired, json.JSONDecodeError) as e:
             return {
                 'success': False,
-                'stdout': '',
-                'stderr': 'Timeout during terraform apply',
-                'returncode': -1
+                'error': str(e)
             }
+        
+        summary = {'success': True, 'add': 0, 'change': 0, 'destroy': 0, 'output_changes': 0, 'resources': []}
+        for resource_change in plan.get('resource_changes', []):
+            actions = resource_change.get('change', {}).get('actions', [])
+            if actions in (['no-op'], ['read']):
+                continue
+            # Un remplacement compte comme une création et une destruction, comme dans terraform plan
+            if 'create' in actions:
+                summary['add'] += 1
+            if 'delete' in actions:
+                summary['destroy'] += 1
+            if 'update' in actions:
+                summary['change'] += 1
+            summary['resources'].append({'address': resource_change.get('address'), 'actions': actions})
+        for output_change in plan.get('output_changes', {}).values():
+            if output_change.get('actions', ['no-op']) != ['no-op']:
+                summary['output_changes'] += 1
+        summary['empty'] = not (summary['add'] or summary['change'] or summary['destroy'] or summary['output_changes'])
+        return summary
     
-    def terraform_destroy(self, lab_id: int) -> Dict[str, Any]:
+    def discard_plan(self, lab_id: int):
+        """Supprimer le fichier de plan pour qu'il ne soit jamais appliqué deux fois"""
+        plan_path = os.path.join(self.get_lab_workspace(lab_id), self.PLAN_FILE)
+        if os.path.exists(plan_path):
+            os.remove(plan_path)
+    
+    def terraform_apply(self, lab_id: int, output_callback: Callable[[str], None] = None,
+                        cancel_event: threading.Event = None) -> Dict[str, Any]:
+        """Appliquer le plan enregistré par terraform_plan (sans nouveau refresh ni plan)"""
+        workspace = self.get_lab_workspace(lab_id)
+        
+        result = run_streaming(
+            ['terraform', 'apply', '-input=false', '-auto-approve', self.PLAN_FILE],
+            cwd=workspace,
+            timeout=1800,  # 30 minutes
+            timeout_message='Timeout during terraform apply',
+            output_callback=output_callback,
+            cancel_event=cancel_event,
+            env=self._terraform_env()
+        )
+        # Un plan appliqué (ou partiellement appliqué) est périmé
+        self.discard_plan(lab_id)
+        return result
+    
+    def terraform_destroy(self, lab_id: int, output_callback: Callable[[str], None] = None,
+                          cancel_event: threading.Event = None) -> Dict[str, Any]:
         """Détruire l'infrastructure Terraform"""
         workspace = self.get_lab_workspace(lab_id)
         
-        try:
-            result = subprocess.run(
-                ['terraform', 'destroy', '-auto-approve'],
-                cwd=workspace,
-                capture_output=True,
-                text=True,
-                timeout=1800  # 30 minutes
-            )
-            
-            return {
-                'success': result.returncode == 0,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                'success': False,
-                'stdout': '',
-                'stderr': 'Timeout during terraform destroy',
-                'returncode': -1
-            }
+        return run_streaming(
+            ['terraform', 'destroy', '-auto-approve'],
+            cwd=workspace,
+            timeout=1800,  # 30 minutes
+            timeout_message='Timeout during terraform destroy',
+            output_callback=output_callback,
+            cancel_event=cancel_event,
+            env=self._terraform_env()
+        )
     
     def get_terraform_outputs(self, lab_id: int) -> Dict[str, Any]:
         """Récupérer les outputs Terraform"""
@@ -479,6 +731,7 @@ ssh_public_key = "{provider_config.get('ssh_public_key', 'YOUR_SSH_PUBLIC_KEY')}
             result = subprocess.run(
                 ['terraform', 'output', '-json'],
                 cwd=workspace,
+                env={**os.environ, **self._terraform_env()},
                 capture_output=True,
                 text=True,
                 timeout=60
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+# Limites de débit serveur -> navigateur en octets/s (0 = illimité)
+SESSION_RATE_LIMIT = int(os.getenv("WS_SESSION_RATE_LIMIT", 0))
+LAB_RATE_LIMIT = int(os.getenv("WS_LAB_RATE_LIMIT", 0))
+# Rafale autorisée, en secondes de débit
+RATE_BURST_SECONDS = float(os.getenv("WS_RATE_BURST_SECONDS", 1.0))
+
+
+class TokenBucket:
+    """
+    Seau à jetons asynchrone (un jeton = un octet).
+
+    consume() réserve immédiatement les octets, quitte à rendre le solde négatif, puis
+    attend le temps nécessaire pour rembourser la dette: les trames plus grandes que la
+    rafale passent quand même et plusieurs consommateurs se partagent le débit.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or rate * RATE_BURST_SECONDS
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount: int) -> float:
+        """Consommer amount jetons; retourne le temps d'attente imposé (secondes)"""
+        self._refill()
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._refill()
+        return {"rate": self.rate, "burst": self.capacity, "available": round(self.tokens)}
+
+
+class SessionStats:
+    """Compteurs d'une session relayée ("up" = navigateur -> machine, "down" = machine -> navigateur)"""
+
+    __slots__ = ("bytes_up", "bytes_down", "messages_up", "messages_down",
+                 "throttled_seconds", "started_at", "last_activity")
+
+    def __init__(self):
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.messages_up = 0
+        self.messages_down = 0
+        self.throttled_seconds = 0.0
+        self.started_at = time.time()
+        self.last_activity = self.started_at
+
+    def record_up(self, size: int):
+        self.bytes_up += size
+        self.messages_up += 1
+        self.last_activity = time.time()
+
+    def record_down(self, size: int):
+        self.bytes_down += size
+        self.messages_down += 1
+        self.last_activity = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        return {
+            "bytes_up": self.bytes_up,
+            "bytes_down": self.bytes_down,
+            "messages_up": self.messages_up,
+            "messages_down": self.messages_down,
+            "avg_rate_down": round(self.bytes_down / elapsed),
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "last_activity": self.last_activity
+        }
+
+
+class TrafficShaper:
+    """Seaux à jetons par session et par lab pour le flux descendant du proxy"""
+
+    def __init__(self, session_rate: int = None, lab_rate: int = None):
+        self.session_rate = SESSION_RATE_LIMIT if session_rate is None else session_rate
+        self.lab_rate = LAB_RATE_LIMIT if lab_rate is None else lab_rate
+        self._session_buckets: Dict[str, TokenBucket] = {}
+        # lab_id -> [seau partagé, nombre de sessions]
+        self._lab_buckets: Dict[str, list] = {}
+
+    def open(self, session_id: str, lab_id: str):
+        if self.session_rate:
+            self._session_buckets[session_id] = TokenBucket(self.session_rate)
+        if self.lab_rate:
+            entry = self._lab_buckets.setdefault(lab_id, [TokenBucket(self.lab_rate), 0])
+            entry[1] += 1
+
+    def close(self, session_id: str, lab_id: str):
+        self._session_buckets.pop(session_id, None)
+        entry = self._lab_buckets.get(lab_id)
+        if entry:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._lab_buckets[lab_id]
+
+    async def throttle(self, session_id: str, lab_id: str, size: int) -> float:
+        """Attendre que la session et son lab aient le débit pour size octets"""
+        delay = 0.0
+        bucket = self._session_buckets.get(session_id)
+        if bucket:
+            delay += await bucket.consume(size)
+        entry = self._lab_buckets.get(lab_id)
+        if entry:
+            delay += await entry[0].consume(size)
+        return delay
+
+    def get_limits(self, session_id: str = None, lab_id: str = None) -> Dict[str, Any]:
+        limits: Dict[str, Optional[Dict[str, Any]]] = {
+            "session_rate": self.session_rate or None,
+            "lab_rate": self.lab_rate or None
+        }
+        if session_id in self._session_buckets:
+            limits["session_bucket"] = self._session_buckets[session_id].to_dict()
+        if lab_id in self._lab_buckets:
+            limits["lab_bucket"] = self._lab_buckets[lab_id][0].to_dict()
+        return limits
@@ -1,82 +1,286 @@
 import asyncio
-import websockets
-import socket
+import contextlib
+import os
+import random
 import threading
+import time
 import logging
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import uuid
 import uvicorn
 from starlette.applications import Starlette
-from starlette.routing import WebSocketRoute
-from starlette.websockets import WebSocket
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from src.services.activity_tracker import ActivityFlusher, activity_flusher
+from src.services.freerdp_service import RDPBackendError, encode_instruction, freerdp_service
+from src.services.machine_resolver import MachineEndpointResolver, machine_resolver
+from src.services.session_recorder import (
+    RECORDING_MODE, RecordingReader, RecordingWriter, list_recordings, recording_writer, replay
+)
+from src.services.session_registry import SessionRegistry, WORKER_ID, create_registry
+from src.services.traffic_control import SessionStats, TrafficShaper
+from src.services.ws_compression import get_compression, uvicorn_ws_options
 
 logger = logging.getLogger(__name__)
 
+# Taille des lectures côté VNC: elle double quand une lecture remplit le tampon (mise à jour
+# plein écran) et diminue quand le flux redevient faible (curseur, petites zones)
+MIN_READ_SIZE = int(os.getenv("WS_PROXY_MIN_READ_SIZE", 16 * 1024))
+MAX_READ_SIZE = int(os.getenv("WS_PROXY_MAX_READ_SIZE", 256 * 1024))
+# Seuil haut du tampon d'écriture vers le serveur VNC au-delà duquel drain() attend
+WRITE_BUFFER_HIGH = int(os.getenv("WS_PROXY_WRITE_BUFFER_HIGH", 256 * 1024))
+# Intervalle de publication des compteurs de session dans le registre
+STATS_INTERVAL = float(os.getenv("WS_STATS_INTERVAL", 5))
+# Vitesses de relecture des enregistrements
+REPLAY_SPEEDS = (1, 4, 16)
+# Keepalive WebSocket (ping/pong gérés par uvicorn): une connexion sans pong est fermée
+PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 20))
+PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", 20))
+# Fermeture des sessions sans aucun octet relayé depuis IDLE_TIMEOUT secondes (0 = jamais)
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 1800))
+
+class UpstreamUnavailable(Exception):
+    """Raised when an upstream (VNC/RDP) server cannot be reached"""
+
+
+class UpstreamConnector:
+    """
+    Open TCP connections to lab machines without blocking the event loop.
+    
+    Each attempt is bounded by connect_timeout, failed attempts are retried with a jittered
+    exponential backoff, and a failure is remembered for negative_ttl seconds per host:port
+    so that reconnect storms from noVNC clients fail fast instead of piling up connects.
+    """
+    
+    def __init__(self, connect_timeout: float = None, retries: int = None, backoff: float = None,
+                 negative_ttl: float = None):
+        self.connect_timeout = connect_timeout or float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+        self.retries = retries if retries is not None else int(os.getenv("UPSTREAM_CONNECT_RETRIES", 2))
+        self.backoff = backoff or float(os.getenv("UPSTREAM_CONNECT_BACKOFF", 0.25))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(os.getenv("UPSTREAM_NEGATIVE_TTL", 10))
+        # "host:port" -> (expiry, error message)
+        self._failures: Dict[str, Tuple[float, str]] = {}
+        self.stats = {"connects": 0, "failures": 0, "retries": 0, "negative_hits": 0}
+    
+    async def open(self, host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        key = f"{host}:{port}"
+        failure = self._failures.get(key)
+        if failure:
+            expiry, error = failure
+            if time.monotonic() < expiry:
+                self.stats["negative_hits"] += 1
+                raise UpstreamUnavailable(f"{key} unreachable (cached): {error}")
+            del self._failures[key]
+        
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                delay = self.backoff * (2 ** (attempt - 1))
+                await asyncio.sleep(random.uniform(delay / 2, delay * 1.5))
+            try:
+                connection = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+                self.stats["connects"] += 1
+                return connection
+            except asyncio.TimeoutError:
+                last_error = f"timeout after {self.connect_timeout}s"
+            except OSError as e:
+                last_error = str(e) or e.__class__.__name__
+        
+        self.stats["failures"] += 1
+        if self.negative_ttl > 0:
+            self._failures[key] = (time.monotonic() + self.negative_ttl, last_error)
+        raise UpstreamUnavailable(f"{key} unreachable: {last_error}")
+    
+    def forget(self, host: str, port: int):
+        """Drop a cached failure (e.g. once the machine has been redeployed)"""
+        self._failures.pop(f"{host}:{port}", None)
+    
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "unreachable": [key for key, (expiry, _) in self._failures.items() if expiry > now]
+        }
+
+
 class WebSocketProxy:
-    def __init__(self):
+    def __init__(self, connector: UpstreamConnector = None, registry: SessionRegistry = None,
+                 shaper: TrafficShaper = None, recorder: RecordingWriter = None,
+                 activity: ActivityFlusher = None, resolver: MachineEndpointResolver = None):
+        # Local sockets of this worker; the registry holds the cluster-wide view of sessions
         self.active_connections: Dict[str, dict] = {}
+        self.connector = connector or UpstreamConnector()
+        self.registry = registry or create_registry()
+        self.shaper = shaper or TrafficShaper()
+        self.recorder = recorder or recording_writer
+        self.activity = activity or activity_flusher
+        self.resolver = resolver or machine_resolver
+        self._heartbeat_task: Optional[asyncio.Task] = None
+    
+    async def _registry_call(self, func, *args, **kwargs):
+        """Call the session registry without blocking the event loop (SQLite/Redis do I/O)"""
+        try:
+            if self.registry.blocking:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Session registry error: {e}")
+    
+    async def _register_session(self, connection_id: str, info: dict):
+        await self._registry_call(self.registry.register, connection_id, info)
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+    
+    async def _heartbeat(self):
+        """Publish this worker's session counters, which also keeps the sessions from expiring"""
+        interval = max(1.0, min(self.registry.ttl / 3, STATS_INTERVAL))
+        while True:
+            await asyncio.sleep(interval)
+            # One failure must not stop stats publishing and session upkeep for good
+            try:
+                await self._check_activity()
+                await self._check_close_requests()
+                if self.active_connections:
+                    await self._registry_call(self.registry.update_many, {
+                        connection_id: self._session_metrics(connection_id, conn_info)
+                        for connection_id, conn_info in list(self.active_connections.items())
+                    })
+            except Exception:
+                logger.exception("Session heartbeat failed")
+    
+    async def _check_activity(self):
+        """Report real traffic to the activity flusher and close sessions idle for too long"""
+        now = time.time()
+        for connection_id, conn_info in list(self.active_connections.items()):
+            last_activity = conn_info["stats"].last_activity
+            remote_session_id = conn_info.get("remote_session_id")
+            if remote_session_id and last_activity > conn_info.get("activity_reported", 0):
+                self.activity.touch(remote_session_id, last_activity, "connected")
+                conn_info["activity_reported"] = last_activity
+            if IDLE_TIMEOUT and now - last_activity > IDLE_TIMEOUT:
+                logger.info(f"Closing idle connection {connection_id} (no traffic for {IDLE_TIMEOUT:.0f}s)")
+                await self._close_session(connection_id, conn_info, "idle", "Idle timeout")
+    
+    async def _check_close_requests(self):
+        """Close sessions whose remote connection was disconnected or timed out by the Flask app"""
+        by_remote_id = {
+            conn_info["remote_session_id"]: connection_id
+            for connection_id, conn_info in list(self.active_connections.items())
+            if conn_info.get("remote_session_id")
+        }
+        if not by_remote_id:
+            return
+        requests = await self._registry_call(self.registry.pop_close_requests, list(by_remote_id)) or {}
+        for remote_session_id, reason in requests.items():
+            connection_id = by_remote_id[remote_session_id]
+            conn_info = self.active_connections.get(connection_id)
+            if conn_info is not None:
+                logger.info(f"Closing connection {connection_id} on request ({reason})")
+                await self._close_session(connection_id, conn_info, reason, f"Session {reason}")
+    
+    async def _close_session(self, connection_id: str, conn_info: dict, reason: str, message: str):
+        """Close the browser side with 4005; the relay then ends and _cleanup_connection stops the backend"""
+        conn_info["closed_reason"] = reason
+        try:
+            await conn_info["websocket"].close(code=4005, reason=message)
+        except RuntimeError:
+            pass
+        # Closing the upstream socket also ends the upstream -> WebSocket task
+        conn_info["writer"].close()
+    
+    def _session_metrics(self, connection_id: str, conn_info: dict) -> dict:
+        recording = conn_info.get("recording")
+        return {
+            "recording": recording.to_dict() if recording else None,
+            "stats": conn_info["stats"].to_dict(),
+            "limits": self.shaper.get_limits(connection_id, conn_info["lab_id"]),
+            "compression": get_compression(conn_info["websocket"])
+        }
         
     async def handle_vnc_connection(self, websocket: WebSocket):
         """Handle VNC WebSocket connection"""
+        connection_id = None
         try:
             # Extract connection parameters from path
             # Expected format: /vnc/{lab_id}/{machine_id}
-            path_parts = websocket.url.path.strip(\"/\").split(\"/\")
-            if len(path_parts) != 3 or path_parts[0] != \"vnc\":
+            path_parts = websocket.url.path.strip("/").split("/")
+            if len(path_parts) != 3 or path_parts[0] != "vnc":
                 await websocket.close(code=4000, reason="Invalid path format")
                 return
                 
             lab_id = path_parts[1]
             machine_id = path_parts[2]
             
-            # Get machine info and VNC details
-            machine_info = self._get_machine_info(lab_id, machine_id)
+            # Get machine info and VNC details (in-memory index, no DB round trip when warm)
+            machine_info = await self.resolver.resolve(lab_id, machine_id)
             if not machine_info:
                 await websocket.close(code=4001, reason="Machine not found")
                 return
                 
-            vnc_host = machine_info.get(\"ip_address\", \"localhost\")
-            vnc_port = machine_info.get(\"vnc_port\", 5901)
+            vnc_host = machine_info.get("ip_address", "localhost")
+            vnc_port = machine_info.get("vnc_port", 5901)
             
             # Create connection ID
             connection_id = str(uuid.uuid4())
             
             # Connect to VNC server
             try:
-                vnc_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                vnc_socket.connect((vnc_host, vnc_port))
-                vnc_socket.settimeout(30)
-                
-                # Store connection info
-                self.active_connections[connection_id] = {
-                    \"type\": \"vnc\",
-                    \"websocket\": websocket,
-                    \"socket\": vnc_socket,
-                    \"machine_id\": machine_id,
-                    \"lab_id\": lab_id
-                }
-                
-                # Start bidirectional data forwarding
-                await self._forward_data(websocket, vnc_socket, connection_id)
-                
-            except Exception as e:
+                reader, writer = await self.connector.open(vnc_host, vnc_port)
+            except UpstreamUnavailable as e:
                 logger.error(f"Failed to connect to VNC server {vnc_host}:{vnc_port}: {e}")
                 await websocket.close(code=4002, reason=f"VNC connection failed: {str(e)}")
+                return
+            writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+            
+            # noVNC negotiates the "binary" subprotocol
+            subprotocols = websocket.scope.get("subprotocols", [])
+            await websocket.accept(subprotocol="binary" if "binary" in subprotocols else None)
+            
+            # Store connection info
+            self.active_connections[connection_id] = {
+                "type": "vnc",
+                "websocket": websocket,
+                "writer": writer,
+                "machine_id": machine_id,
+                "lab_id": lab_id,
+                "remote_session_id": websocket.query_params.get("session_id"),
+                "stats": SessionStats()
+            }
+            if RECORDING_MODE == "all" or (RECORDING_MODE == "on-demand" and websocket.query_params.get("record") == "1"):
+                self.active_connections[connection_id]["recording"] = self.recorder.start(connection_id, {
+                    "type": "vnc", "lab_id": lab_id, "machine_id": machine_id
+                })
+            self.shaper.open(connection_id, lab_id)
+            await self._register_session(connection_id, {
+                "type": "vnc",
+                "lab_id": lab_id,
+                "machine_id": machine_id,
+                "upstream": f"{vnc_host}:{vnc_port}",
+                "client": websocket.client.host if websocket.client else None,
+                **self._session_metrics(connection_id, self.active_connections[connection_id])
+            })
+            
+            # Start bidirectional data forwarding
+            await self._forward_data(websocket, reader, writer, connection_id)
                 
         except Exception as e:
             logger.error(f"Error in VNC connection handler: {e}")
             await websocket.close(code=4003, reason="Internal server error")
         finally:
             if connection_id in self.active_connections:
-                self._cleanup_connection(connection_id)
+                await self._cleanup_connection(connection_id)
     
     async def handle_rdp_connection(self, websocket: WebSocket):
-        """Handle RDP WebSocket connection (via FreeRDP proxy)"""
+        """Handle RDP WebSocket connection (Guacamole protocol via a per-session gateway process)"""
+        connection_id = None
         try:
             # Extract connection parameters from path
-            # Expected format: /rdp/{lab_id}/{machine_id}
-            path_parts = websocket.url.path.strip(\"/\").split(\"/\")
-            if len(path_parts) != 3 or path_parts[0] != \"rdp\":
+            # Expected format: /rdp/{lab_id}/{machine_id}?session_id=...&width=...&height=...
+            path_parts = websocket.url.path.strip("/").split("/")
+            if len(path_parts) != 3 or path_parts[0] != "rdp":
                 await websocket.close(code=4000, reason="Invalid path format")
                 return
                 
@@ -84,37 +288,89 @@ class WebSocketProxy:
             machine_id = path_parts[2]
             
             # Get machine info and RDP details
-            machine_info = self._get_machine_info(lab_id, machine_id)
+            machine_info = await self.resolver.resolve(lab_id, machine_id)
             if not machine_info:
                 await websocket.close(code=4001, reason="Machine not found")
                 return
                 
-            rdp_host = machine_info.get(\"ip_address\", \"localhost\")
-            rdp_port = machine_info.get(\"rdp_port\", 3389)
+            rdp_host = machine_info.get("ip_address", "localhost")
+            rdp_port = machine_info.get("rdp_port", 3389)
+            # Credentials come from the remote connection created by /api/remote-access/connect
+            credentials = await self.resolver.get_rdp_credentials(websocket.query_params.get("session_id")) or {}
             
             # Create connection ID
             connection_id = str(uuid.uuid4())
             
-            # For RDP, we would need to implement a more complex proxy
-            # This is a simplified version - in production, consider using
-            # libraries like python-rdp or integrating with FreeRDP
+            try:
+                backend = await freerdp_service.create_rdp_session(
+                    rdp_host, rdp_port,
+                    username=credentials.get("username"),
+                    password=credentials.get("password"),
+                    domain=websocket.query_params.get("domain"),
+                    width=int(websocket.query_params.get("width", 1024)),
+                    height=int(websocket.query_params.get("height", 768)),
+                    dpi=int(websocket.query_params.get("dpi", 96)),
+                    session_id=connection_id
+                )
+            except (RDPBackendError, asyncio.TimeoutError) as e:
+                logger.error(f"Failed to open RDP session to {rdp_host}:{rdp_port}: {e}")
+                await websocket.close(code=4002, reason=f"RDP connection failed: {str(e)}")
+                return
             
-            await websocket.close(code=4004, reason="RDP support not yet implemented")
+            # guacamole-common-js negotiates the "guacamole" subprotocol and expects the
+            # tunnel UUID as an internal (empty opcode) instruction
+            subprotocols = websocket.scope.get("subprotocols", [])
+            await websocket.accept(subprotocol="guacamole" if "guacamole" in subprotocols else None)
+            await websocket.send_text(encode_instruction("", backend.connection_id))
+            
+            self.active_connections[connection_id] = {
+                "type": "rdp",
+                "websocket": websocket,
+                "writer": backend.writer,
+                "backend": backend,
+                "machine_id": machine_id,
+                "lab_id": lab_id,
+                "remote_session_id": websocket.query_params.get("session_id"),
+                "stats": SessionStats()
+            }
+            self.shaper.open(connection_id, lab_id)
+            await self._register_session(connection_id, {
+                "type": "rdp",
+                "lab_id": lab_id,
+                "machine_id": machine_id,
+                "upstream": f"{rdp_host}:{rdp_port}",
+                "gateway_pid": backend.process.pid,
+                "client": websocket.client.host if websocket.client else None,
+                **self._session_metrics(connection_id, self.active_connections[connection_id])
+            })
+            
+            # Instructions received together with "ready"
+            if backend.parser.pending:
+                await websocket.send_text(backend.parser.pending)
+                backend.parser.pending = ""
+            await self._forward_data(websocket, backend.reader, backend.writer, connection_id)
             
         except Exception as e:
             logger.error(f"Error in RDP connection handler: {e}")
             await websocket.close(code=4003, reason="Internal server error")
+        finally:
+            if connection_id in self.active_connections:
+                await self._cleanup_connection(connection_id)
+            elif connection_id:
+                await freerdp_service.terminate_session(connection_id)
     
-    async def _forward_data(self, websocket: WebSocket, socket_conn, connection_id):
+    async def _forward_data(self, websocket: WebSocket, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter, connection_id):
         """Forward data bidirectionally between WebSocket and socket"""
         try:
+            if self.active_connections[connection_id]["type"] == "rdp":
+                ws_to_socket, socket_to_ws = self._forward_guacamole_ws_to_socket, self._forward_guacamole_to_ws
+            else:
+                ws_to_socket, socket_to_ws = self._forward_ws_to_socket, self._forward_socket_to_ws
+            
             # Create tasks for both directions
-            ws_to_socket_task = asyncio.create_task(
-                self._forward_ws_to_socket(websocket, socket_conn, connection_id)
-            )
-            socket_to_ws_task = asyncio.create_task(
-                self._forward_socket_to_ws(websocket, socket_conn, connection_id)
-            )
+            ws_to_socket_task = asyncio.create_task(ws_to_socket(websocket, writer, connection_id))
+            socket_to_ws_task = asyncio.create_task(socket_to_ws(websocket, reader, connection_id))
             
             # Wait for either task to complete (or fail)
             done, pending = await asyncio.wait(
@@ -125,81 +381,237 @@ class WebSocketProxy:
             # Cancel remaining tasks
             for task in pending:
                 task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
                 
         except Exception as e:
             logger.error(f"Error in data forwarding: {e}")
         finally:
-            self._cleanup_connection(connection_id)
+            await self._cleanup_connection(connection_id)
     
-    async def _forward_ws_to_socket(self, websocket: WebSocket, socket_conn, connection_id):
+    async def _forward_ws_to_socket(self, websocket: WebSocket, writer: asyncio.StreamWriter, connection_id):
         """Forward data from WebSocket to socket"""
+        stats = self.active_connections[connection_id]["stats"]
         try:
             async for message in websocket.iter_bytes():
-                socket_conn.send(message)
-        except websockets.exceptions.ConnectionClosedOK:
+                stats.record_up(len(message))
+                writer.write(message)
+                # Backpressure: stop reading the WebSocket while the VNC server is not consuming
+                await writer.drain()
+        except WebSocketDisconnect:
             logger.info(f"WebSocket connection closed for {connection_id}")
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.info(f"VNC connection closed for {connection_id}: {e}")
         except Exception as e:
             logger.error(f"Error forwarding WS to socket: {e}")
     
-    async def _forward_socket_to_ws(self, websocket: WebSocket, socket_conn, connection_id):
+    async def _forward_socket_to_ws(self, websocket: WebSocket, reader: asyncio.StreamReader, connection_id):
         """Forward data from socket to WebSocket"""
+        read_size = MIN_READ_SIZE
+        conn_info = self.active_connections[connection_id]
+        stats, lab_id, recording = conn_info["stats"], conn_info["lab_id"], conn_info.get("recording")
         try:
-            loop = asyncio.get_event_loop()
             while True:
-                # Read from socket in a non-blocking way
-                data = await loop.run_in_executor(None, socket_conn.recv, 4096)
+                data = await reader.read(read_size)
                 if not data:
                     break
+                # Per-session and per-lab token buckets (no-op when no limit is configured)
+                stats.throttled_seconds += await self.shaper.throttle(connection_id, lab_id, len(data))
+                stats.record_down(len(data))
+                # send_bytes only returns once the frame is handed to the transport, which
+                # throttles reads from the VNC server when the browser is slow
                 await websocket.send_bytes(data)
+                if recording:
+                    recording.write(data)
+                if len(data) == read_size:
+                    read_size = min(read_size * 2, MAX_READ_SIZE)
+                elif len(data) < read_size // 4:
+                    read_size = max(read_size // 2, MIN_READ_SIZE)
+        except (WebSocketDisconnect, ConnectionError) as e:
+            logger.info(f"Connection closed for {connection_id}: {e}")
         except Exception as e:
             logger.error(f"Error forwarding socket to WS: {e}")
     
-    def _get_machine_info(self, lab_id: str, machine_id: str) -> Optional[dict]:
-        """Get machine information from database"""
+    async def _forward_guacamole_ws_to_socket(self, websocket: WebSocket, writer: asyncio.StreamWriter,
+                                              connection_id):
+        """Forward Guacamole instructions from the browser to the gateway"""
+        stats = self.active_connections[connection_id]["stats"]
+        try:
+            async for message in websocket.iter_text():
+                stats.record_up(len(message))
+                # Internal tunnel instructions (empty opcode) are answered here: ping is echoed
+                if message.startswith("0.,"):
+                    if message.startswith("0.,4.ping,"):
+                        await websocket.send_text(message)
+                    continue
+                writer.write(message.encode())
+                await writer.drain()
+        except WebSocketDisconnect:
+            logger.info(f"WebSocket connection closed for {connection_id}")
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.info(f"RDP gateway connection closed for {connection_id}: {e}")
+        except Exception as e:
+            logger.error(f"Error forwarding WS to RDP gateway: {e}")
+    
+    async def _forward_guacamole_to_ws(self, websocket: WebSocket, reader: asyncio.StreamReader, connection_id):
+        """Forward complete Guacamole instructions from the gateway to the browser"""
+        conn_info = self.active_connections[connection_id]
+        stats, lab_id, backend = conn_info["stats"], conn_info["lab_id"], conn_info["backend"]
+        parser = backend.parser
         try:
-            from src.models.lab import Machine
-            machine = Machine.query.filter_by(id=int(machine_id), lab_id=int(lab_id)).first()
-            if machine:
-                return {
-                    \"ip_address\": machine.ip_address,
-                    \"vnc_port\": 5901,  # Default VNC port
-                    \"rdp_port\": 3389,  # Default RDP port
-                }
-            return None
+            while True:
+                data = await reader.read(MAX_READ_SIZE)
+                if not data:
+                    break
+                # Count and shape every byte read, even when it only completes a later instruction
+                stats.throttled_seconds += await self.shaper.throttle(connection_id, lab_id, len(data))
+                stats.record_down(len(data))
+                text = parser.feed(data)
+                if not text:
+                    continue
+                await websocket.send_text(text)
+                # A "sync" instruction ends the first complete frame
+                if backend.first_frame_at is None and "4.sync," in text:
+                    freerdp_service.record_first_frame(backend)
+        except (WebSocketDisconnect, ConnectionError) as e:
+            logger.info(f"Connection closed for {connection_id}: {e}")
         except Exception as e:
-            logger.error(f"Error getting machine info: {e}")
-            return None
+            logger.error(f"Error forwarding RDP gateway to WS: {e}")
+    
+    async def handle_replay_connection(self, websocket: WebSocket):
+        """Stream a recorded VNC session to noVNC (?speed=1|4|16, ?start=seconds to fast-forward)"""
+        try:
+            reader = RecordingReader(self.recorder.directory, websocket.path_params["recording_id"])
+        except (FileNotFoundError, ValueError):
+            await websocket.close(code=4001, reason="Recording not found")
+            return
+        try:
+            speed = float(websocket.query_params.get("speed", 1))
+            start_ms = int(float(websocket.query_params.get("start", 0)) * 1000)
+        except ValueError:
+            speed = None
+        if speed not in REPLAY_SPEEDS:
+            await websocket.close(code=4000, reason=f"Speed must be one of {REPLAY_SPEEDS}")
+            return
+        
+        subprotocols = websocket.scope.get("subprotocols", [])
+        await websocket.accept(subprotocol="binary" if "binary" in subprotocols else None)
+        
+        async def discard_client_messages():
+            # noVNC still sends its handshake and input; the recording answers none of it
+            try:
+                async for _ in websocket.iter_bytes():
+                    pass
+            except WebSocketDisconnect:
+                pass
+        
+        tasks = [asyncio.create_task(replay(reader, websocket.send_bytes, speed, start_ms)),
+                 asyncio.create_task(discard_client_messages())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), (WebSocketDisconnect, ConnectionError)):
+                logger.error(f"Error replaying recording: {task.exception()}")
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
     
-    def _cleanup_connection(self, connection_id: str):
+    async def _cleanup_connection(self, connection_id: str):
         """Clean up connection resources"""
         if connection_id in self.active_connections:
-            conn_info = self.active_connections[connection_id]
+            conn_info = self.active_connections.pop(connection_id)
+            self.shaper.close(connection_id, conn_info["lab_id"])
             try:
-                if \"socket\" in conn_info:
-                    conn_info[\"socket\"].close()
-            except:
+                if "writer" in conn_info:
+                    conn_info["writer"].close()
+            except Exception:
                 pass
-            del self.active_connections[connection_id]
+            if conn_info.get("recording"):
+                conn_info["recording"].close()
+            if conn_info.get("remote_session_id"):
+                self.activity.touch(conn_info["remote_session_id"], conn_info["stats"].last_activity, "disconnected")
+            if "backend" in conn_info:
+                await freerdp_service.terminate_session(connection_id)
+            await self._registry_call(self.registry.unregister, connection_id)
             logger.info(f"Cleaned up connection {connection_id}")
+    
+    def get_sessions(self) -> list:
+        """Sessions of all workers sharing the registry (live counters for this worker's sessions)"""
+        sessions = self.registry.list_sessions()
+        for session in sessions:
+            conn_info = self.active_connections.get(session["id"])
+            if conn_info is not None:
+                session.update(self._session_metrics(session["id"], conn_info))
+        return sessions
 
 # Global proxy instance
 proxy = WebSocketProxy()
 
+def request_session_close(remote_session_ids, reason: str = "disconnected"):
+    """Ask the worker holding these remote connections' sessions to close them (called from Flask)"""
+    remote_session_ids = [remote_session_id for remote_session_id in remote_session_ids if remote_session_id]
+    if not remote_session_ids:
+        return
+    try:
+        proxy.registry.request_close(remote_session_ids, reason)
+    except Exception as e:
+        logger.error(f"Failed to request close of proxy sessions {remote_session_ids}: {e}")
+
 async def vnc_websocket_endpoint(websocket: WebSocket):
     await proxy.handle_vnc_connection(websocket)
 
 async def rdp_websocket_endpoint(websocket: WebSocket):
     await proxy.handle_rdp_connection(websocket)
 
-websocket_app = Starlette(routes=[
+async def sessions_endpoint(request: Request):
+    sessions = await proxy._registry_call(proxy.get_sessions) or []
+    return JSONResponse({"sessions": sessions, "count": len(sessions)})
+
+async def replay_websocket_endpoint(websocket: WebSocket):
+    await proxy.handle_replay_connection(websocket)
+
+async def recordings_endpoint(request: Request):
+    recordings = await asyncio.to_thread(list_recordings, proxy.recorder.directory)
+    return JSONResponse({"recordings": recordings, "count": len(recordings), **proxy.recorder.get_stats()})
+
+async def rdp_pool_endpoint(request: Request):
+    return JSONResponse({"worker": WORKER_ID, **freerdp_service.get_pool_stats()})
+
+async def health_endpoint(request: Request):
+    return JSONResponse({"status": "ok", "worker": WORKER_ID, "local_sessions": len(proxy.active_connections),
+                         "machine_index": proxy.resolver.get_stats()})
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await proxy.resolver.warm()
+    # Pre-start the RDP gateway pool of this worker so the first sessions do not wait
+    if freerdp_service.pool_min and freerdp_service.is_available():
+        freerdp_service.start_pool()
+    yield
+    await freerdp_service.shutdown()
+    await proxy.activity.flush()
+
+websocket_app = Starlette(lifespan=lifespan, routes=[
     WebSocketRoute("/vnc/{lab_id}/{machine_id}", vnc_websocket_endpoint),
     WebSocketRoute("/rdp/{lab_id}/{machine_id}", rdp_websocket_endpoint),
+    WebSocketRoute("/replay/{recording_id}", replay_websocket_endpoint),
+    Route("/sessions", sessions_endpoint),
+    Route("/recordings", recordings_endpoint),
+    Route("/rdp-pool", rdp_pool_endpoint),
+    Route("/health", health_endpoint),
 ])
 
-def run_websocket_server_thread(host=\"0.0.0.0\", port=8765):
+def uvicorn_options() -> dict:
+    """WebSocket settings shared by the embedded server and src/proxy_main.py"""
+    return {"ws_ping_interval": PING_INTERVAL or None, "ws_ping_timeout": PING_TIMEOUT or None,
+            **uvicorn_ws_options()}
+
+def run_websocket_server_thread(host="0.0.0.0", port=8765):
     """Run WebSocket server in a separate thread using uvicorn"""
     def run_server():
-        uvicorn.run(websocket_app, host=host, port=port, log_level="info")
+        uvicorn.run(websocket_app, host=host, port=port, log_level="info", **uvicorn_options())
 
     thread = threading.Thread(target=run_server, daemon=True)
     thread.start()
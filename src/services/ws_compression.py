@@ -0,0 +1,198 @@
+import os
+import time
+from typing import Any, Dict, Sequence
+
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, Frame, Opcode
+from websockets.typing import ExtensionParameter
+
+# Compression permessage-deflate du proxy (négociée seulement si WS_COMPRESSION=True)
+COMPRESSION_ENABLED = os.getenv("WS_COMPRESSION", "False") == "True"
+COMPRESSION_LEVEL = int(os.getenv("WS_COMPRESSION_LEVEL", 1))
+# "auto" (décision mesurée par session), "on" ou "off" (extension négociée mais inutilisée)
+COMPRESSION_MODE = os.getenv("WS_COMPRESSION_MODE", "auto")
+# Désactivation si le gain est inférieur à MIN_SAVING ou si le coût dépasse MAX_CPU_MS_PER_MB
+MIN_SAVING = float(os.getenv("WS_COMPRESSION_MIN_SAVING", 0.15))
+MAX_CPU_MS_PER_MB = float(os.getenv("WS_COMPRESSION_MAX_CPU_MS_PER_MB", 40))
+# Volume mesuré avant chaque décision et délai avant de réessayer une session désactivée
+SAMPLE_BYTES = int(os.getenv("WS_COMPRESSION_SAMPLE_BYTES", 512 * 1024))
+RETRY_SECONDS = float(os.getenv("WS_COMPRESSION_RETRY_SECONDS", 30))
+
+# Clé de la session de compression dans scope["extensions"]
+SCOPE_KEY = "websocket.compression"
+
+
+class AdaptiveDeflate(PerMessageDeflate):
+    """
+    permessage-deflate dont la compression peut être suspendue par message.
+
+    RFC 7692 laisse l'émetteur choisir message par message (bit RSV1): en mode "auto",
+    chaque fenêtre de SAMPLE_BYTES est évaluée (taux de compression, temps CPU) et la
+    compression est coupée pendant RETRY_SECONDS si elle ne rapporte pas assez ou coûte
+    trop cher; "on" et "off" forcent le choix.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mode = COMPRESSION_MODE
+        self.enabled = True
+        self.disabled_until = 0.0
+        self.toggles = 0
+        # Totaux de la session et fenêtre de mesure courante
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_skipped = 0
+        self.cpu_seconds = 0.0
+        self._window_in = 0
+        self._window_out = 0
+        self._window_cpu = 0.0
+        self._compress_message = True
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not Opcode.CONT:
+            self._compress_message = self._should_compress()
+        if not self._compress_message:
+            self.bytes_skipped += len(frame.data)
+            return frame
+
+        start = time.perf_counter()
+        encoded = super().encode(frame)
+        elapsed = time.perf_counter() - start
+        self._record(len(frame.data), len(encoded.data), elapsed)
+        return encoded
+
+    def _should_compress(self) -> bool:
+        if self.mode != "auto":
+            return self.mode == "on"
+        if not self.enabled and time.monotonic() >= self.disabled_until:
+            # Nouvel essai: le contenu de l'écran a pu changer
+            self.enabled = True
+            self.toggles += 1
+        return self.enabled
+
+    def _record(self, size_in: int, size_out: int, elapsed: float):
+        self.bytes_in += size_in
+        self.bytes_out += size_out
+        self.cpu_seconds += elapsed
+        self._window_in += size_in
+        self._window_out += size_out
+        self._window_cpu += elapsed
+        if self._window_in < SAMPLE_BYTES:
+            return
+
+        saving = 1 - self._window_out / self._window_in
+        cpu_ms_per_mb = self._window_cpu * 1000 / (self._window_in / 1e6)
+        self._window_in = self._window_out = 0
+        self._window_cpu = 0.0
+        if self.mode == "auto" and (saving < MIN_SAVING or cpu_ms_per_mb > MAX_CPU_MS_PER_MB):
+            self.enabled = False
+            self.disabled_until = time.monotonic() + RETRY_SECONDS
+            self.toggles += 1
+
+    def set_mode(self, mode: str):
+        if mode not in ("auto", "on", "off"):
+            raise ValueError(f"Invalid compression mode: {mode}")
+        self.mode = mode
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "negotiated": True,
+            "mode": self.mode,
+            "active": self.mode == "on" or (self.mode == "auto" and self.enabled),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_uncompressed": self.bytes_skipped,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            "cpu_ms": round(self.cpu_seconds * 1000, 1),
+            "cpu_ms_per_mb": round(self.cpu_seconds * 1000 / (self.bytes_in / 1e6), 2) if self.bytes_in else None,
+            "toggles": self.toggles
+        }
+
+
+class AdaptiveDeflateFactory(ServerPerMessageDeflateFactory):
+    """Négociation permessage-deflate standard produisant une extension AdaptiveDeflate"""
+
+    def process_request_params(self, params: Sequence[ExtensionParameter],
+                               accepted_extensions: Sequence[Extension]):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, AdaptiveDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings
+        )
+
+
+_protocol_class = None
+
+
+def _adaptive_protocol_class():
+    """
+    Protocole uvicorn avec compression adaptative, construit à la première utilisation.
+
+    WebSocketsSansIOProtocol est interne à uvicorn (>= 0.35): il n'est importé que si la
+    compression est activée, pour que l'import du proxy (et de l'application Flask) ne
+    dépende pas de la version d'uvicorn installée.
+    """
+    global _protocol_class
+    if _protocol_class is not None:
+        return _protocol_class
+
+    from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+
+    class AdaptiveCompressionWebSocketProtocol(WebSocketsSansIOProtocol):
+        """
+        Protocole WebSocket uvicorn (implémentation websockets sans E/S) avec compression adaptative.
+
+        À utiliser avec uvicorn.run(..., **uvicorn_ws_options()); l'application retrouve l'extension négociée (ou None)
+        dans scope["extensions"]["websocket.compression"].
+        """
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if self.config.ws_per_message_deflate:
+                self.conn.available_extensions = [
+                    AdaptiveDeflateFactory(
+                        server_max_window_bits=12,
+                        client_max_window_bits=12,
+                        compress_settings={"memLevel": 5, "level": COMPRESSION_LEVEL},
+                    )
+                ]
+
+        async def run_asgi(self) -> None:
+            self.scope["extensions"][SCOPE_KEY] = next(
+                (extension for extension in self.conn.extensions if isinstance(extension, AdaptiveDeflate)), None
+            )
+            await super().run_asgi()
+
+    _protocol_class = AdaptiveCompressionWebSocketProtocol
+    return _protocol_class
+
+
+def __getattr__(name: str):
+    # Résolu par uvicorn via le chemin d'import de uvicorn_ws_options() (un par worker)
+    if name == "AdaptiveCompressionWebSocketProtocol":
+        return _adaptive_protocol_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def uvicorn_ws_options() -> Dict[str, Any]:
+    """Options uvicorn du proxy selon WS_COMPRESSION (chemin d'import: utilisable avec plusieurs workers)"""
+    if not COMPRESSION_ENABLED:
+        return {"ws_per_message_deflate": False}
+    # Échouer au démarrage plutôt qu'à la première connexion si uvicorn est trop ancien
+    _adaptive_protocol_class()
+    return {
+        "ws": "src.services.ws_compression:AdaptiveCompressionWebSocketProtocol",
+        "ws_per_message_deflate": True
+    }
+
+
+def get_compression(websocket) -> Dict[str, Any]:
+    """Métriques de compression d'une session Starlette"""
+    extension = websocket.scope.get("extensions", {}).get(SCOPE_KEY)
+    return extension.to_dict() if extension is not None else {"negotiated": False}
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# La base est choisie à l'import de src.models.lab: une base jetable pour ces tests
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test_labs.db')}"
+
+from src.main import app  # noqa: E402
+from src.models.lab import db, Lab, Machine, Snapshot, decode_json_column  # noqa: E402
+from src.services.performance_optimizer import performance_optimizer  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app.test_client()
+
+
+def _create_labs(labs, machines):
+    with app.app_context():
+        for i in range(labs):
+            lab = Lab(name=f"lab-{i}", provider="local", provider_config=json.dumps({"region": "eu"}))
+            db.session.add(lab)
+            db.session.flush()
+            for j in range(machines):
+                db.session.add(Machine(lab_id=lab.id, name=f"m-{i}-{j}", os="ubuntu",
+                                       software_config=json.dumps(["nginx"]),
+                                       custom_playbooks=json.dumps([1, 2])))
+            db.session.add(Snapshot(lab_id=lab.id, name=f"s-{i}", snapshot_data=json.dumps({"id": i})))
+        db.session.commit()
+
+
+def _count_statements(client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    # Le cache de réponses ne doit pas masquer les requêtes SQL
+    performance_optimizer.cache.clear()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize("url", ["/api/labs?limit=500", "/api/labs?limit=500&fields=id,name"])
+def test_list_labs_query_count_is_constant(client, url):
+    counts = []
+    for labs, machines in ((1, 1), (5, 3), (20, 5)):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        _create_labs(labs, machines)
+        count, body = _count_statements(client, url)
+        assert len(body) == labs
+        counts.append(count)
+    assert len(set(counts)) == 1, counts
+
+
+def test_get_lab_query_count_is_constant(client):
+    counts = []
+    for machines in (1, 10):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        _create_labs(1, machines)
+        with app.app_context():
+            lab_id = Lab.query.first().id
+        count, body = _count_statements(client, f"/api/labs/{lab_id}")
+        assert len(body["machines"]) == machines
+        counts.append(count)
+    assert counts[0] == counts[1], counts
+
+
+def test_decode_json_column_returns_independent_values():
+    raw = json.dumps({"packages": ["nginx"], "options": {"tls": True}})
+    first = decode_json_column(raw, dict)
+    first["packages"].append("redis")
+    first["options"]["tls"] = False
+    assert decode_json_column(raw, dict) == {"packages": ["nginx"], "options": {"tls": True}}
+    assert decode_json_column(None, list) == []